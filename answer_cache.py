@@ -0,0 +1,221 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+import metrics
+from config import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, SEMANTIC_CACHE_THRESHOLD, TOP_K
+from vector_math import normalize
+
+VERSION_CHECK_INTERVAL = 5.0  # Seconds between checks of the index files for a rebuild
+
+RE_SPACES = re.compile(r"\s+")
+RE_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+LOOKUPS = metrics.REGISTRY.counter("slm_answer_cache_lookups_total", "Answer cache lookups by result (exact, semantic, miss).")
+EVICTIONS = metrics.REGISTRY.counter("slm_answer_cache_evictions_total", "Cached answers dropped, by reason (size, ttl, version).")
+
+
+def normalize_question(question):
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a question."""
+    text = RE_SPACES.sub(" ", unicodedata.normalize("NFKC", question).lower()).strip()
+    return RE_TRAILING_PUNCTUATION.sub("", text)
+
+
+class _Entry:
+    __slots__ = ("answers", "expires", "slot")
+
+    def __init__(self, answers, expires, slot):
+        self.answers = answers
+        self.expires = expires
+        self.slot = slot
+
+
+class AnswerCache:
+    """
+    Two-level cache of answers in front of a RetrievalEngine (or ShardedRetriever).
+
+    Questions are first looked up by their normalized text in an LRU dict.
+    Misses are encoded and compared with the embeddings of every cached
+    question; one with cosine similarity of at least similarity_threshold
+    (and the same top_k and corpora) reuses its answer. Only questions missing
+    both levels are searched, with the embeddings already computed.
+
+    Entries expire after ttl seconds, the least recently used are evicted
+    beyond max_entries, and the whole cache is dropped when the engine's
+    index_version() changes (checked at most every version_check_interval
+    seconds), so a rebuilt index never serves stale answers.
+    """
+
+    def __init__(self, engine, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                 similarity_threshold=SEMANTIC_CACHE_THRESHOLD, semantic=True,
+                 version_check_interval=VERSION_CHECK_INTERVAL):
+        self.engine = engine
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.semantic = semantic
+        self.version_check_interval = version_check_interval
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+        self._entries = OrderedDict()  # key -> _Entry, least recently used first
+        self._vectors = None  # (max_entries, d) unit embeddings of cached questions, zero rows for free slots
+        self._slot_keys = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked = float("-inf")
+        self._generation = 0  # Bumped by every clear, so answers computed before one are not stored after it
+
+    def _remove(self, key, reason=None):
+        entry = self._entries.pop(key)
+        if entry.slot is not None:
+            self._vectors[entry.slot] = 0
+            self._slot_keys[entry.slot] = None
+            self._free_slots.append(entry.slot)
+        if reason is not None:
+            self.stats["expired" if reason == "ttl" else "evictions"] += 1
+            EVICTIONS.inc(reason=reason)
+
+    def _fresh(self, key, now):
+        """The live entry for key (marked as recently used), or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= now:
+            self._remove(key, "ttl")
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, answers, vector, now):
+        if key in self._entries:
+            self._remove(key)
+        while len(self._entries) >= self.max_entries:
+            self._remove(next(iter(self._entries)), "size")
+
+        slot = None
+        if vector is not None:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            slot = self._free_slots.pop()
+            self._vectors[slot] = vector
+            self._slot_keys[slot] = key
+        self._entries[key] = _Entry(answers, now + self.ttl, slot)
+
+    def _match(self, unit_embeddings, scope, now):
+        """Cached answers of the most similar live question with the same scope, per embedding (None if none)."""
+        matches = [None] * len(unit_embeddings)
+        if self._vectors is None or not self._entries:
+            return matches
+        similarities = unit_embeddings @ self._vectors.T
+        for i, row in enumerate(similarities):
+            candidates = np.flatnonzero(row >= self.similarity_threshold)
+            for slot in candidates[np.argsort(-row[candidates])]:
+                key = self._slot_keys[slot]
+                if key is None or key[1:] != scope:
+                    continue
+                entry = self._fresh(key, now)
+                if entry is not None:
+                    matches[i] = entry.answers
+                    break
+        return matches
+
+    def _check_version(self):
+        """Drops every entry if the engine's index files changed since the last check."""
+        now = time.monotonic()
+        if now - self._version_checked < self.version_check_interval:
+            return
+        self._version_checked = now
+        version = self.engine.index_version()
+        with self._lock:
+            if version != self._version:
+                if self._version is not None and self._entries:
+                    EVICTIONS.inc(len(self._entries), reason="version")
+                    self.stats["invalidations"] += 1
+                self._clear()
+                self._version = version
+
+    def _clear(self):
+        self._generation += 1
+        self._entries.clear()
+        self._vectors = None
+        self._slot_keys = [None] * self.max_entries
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def retrieve_best_sentences(self, queries, top_k=TOP_K, batch_size=32, **kwargs):
+        """
+        Same as the engine's retrieve_best_sentences, answering repeated and paraphrased questions from the cache.
+
+        Extra keyword arguments (e.g. corpora) are passed to the engine and are part of the cache key.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        self._check_version()
+
+        corpora = kwargs.get("corpora")
+        scope = (top_k, tuple(sorted(corpora)) if corpora else None)
+        keys = [(normalize_question(query),) + scope for query in queries]
+        results = [None] * len(queries)
+
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            for i, key in enumerate(keys):
+                entry = self._fresh(key, now)
+                if entry is not None:
+                    results[i] = entry.answers
+        missing = [i for i, answers in enumerate(results) if answers is None]
+        self._count("exact", len(queries) - len(missing))
+
+        embeddings = unit_embeddings = None
+        if missing and self.semantic:
+            with metrics.timer("encode", scope="answer_cache"):
+                embeddings = self.engine.model.encode([queries[i] for i in missing], batch_size=batch_size,
+                                                      convert_to_numpy=True)
+            unit_embeddings = normalize(embeddings)
+            with self._lock:
+                matches = self._match(unit_embeddings, scope, now)
+            rows = [row for row, answers in enumerate(matches) if answers is None]
+            for i, answers in zip(missing, matches):
+                results[i] = answers
+            self._count("semantic", len(missing) - len(rows))
+            missing = [missing[row] for row in rows]
+            embeddings, unit_embeddings = embeddings[rows], unit_embeddings[rows]
+        self._count("miss", len(missing))
+
+        if missing:
+            answers = self.engine.retrieve_best_sentences([queries[i] for i in missing], top_k=top_k,
+                                                          batch_size=batch_size, query_embeddings=embeddings, **kwargs)
+            now = time.monotonic()
+            with self._lock:
+                for row, (i, answer) in enumerate(zip(missing, answers)):
+                    results[i] = answer
+                    if self._generation == generation:  # Otherwise the index changed while answering: do not cache
+                        self._put(keys[i], answer, None if unit_embeddings is None else unit_embeddings[row], now)
+
+        return [list(answers) for answers in results]
+
+    def retrieve_best_sentence(self, query, top_k=TOP_K, **kwargs):
+        return self.retrieve_best_sentences([query], top_k=top_k, **kwargs)[0]
+
+    def _count(self, result, amount):
+        if amount:
+            LOOKUPS.inc(amount, result=result)
+            with self._lock:
+                self.stats["misses" if result == "miss" else f"{result}_hits"] += amount
+
+    def report(self):
+        """Entry count, hit rates and eviction counts."""
+        with self._lock:
+            stats = dict(self.stats)
+            entries = len(self._entries)
+        lookups = max(stats["exact_hits"] + stats["semantic_hits"] + stats["misses"], 1)
+        return {"entries": entries, "max_entries": self.max_entries, **stats,
+                "hit_rate": (stats["exact_hits"] + stats["semantic_hits"]) / lookups}
@@ -0,0 +1,312 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from config import data_paths
+from bm25 import BM25Index, tokenize
+from chunk_store import ChunkStore, write_chunk_store
+from chunks import load_chunks
+from index_factory import INDEX_TYPES, PRECISIONS, build_index, save_index
+from retrieval import RetrievalEngine
+from sentence_index import build_sentence_index, save_sentence_index
+from vector_math import normalize
+
+# Benchmark defaults
+NUM_CHUNKS = 2000  # Synthetic corpus size
+NUM_QUESTIONS = 200
+TOP_K = 5
+CONCURRENCY_LEVELS = (1, 4, 16)
+HASH_DIMENSION = 384  # Same width as all-MiniLM-L6-v2
+STAGES = ("encode", "faiss", "rerank", "lexical", "sentences")
+
+
+class HashingEncoder:
+    """
+    Deterministic bag-of-words encoder with SentenceTransformer's encode() interface.
+
+    Every term is hashed to a signed dimension, so vectors need no model
+    download and are identical across machines and runs. Texts sharing
+    terms get similar vectors, which is enough to exercise retrieval.
+    """
+
+    def __init__(self, dimension=HASH_DIMENSION):
+        self.dimension = dimension
+        self._slots = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def _slot(self, term):
+        slot = self._slots.get(term)
+        if slot is None:
+            value = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+            slot = self._slots[term] = (value % self.dimension, 1.0 if value >> 63 else -1.0)
+        return slot
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term in tokenize(text):
+                column, sign = self._slot(term)
+                vectors[row, column] += sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+        return vectors[0] if single else vectors
+
+
+def _word(rng, syllables):
+    return "".join(rng.choice(syllables, size=rng.integers(2, 4)))
+
+
+def synthetic_corpus(num_chunks=NUM_CHUNKS, num_questions=NUM_QUESTIONS, seed=0, topics=None):
+    """
+    Generates topical chunks and questions with known gold chunks.
+
+    Each chunk mixes words of one topic with common filler words, and each
+    question paraphrases a few words of one sentence of its gold chunk.
+    Returns (chunks, questions, gold_positions).
+    """
+    rng = np.random.default_rng(seed)
+    syllables = np.array([c + v for c in "bdfgklmnprstvz" for v in "aeiou"])
+    topics = topics or max(num_chunks // 10, 1)
+    common = [_word(rng, syllables) for _ in range(200)]
+    topic_words = [[_word(rng, syllables) for _ in range(30)] for _ in range(topics)]
+
+    chunks, chunk_sentences = [], []
+    for i in range(num_chunks):
+        words = topic_words[i % topics]
+        sentences = []
+        for _ in range(rng.integers(4, 9)):
+            length = rng.integers(8, 15)
+            picks = [rng.choice(words) if rng.random() < 0.6 else rng.choice(common) for _ in range(length)]
+            sentences.append(" ".join(picks).capitalize() + ".")
+        chunk_sentences.append(sentences)
+        chunks.append(" ".join(sentences))
+
+    gold = rng.choice(num_chunks, size=min(num_questions, num_chunks), replace=False)
+    questions = []
+    for position in gold:
+        sentence = tokenize(rng.choice(chunk_sentences[position]))
+        picks = rng.choice(sentence, size=min(5, len(sentence)), replace=False)
+        questions.append("What about " + " ".join(picks) + "?")
+    return chunks, questions, [int(p) for p in gold]
+
+
+def load_fixture(corpus_path, questions_path):
+    """Loads chunks (one per line) and JSONL questions of the form {"question": ..., "gold": chunk position}."""
+    chunks = load_chunks(corpus_path)
+    questions, gold = [], []
+    with open(questions_path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                questions.append(record["question"])
+                gold.append(int(record["gold"]))
+    return chunks, questions, gold
+
+
+def build_artifacts(chunks, encoder, data_dir, index_type="flat", precision="fp32"):
+    """Writes chunk store, FAISS index, sentence index and BM25 index into data_dir. Returns seconds per step."""
+    paths = data_paths(data_dir)
+    timings = {}
+
+    start = time.perf_counter()
+    write_chunk_store(chunks, paths["chunk_store"])
+    store = ChunkStore(paths["chunk_store"])
+    ids = np.array(store.ids)
+    timings["chunk_store"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectors = normalize(encoder.encode(chunks, batch_size=64, convert_to_numpy=True))
+    np.save(paths["embedding_vectors"], vectors)  # Full-precision copy for exact re-ranking
+    np.save(paths["embedding_ids"], ids)
+    index, build_params = build_index(vectors, index_type, ids=ids, precision=precision)
+    save_index(index, paths["embeddings_index"], index_type, build_params, id_scheme="content_hash")
+    timings["faiss_index"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):  # Keep stdout for the JSON report
+        sentences, offsets, embeddings, sentence_ids = build_sentence_index(chunks, encoder, ids=ids)
+    save_sentence_index(sentences, offsets, embeddings, sentence_ids, paths["sentence_embeddings"],
+                        paths["sentence_offsets"], paths["sentence_chunk_ids"], paths["sentences"])
+    timings["sentence_index"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    BM25Index.build(store, ids).save(paths["bm25"])
+    timings["bm25"] = time.perf_counter() - start
+    store.close()
+    return timings
+
+
+def percentiles(samples_seconds):
+    """p50/p95/p99/mean/max in milliseconds."""
+    if not samples_seconds:
+        return None
+    ms = np.asarray(samples_seconds) * 1000
+    return {"p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95)),
+            "p99": float(np.percentile(ms, 99)), "mean": float(ms.mean()), "max": float(ms.max()),
+            "count": int(ms.size)}
+
+
+def ranking_metrics(positions, gold, k):
+    """recall@k and MRR of the gold chunk positions in (N, k) retrieved positions."""
+    hits, reciprocal_ranks = [], []
+    for retrieved, target in zip(positions, gold):
+        ranks = np.flatnonzero(np.asarray(retrieved[:k]) == target)
+        hits.append(bool(ranks.size))
+        reciprocal_ranks.append(1.0 / (ranks[0] + 1) if ranks.size else 0.0)
+    return {f"recall@{k}": float(np.mean(hits)), "mrr": float(np.mean(reciprocal_ranks))}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, or None where it is not available."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 2**20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # Bytes on macOS, KiB on Linux
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(chunks, questions, gold, encoder, data_dir, index_type="flat", lexical_backend="bm25",
+                  top_k=TOP_K, repeat=1, concurrency_levels=CONCURRENCY_LEVELS, precision="fp32"):
+    """Builds the indexes, replays the questions and returns the report as a dict."""
+    build_times = build_artifacts(chunks, encoder, data_dir, index_type, precision)
+
+    stage_samples = {stage: [] for stage in STAGES}
+    engine = RetrievalEngine.from_data_dir(data_dir, model=encoder, lexical_backend=lexical_backend, verbose=False)
+    load_times = engine.warm_up()
+    if lexical_backend:
+        engine.lexical  # Loaded here so its load time is not counted as query latency
+
+    # Quality: one batched search over every question
+    _, positions = engine.search_chunks(questions, top_k=top_k)
+    quality = ranking_metrics(positions, gold, top_k)
+
+    # Latency: questions replayed one at a time, with per-stage timings
+    engine.stage_callback = lambda stage, seconds: stage_samples[stage].append(seconds)
+    latencies = []
+    for _ in range(repeat):
+        for question in questions:
+            start = time.perf_counter()
+            engine.retrieve_best_sentence(question, top_k=top_k)
+            latencies.append(time.perf_counter() - start)
+    engine.stage_callback = None
+
+    # Throughput: the same replay from several client threads
+    throughput = []
+    workload = questions * repeat
+    for concurrency in concurrency_levels:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda q: engine.retrieve_best_sentence(q, top_k=top_k), workload))
+            elapsed = time.perf_counter() - start
+        throughput.append({"concurrency": concurrency, "qps": len(workload) / elapsed, "seconds": elapsed})
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "config": {"index_type": index_type, "precision": precision, "lexical_backend": lexical_backend or None, "top_k": top_k,
+                   "repeat": repeat, "encoder": type(encoder).__name__,
+                   "chunks": len(chunks), "questions": len(questions)},
+        "build_seconds": build_times,
+        "load_seconds": load_times,
+        "quality": quality,
+        "latency_ms": percentiles(latencies),
+        "stages_ms": {stage: percentiles(samples) for stage, samples in stage_samples.items()},
+        "throughput": throughput,
+        "backends": engine.latency_report(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def format_summary(report):
+    config, quality = report["config"], report["quality"]
+    lines = [f"📊 {config['chunks']} chunks, {config['questions']} questions, {config['index_type']} {config['precision']} index, "
+             f"lexical={config['lexical_backend']}"]
+    lines.append("   " + "  ".join(f"{name}={value:.3f}" for name, value in quality.items()))
+    latency = report["latency_ms"]
+    lines.append(f"   latency  p50={latency['p50']:.2f}ms  p95={latency['p95']:.2f}ms  p99={latency['p99']:.2f}ms")
+    for stage, stats in report["stages_ms"].items():
+        if stats:
+            lines.append(f"   {stage:<9} p50={stats['p50']:.3f}ms  p95={stats['p95']:.3f}ms")
+    for row in report["throughput"]:
+        lines.append(f"   {row['concurrency']:>3} threads: {row['qps']:.1f} QPS")
+    if report["peak_rss_mb"] is not None:
+        lines.append(f"   peak RSS {report['peak_rss_mb']:.1f} MB")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark: latency, throughput, memory and recall.")
+    parser.add_argument("--chunks", type=int, default=NUM_CHUNKS, help="Synthetic corpus size.")
+    parser.add_argument("--questions", type=int, default=NUM_QUESTIONS, help="Synthetic questions.")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic corpus seed.")
+    parser.add_argument("--corpus", help="Fixture chunks file (one chunk per line) instead of the synthetic corpus.")
+    parser.add_argument("--questions-file", help="Fixture JSONL questions {\"question\", \"gold\"} for --corpus.")
+    parser.add_argument("--model", help="Benchmark a SentenceTransformer model instead of the offline hashing encoder.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="FAISS index type.")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32", help="Vector storage precision of the index.")
+    parser.add_argument("--lexical", choices=["bm25", ""], default="bm25", help="Lexical backend ('' for FAISS only).")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="Chunks retrieved per question.")
+    parser.add_argument("--repeat", type=int, default=1, help="Times the question set is replayed.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=list(CONCURRENCY_LEVELS), help="Client threads for QPS.")
+    parser.add_argument("--data-dir", help="Where to build the indexes (default: a temporary directory).")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout).")
+    args = parser.parse_args()
+
+    if args.corpus:
+        if not args.questions_file:
+            parser.error("--corpus needs --questions-file")
+        chunks, questions, gold = load_fixture(args.corpus, args.questions_file)
+    else:
+        chunks, questions, gold = synthetic_corpus(args.chunks, args.questions, args.seed)
+
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+
+        encoder = SentenceTransformer(args.model)
+    else:
+        encoder = HashingEncoder()
+
+    with tempfile.TemporaryDirectory(prefix="slm_benchmark_", ignore_cleanup_errors=True) as temp_dir:
+        data_dir = args.data_dir or temp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        report = run_benchmark(chunks, questions, gold, encoder, data_dir, args.index_type, args.lexical,
+                               args.top_k, args.repeat, args.concurrency, args.precision)
+
+    print(format_summary(report), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"✅ Report written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import json
+import os
+import re
+from array import array
+import numpy as np
+
+# Paths
+CHUNK_STORE_PATH = "K:/slm_project/data/chunks"
+BM25_PATH = "K:/slm_project/data/bm25"  # Prefix of the bm25.* index files
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercased alphanumeric terms."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def index_paths(prefix):
+    """Files making up a BM25 index."""
+    return {
+        "meta": prefix + ".json",
+        "terms": prefix + ".terms.txt",  # One term per line, line number = term ID
+        "term_offsets": prefix + ".term_offsets.npy",  # int64, V + 1 offsets into the postings
+        "doc_ids": prefix + ".doc_ids.npy",  # int32, document of each posting, grouped by term
+        "impacts": prefix + ".impacts.npy",  # float32, precomputed BM25 term score of each posting
+        "chunk_ids": prefix + ".chunk_ids.npy",  # int64, chunk content ID of each document
+    }
+
+
+class BM25Index:
+    """
+    In-process BM25 inverted index over the chunk store.
+
+    Postings are stored term-major in flat NumPy arrays (CSR layout), and
+    each posting holds its full BM25 term score, precomputed at build time.
+    A query is then a gather of a few posting slices plus one weighted
+    bincount, with no per-document Python work. Saved indexes are loaded
+    memory-mapped, so opening is cheap and processes share the pages.
+    """
+
+    name = "bm25"
+
+    def __init__(self, terms, term_offsets, doc_ids, impacts, chunk_ids, meta):
+        self.vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.impacts = impacts
+        self.chunk_ids = chunk_ids
+        self.meta = meta
+        self.num_docs = len(chunk_ids)
+
+    @classmethod
+    def build(cls, texts, ids, k1=K1, b=B):
+        """Builds an index from chunk texts and their content IDs."""
+        vocabulary = {}
+        posting_terms, posting_docs, posting_tfs = array("i"), array("i"), array("f")
+        doc_lengths = array("f")
+
+        for doc, text in enumerate(texts):
+            counts = {}
+            tokens = tokenize(text)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                posting_terms.append(vocabulary.setdefault(token, len(vocabulary)))
+                posting_docs.append(doc)
+                posting_tfs.append(count)
+            doc_lengths.append(len(tokens))
+
+        num_docs = len(doc_lengths)
+        doc_lengths = np.frombuffer(doc_lengths, dtype=np.float32)
+        average_length = float(doc_lengths.mean()) if num_docs else 0.0
+
+        # Group postings by term (stable, so documents stay in order within a term)
+        terms = np.frombuffer(posting_terms, dtype=np.int32)
+        order = np.argsort(terms, kind="stable")
+        doc_ids = np.frombuffer(posting_docs, dtype=np.int32)[order]
+        tfs = np.frombuffer(posting_tfs, dtype=np.float32)[order]
+        document_frequencies = np.bincount(terms, minlength=len(vocabulary))
+        term_offsets = np.concatenate([[0], np.cumsum(document_frequencies)]).astype(np.int64)
+
+        idf = np.log1p((num_docs - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        norms = k1 * (1 - b + b * doc_lengths[doc_ids] / max(average_length, 1e-9))
+        impacts = (np.repeat(idf, document_frequencies) * tfs * (k1 + 1) / (tfs + norms)).astype(np.float32)
+
+        meta = {"k1": k1, "b": b, "num_docs": num_docs, "average_length": average_length}
+        return cls(list(vocabulary), term_offsets, doc_ids, impacts, np.asarray(ids, dtype=np.int64), meta)
+
+    def save(self, prefix=BM25_PATH):
+        paths = index_paths(prefix)
+        with open(paths["terms"], "w", encoding="utf-8") as file:
+            file.write("\n".join(sorted(self.vocabulary, key=self.vocabulary.get)))
+        np.save(paths["term_offsets"], self.term_offsets)
+        np.save(paths["doc_ids"], self.doc_ids)
+        np.save(paths["impacts"], self.impacts)
+        np.save(paths["chunk_ids"], self.chunk_ids)
+        with open(paths["meta"], "w", encoding="utf-8") as file:
+            json.dump(self.meta, file, indent=2)
+
+    @classmethod
+    def load(cls, prefix=BM25_PATH):
+        """Opens a saved index; postings are memory-mapped, only the vocabulary is read into memory."""
+        paths = index_paths(prefix)
+        for path in paths.values():
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"❌ BM25 index file not found: {path} (run bm25.py)")
+
+        with open(paths["terms"], "r", encoding="utf-8") as file:
+            terms = file.read().split("\n") if os.path.getsize(paths["terms"]) else []
+        with open(paths["meta"], "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        return cls(terms,
+                   np.load(paths["term_offsets"], mmap_mode="r"),
+                   np.load(paths["doc_ids"], mmap_mode="r"),
+                   np.load(paths["impacts"], mmap_mode="r"),
+                   np.load(paths["chunk_ids"], mmap_mode="r"),
+                   meta)
+
+    def score(self, query):
+        """Returns (doc positions, BM25 scores) of every document matching at least one query term."""
+        term_ids = {self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary}
+        if not term_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        slices = [slice(self.term_offsets[t], self.term_offsets[t + 1]) for t in term_ids]
+        docs = np.concatenate([self.doc_ids[s] for s in slices])
+        impacts = np.concatenate([self.impacts[s] for s in slices])
+
+        # Dense accumulation when the postings cover a good part of the corpus, sparse otherwise
+        if len(docs) * 8 >= self.num_docs:
+            scores = np.bincount(docs, weights=impacts, minlength=self.num_docs)
+            matched = np.flatnonzero(scores)
+            return matched, scores[matched]
+        matched, inverse = np.unique(docs, return_inverse=True)
+        return matched, np.bincount(inverse, weights=impacts)
+
+    def search_positions(self, query, top_k):
+        """Top documents of one query as [(position, score)], best first."""
+        docs, scores = self.score(query)
+        if len(docs) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            docs, scores = docs[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        return [(int(docs[i]), float(scores[i])) for i in order]
+
+    def search(self, queries, top_k, timeout=None):
+        """
+        Lexical backend interface, same as ElasticsearchBackend.search.
+
+        Returns, for each query, [(chunk_id, score)] best first. timeout is
+        accepted for compatibility; in-process queries do not need one.
+        """
+        return [[(int(self.chunk_ids[position]), score) for position, score in self.search_positions(query, top_k)]
+                for query in queries]
+
+
+if __name__ == "__main__":
+    from chunk_store import ChunkStore
+
+    print("📂 Opening chunk store...")
+    store = ChunkStore(CHUNK_STORE_PATH)
+
+    print("🔍 Building BM25 index...")
+    index = BM25Index.build(store, store.ids)
+
+    print("💾 Saving BM25 index...")
+    index.save()
+
+    print(f"✅ BM25 index with {len(index.vocabulary)} terms over {index.num_docs} chunks saved to: {BM25_PATH}.*")
@@ -0,0 +1,133 @@
+import argparse
+import json
+import numpy as np
+from chunks import chunk_id
+from config import DATA_DIR, RETRIEVAL_MIN_SCORE, RETRIEVAL_SCORE_GAP, TOP_K, data_paths
+from retrieval import RetrievalEngine, adaptive_keep
+
+TARGET_RECALL = 0.95  # Share of answerable questions whose gold chunk must survive each threshold
+
+
+def load_labeled_questions(path):
+    """
+    Reads JSONL of {"question": ..., "gold": chunk ID} or {"question": ..., "gold_text": chunk text}.
+
+    Gold chunks are named by content ID (chunks.chunk_id), which survives
+    re-ingesting and deduplication, unlike chunk positions. A question with
+    neither field (or a null one) is unanswerable. Returns the questions
+    and their gold chunk IDs (None if unanswerable).
+    """
+    questions, gold = [], []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                questions.append(record["question"])
+                if record.get("gold") is not None:
+                    gold.append(int(record["gold"]))
+                elif record.get("gold_text") is not None:
+                    gold.append(chunk_id(record["gold_text"]))
+                else:
+                    gold.append(None)
+    return questions, gold
+
+
+def gold_positions(engine, gold):
+    """Maps gold chunk IDs to positions in the engine's chunk store (-1 where the chunk is gone)."""
+    ids = [cid for cid in gold if cid is not None]
+    positions = iter(engine.chunk_lookup.positions(np.array(ids, dtype=np.int64)).tolist() if ids else [])
+    return [None if cid is None else next(positions) for cid in gold]
+
+
+def score_questions(engine, questions, top_k=TOP_K, batch_size=64):
+    """Best-first chunk positions and cosine similarities of every question, without adaptive cutting."""
+    adaptive, engine.adaptive = engine.adaptive, False
+    try:
+        _, positions, scores = engine.search_scored(questions, top_k, batch_size)
+    finally:
+        engine.adaptive = adaptive
+    return positions, scores
+
+
+def calibrate(positions, scores, gold, target_recall=TARGET_RECALL):
+    """
+    Picks min_score and score_gap from the scores of labeled questions (gold: chunk positions, None if unanswerable).
+
+    The highest min_score that target_recall of the answerable questions'
+    best chunks still reach rejects the most unanswerable questions at that
+    recall. Any lower threshold above the best unanswerable score beneath
+    it rejects the same ones, so min_score sits midway in that margin,
+    keeping more answerable questions. score_gap is the smallest gap below
+    the best chunk that target_recall of the gold chunks found in the top k
+    fall within. Returns both with the recall and work they lead to.
+    """
+    answerable = np.array([g is not None for g in gold])
+    best = scores[:, 0]
+    gold_rows = [(q, np.flatnonzero(positions[q] == g)) for q, g in enumerate(gold) if g is not None]
+    gaps = np.array([best[q] - scores[q, hits[0]] for q, hits in gold_rows if hits.size])
+
+    min_score = RETRIEVAL_MIN_SCORE
+    if answerable.any():
+        answerable_best = np.sort(best[answerable])
+        min_score = float(answerable_best[len(answerable_best) - int(np.ceil(target_recall * len(answerable_best)))])
+        rejected = best[~answerable][best[~answerable] < min_score]
+        if rejected.size:
+            min_score = float((rejected.max() + min_score) / 2)
+    score_gap = float(np.quantile(gaps, target_recall)) if gaps.size else RETRIEVAL_SCORE_GAP
+
+    keep = adaptive_keep(scores, min_score, score_gap) & (positions >= 0)
+    misses = ~keep[:, 0]
+    kept_gold = [hits.size and keep[q, hits[0]] for q, hits in gold_rows]
+    return {
+        "min_score": round(min_score, 4),
+        "score_gap": round(score_gap, 4),
+        "target_recall": target_recall,
+        "top_k": positions.shape[1],
+        "questions": len(gold),
+        "answerable": int(answerable.sum()),
+        "gold_in_top_k": float(gaps.size / max(answerable.sum(), 1)),
+        "gold_kept": float(np.mean(kept_gold)) if kept_gold else 0.0,
+        "answerable_missed": float(misses[answerable].mean()) if answerable.any() else 0.0,
+        "unanswerable_rejected": float(misses[~answerable].mean()) if (~answerable).any() else None,
+        "mean_chunks_kept": float(keep.sum(axis=1).mean()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate adaptive retrieval thresholds on a labeled question set.")
+    parser.add_argument("questions", help="JSONL {\"question\", \"gold\": chunk ID or \"gold_text\"}, neither if unanswerable.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Data directory of the index to calibrate.")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="Chunks fetched per question (the adaptive upper bound).")
+    parser.add_argument("--target-recall", type=float, default=TARGET_RECALL, help="Share of gold chunks each threshold must keep.")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the thresholds, do not save them.")
+    args = parser.parse_args()
+
+    questions, gold = load_labeled_questions(args.questions)
+    engine = RetrievalEngine.from_data_dir(args.data_dir, lexical_backend="")  # Thresholds apply to vector similarities
+    if engine.metric != "ip":
+        raise SystemExit("❌ Adaptive retrieval needs an inner product (cosine) index, rebuild with --metric ip")
+    gold = gold_positions(engine, gold)
+    missing = {q for q, position in enumerate(gold) if position == -1}
+    if missing:
+        print(f"⚠️ Skipping {len(missing)} questions whose gold chunk is not in the index (relabel them)")
+        questions = [question for q, question in enumerate(questions) if q not in missing]
+        gold = [position for position in gold if position != -1]
+    if not questions:
+        raise SystemExit("❌ No labeled questions left to calibrate on")
+
+    print(f"🔍 Scoring {len(questions)} labeled questions...")
+    positions, scores = score_questions(engine, questions, args.top_k)
+    report = calibrate(positions, scores, gold, args.target_recall)
+
+    print(f"📊 min_score={report['min_score']}  score_gap={report['score_gap']}")
+    print(f"   gold chunk in top {report['top_k']}: {report['gold_in_top_k']:.1%}, kept after the cut: {report['gold_kept']:.1%}")
+    print(f"   answerable answered as misses: {report['answerable_missed']:.1%}")
+    if report["unanswerable_rejected"] is not None:
+        print(f"   unanswerable rejected early: {report['unanswerable_rejected']:.1%}")
+    print(f"   chunks processed per question: {report['mean_chunks_kept']:.2f} (of {report['top_k']})")
+
+    if not args.dry_run:
+        path = data_paths(args.data_dir)["retrieval_calibration"]
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"✅ Thresholds saved to {path}")
@@ -1,8 +1,10 @@
+import os
 import faiss
 import numpy as np
 
 # Path to stored FAISS index
 EMBEDDING_PATH = "K:/slm_project/data/embeddings.index"
+IDS_PATH = "K:/slm_project/data/embeddings.ids.npy"  # Chunk IDs, for indexes built with content IDs
 
 # Load the FAISS index
 print("📥 Loading FAISS index...")
@@ -17,7 +19,14 @@ print("🔍 Retrieving sample embeddings...")
 
 # FAISS doesn't support direct retrieval for IndexFlatL2, so we use reconstruct_n
 sample_size = min(3, num_vectors)  # Limit to available vectors
-embeddings = np.array([index.reconstruct(i) for i in range(sample_size)])
+sample_ids = np.load(IDS_PATH)[:sample_size] if os.path.exists(IDS_PATH) else range(sample_size)
+
+# IVF indexes need an ID → list lookup before they can reconstruct by ID
+ivf = faiss.try_extract_index_ivf(index)
+if ivf is not None:
+    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+embeddings = np.array([index.reconstruct(int(i)) for i in sample_ids])
 
 # Print first 3 embeddings
 print("\n📌 Sample Embeddings (First 3 rows):")
@@ -0,0 +1,156 @@
+import mmap
+import os
+from array import array
+import numpy as np
+from chunks import ChunkIdLookup, chunk_id, load_chunks
+
+# Paths
+DATA_PATH = "K:/slm_project/data/tokenized_chunks.txt"
+CHUNK_STORE_PATH = "K:/slm_project/data/chunks"  # Prefix of chunks.bin / chunks.offsets.npy / chunks.ids.npy / chunks.order.npy
+
+
+def store_paths(prefix):
+    """Files making up a chunk store."""
+    return {
+        "blob": prefix + ".bin",  # UTF-8 text of every chunk, back to back
+        "offsets": prefix + ".offsets.npy",  # int64, n + 1 byte offsets into the blob
+        "ids": prefix + ".ids.npy",  # int64 content ID of each chunk
+        "order": prefix + ".order.npy",  # (2, n): IDs in sorted order and their positions, for ID lookups
+    }
+
+
+class ChunkStoreWriter:
+    """Appends chunks to a new chunk store one at a time, without holding their text in memory."""
+
+    def __init__(self, prefix=CHUNK_STORE_PATH):
+        self.paths = store_paths(prefix)
+        self._blob = open(self.paths["blob"] + ".tmp", "wb")
+        self._offsets = array("q", [0])
+        self._ids = array("q")
+
+    def append(self, text, cid=None):
+        """Adds a chunk and returns its position."""
+        text = text.strip()
+        data = text.encode("utf-8")
+        self._blob.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        self._ids.append(chunk_id(text) if cid is None else cid)
+        return len(self._ids) - 1
+
+    def close(self):
+        """Writes the offsets and ID tables and atomically replaces any previous store."""
+        self._blob.close()
+        ids = np.frombuffer(self._ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        np.save(self.paths["offsets"] + ".tmp.npy", np.frombuffer(self._offsets, dtype=np.int64))
+        np.save(self.paths["ids"] + ".tmp.npy", ids)
+        np.save(self.paths["order"] + ".tmp.npy", np.stack([ids[order], order]))
+
+        os.replace(self.paths["blob"] + ".tmp", self.paths["blob"])
+        for name in ("offsets", "ids", "order"):
+            os.replace(self.paths[name] + ".tmp.npy", self.paths[name])
+        return len(ids)
+
+    def abort(self):
+        """Closes and deletes the partly written files, leaving any previous store untouched."""
+        self._blob.close()
+        for path in [self.paths["blob"] + ".tmp"] + [self.paths[name] + ".tmp.npy" for name in ("offsets", "ids", "order")]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_chunk_store(text_chunks, prefix=CHUNK_STORE_PATH):
+    """Writes a list (or any iterable) of chunks as a chunk store."""
+    writer = ChunkStoreWriter(prefix)
+    for text in text_chunks:
+        writer.append(text)
+    return writer.close()
+
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped chunk store.
+
+    The text blob and the offset / ID tables are mapped rather than read, so
+    opening is O(1) regardless of corpus size, a chunk is fetched by position
+    with two offset reads and one slice, and every process that opens the
+    same store shares its pages through the OS page cache.
+    """
+
+    def __init__(self, prefix=CHUNK_STORE_PATH):
+        self.paths = store_paths(prefix)
+        for path in self.paths.values():
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"❌ Chunk store file not found: {path} (run chunk_store.py)")
+
+        self.offsets = np.load(self.paths["offsets"], mmap_mode="r")
+        self.ids = np.load(self.paths["ids"], mmap_mode="r")
+        order = np.load(self.paths["order"], mmap_mode="r")
+        self._lookup = ChunkIdLookup(self.ids, sorted_ids=order[0], order=order[1])
+
+        self._file = open(self.paths["blob"], "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        if len(self.offsets) != len(self.ids) + 1 or self.offsets[-1] != size:
+            raise ValueError(f"❌ Chunk store {prefix} is inconsistent, rebuild it with chunk_store.py")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("chunk position out of range")
+        return self._blob[self.offsets[position]:self.offsets[position + 1]].decode("utf-8")
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    @property
+    def lookup(self):
+        """ChunkIdLookup over this store's IDs."""
+        return self._lookup
+
+    def positions(self, ids):
+        """Positions of chunks by content ID (-1 where unknown)."""
+        return self._lookup.positions(ids)
+
+    def get_by_id(self, cid):
+        """Text of the chunk with this content ID, or None."""
+        position = int(self.positions([cid])[0])
+        return self[position] if position >= 0 else None
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+if __name__ == "__main__":
+    print("📂 Loading tokenized chunks...")
+    text_chunks = load_chunks(DATA_PATH)
+
+    print("💾 Writing chunk store...")
+    count = write_chunk_store(text_chunks)
+
+    print(f"✅ Chunk store with {count} chunks saved to: {CHUNK_STORE_PATH}.bin")
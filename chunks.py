@@ -0,0 +1,66 @@
+import hashlib
+import os
+import numpy as np
+
+
+def load_chunks(file_path):
+    """
+    Load non-empty text chunks from tokenized_chunks.txt.
+
+    save_chunks() separates chunks with blank lines; every stage (embedding,
+    sentence index, retrieval) must skip them the same way so positions agree.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def indexed_chunks_path(path):
+    """
+    The chunks file to index for tokenized chunks at path.
+
+    That is dedup.py's output next to it (NAME.dedup.txt) when it was written
+    after the chunks, otherwise path itself.
+    """
+    deduplicated = os.path.splitext(path)[0] + ".dedup.txt"
+    if os.path.exists(deduplicated) and (not os.path.exists(path)
+                                         or os.path.getmtime(deduplicated) >= os.path.getmtime(path)):
+        return deduplicated
+    return path
+
+
+def chunk_id(text):
+    """Stable 63-bit ID of a chunk, derived from its content (fits FAISS int64 labels)."""
+    digest = hashlib.blake2b(text.strip().encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & 0x7FFFFFFFFFFFFFFF
+
+
+def chunk_ids(text_chunks):
+    """Content IDs of a list of chunks, as an int64 array aligned with the list."""
+    return np.fromiter((chunk_id(text) for text in text_chunks), dtype=np.int64, count=len(text_chunks))
+
+
+class ChunkIdLookup:
+    """Maps chunk IDs back to positions in the chunk list with a vectorized sorted-array search."""
+
+    def __init__(self, ids, sorted_ids=None, order=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        if order is None:
+            # Stable sort keeps the first position of duplicate chunks
+            order = np.argsort(self.ids, kind="stable")
+            sorted_ids = self.ids[order]
+        self._order = order
+        self._sorted_ids = sorted_ids
+
+    def __len__(self):
+        return len(self._sorted_ids)
+
+    def positions(self, ids):
+        """Positions of the given IDs; unknown IDs (including FAISS's -1 padding) map to -1."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+
+        slots = np.searchsorted(self._sorted_ids, ids)
+        slots = np.minimum(slots, len(self._sorted_ids) - 1)
+        found = self._sorted_ids[slots] == ids
+        return np.where(found, self._order[slots], -1)
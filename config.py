@@ -6,11 +6,40 @@ DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "data"))  # Data folder
 MODEL_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "models"))  # Model folder
 
 BOOK_PATH = os.path.join(DATA_DIR, "india2020.pdf")  # Path to the book file
+SHARDS_DIR = os.path.join(DATA_DIR, "corpora")  # One data directory per corpus (book), see shards.py
 MODEL_PATH = os.path.join(MODEL_DIR, "slm_model.pth")  # Model save path
 
+# === DATA FILES ===
+def data_paths(data_dir=DATA_DIR):
+    """Locations of every pipeline artifact inside a data directory."""
+    return {
+        "extracted_text": os.path.join(data_dir, "extracted_text_cleaned.txt"),
+        "preprocessed_text": os.path.join(data_dir, "preprocessed_text.txt"),
+        "tokenized_chunks": os.path.join(data_dir, "tokenized_chunks.txt"),
+        "deduplicated_chunks": os.path.join(data_dir, "tokenized_chunks.dedup.txt"),  # Kept chunks written by dedup.py
+        "chunk_store": os.path.join(data_dir, "chunks"),  # Prefix of the chunk store files
+        "chunk_sources": os.path.join(data_dir, "chunk_sources.npy"),  # Kept chunk ID of every source chunk (dedup.py)
+        "embeddings_index": os.path.join(data_dir, "embeddings.index"),
+        "embedding_vectors": os.path.join(data_dir, "embeddings.vectors.npy"),
+        "embedding_ids": os.path.join(data_dir, "embeddings.ids.npy"),
+        "index_bundle": os.path.join(data_dir, "index_bundle"),  # Memory-mappable copy of the index (index_bundle.py)
+        "retrieval_calibration": os.path.join(data_dir, "retrieval_calibration.json"),  # calibrate_retrieval.py
+        "sentence_embeddings": os.path.join(data_dir, "sentence_embeddings.npy"),
+        "sentence_offsets": os.path.join(data_dir, "sentence_offsets.npy"),
+        "sentence_chunk_ids": os.path.join(data_dir, "sentence_chunk_ids.npy"),
+        "sentences": os.path.join(data_dir, "sentences.txt"),
+        "bm25": os.path.join(data_dir, "bm25"),  # Prefix of the BM25 index files
+    }
+
 # === EMBEDDING CONFIGURATION ===
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"  # SBERT model used for chunk, sentence and question embeddings
 EMBEDDING_DIM = 768  # Dimension of word embeddings (e.g., BERT)
 MAX_TOKENS = 512  # Maximum tokens per input (truncate if longer)
+EMBEDDING_MAX_TOKENS = 256  # Encoder window of the SBERT model in wordpieces, including [CLS] and [SEP]
+ENCODER_BACKEND = os.environ.get("SLM_ENCODER_BACKEND", "torch")  # "torch", "torch_int8", "onnx" or "onnx_int8" (see encoders.py)
+ENCODER_THREADS = int(os.environ.get("SLM_ENCODER_THREADS", "0"))  # Intra-op threads of the encoder, 0 = library default
+ENCODER_PARITY_TOLERANCE = 0.99  # Lowest cosine similarity to the torch embeddings a backend may produce
+ONNX_DIR = os.path.join(MODEL_DIR, "onnx")  # Exported ONNX encoders, one folder per model
 
 # === TRAINING HYPERPARAMETERS ===
 BATCH_SIZE = 16  # Batch size for training
@@ -18,13 +47,30 @@ EPOCHS = 5  # Number of epochs for training
 LEARNING_RATE = 3e-5  # Learning rate
 
 # === RETRIEVAL SETTINGS ===
-TOP_K = 5  # Number of top retrieved passages for QA
+TOP_K = 5  # Most chunks retrieved per question; adaptive retrieval usually processes fewer
+RETRIEVAL_MIN_SCORE = 0.15  # Cosine similarity the best chunk needs, below it a question is answered as a miss at once
+RETRIEVAL_SCORE_GAP = 0.2  # Chunks scoring this far below the best one are dropped (see calibrate_retrieval.py)
+LEXICAL_BACKEND = os.environ.get("SLM_LEXICAL_BACKEND", "elasticsearch")  # "elasticsearch", "bm25" (in-process) or "" for FAISS only
+SHARD_MEMORY_BUDGET_MB = int(os.environ.get("SLM_SHARD_MEMORY_MB", "4096"))  # Resident shards are evicted (LRU) beyond this
+SHARD_SEARCH_THREADS = 8  # Shards searched in parallel per query batch
+ANSWER_CACHE_SIZE = 4096  # Answers kept by the question cache (answer_cache.py)
+ANSWER_CACHE_TTL = 3600.0  # Seconds a cached answer stays valid
+SEMANTIC_CACHE_THRESHOLD = 0.95  # Cosine similarity above which a paraphrased question reuses a cached answer
+SENTENCES_PER_CHUNK = 2  # Answer sentences returned per retrieved chunk, picked globally across chunks (rerank.py)
+ANSWER_MIN_SCORE = 0.2  # Cosine similarity the best sentence needs, below it the fallback response is used
+CROSS_ENCODER_MODEL = os.environ.get("SLM_CROSS_ENCODER", "")  # e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2", "" to skip
+RERANK_CANDIDATES = 20  # Sentences per question re-scored by the cross-encoder
+RERANK_TIME_BUDGET_MS = 50.0  # Cross-encoder time per question, beyond which the bi-encoder ranking is kept
 
 # === TOKENIZATION CONFIGURATION ===
 TOKENIZER_MODEL = "bert-base-uncased"  # Model name for tokenizer
+CHUNK_TOKENIZER_MODEL = f"sentence-transformers/{EMBEDDING_MODEL_NAME}"  # Tokenizer chunk lengths are measured with
+CHUNK_MAX_TOKENS = min(MAX_TOKENS, EMBEDDING_MAX_TOKENS) - 2  # Largest chunk that is embedded without truncation
+CHUNK_OVERLAP_TOKENS = 50  # Tokens of trailing sentences repeated at the start of the next chunk
+DEDUP_THRESHOLD = 0.8  # Estimated Jaccard similarity (MinHash) at which chunks collapse into one, see dedup.py
 
 # === DEBUG SETTINGS ===
-DEBUG_MODE = True  # Set to False to disable debug prints
+DEBUG_MODE = os.environ.get("SLM_DEBUG", "0") == "1"  # Set SLM_DEBUG=1 to enable debug prints
 
 # Print verification only if executed directly
 if __name__ == "__main__" or DEBUG_MODE:
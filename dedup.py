@@ -0,0 +1,163 @@
+import argparse
+import os
+import re
+import zlib
+from array import array
+import numpy as np
+from bm25 import tokenize
+from chunks import chunk_id, load_chunks
+from config import DATA_DIR, DEDUP_THRESHOLD, data_paths
+
+# MinHash / LSH settings
+NUM_PERM = 128  # Hash functions per signature
+LSH_BANDS = 16  # Bands of NUM_PERM // LSH_BANDS rows; chunks sharing one band are compared (~0.7 Jaccard)
+SHINGLE_SIZE = 5  # Words per shingle
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+RE_NON_WORD = re.compile(r"[^\w\s]")
+RE_SPACES = re.compile(r"\s+")
+
+
+class MinHasher:
+    """MinHash signatures of word shingles, with NUM_PERM universal hash functions."""
+
+    def __init__(self, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=1):
+        rng = np.random.default_rng(seed)
+        # Below 2**32, so a * hash + b stays within uint64
+        self.a = rng.integers(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.shingle_size = shingle_size
+
+    def shingles(self, text):
+        """CRC32 hashes of the distinct word shingles of a text (a shorter text is one shingle)."""
+        words = tokenize(text)
+        k = self.shingle_size
+        grams = [" ".join(words[i:i + k]) for i in range(max(len(words) - k + 1, 1))] if words else []
+        return np.fromiter({zlib.crc32(gram.encode("utf-8")) for gram in grams}, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = self.shingles(text)
+        if not hashes.size:
+            return np.full(len(self.a), MAX_HASH, dtype=np.uint32)
+        values = (np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        return values.min(axis=1).astype(np.uint32)
+
+
+class NearDuplicateFilter:
+    """
+    Streaming near-duplicate detection with MinHash and LSH banding.
+
+    Every chunk passed to add() is either kept, or collapsed into the kept
+    chunk whose estimated Jaccard similarity (share of equal signature
+    values) is at least threshold. Only kept chunks whose signature shares
+    an LSH band with the new one are compared, so each add() costs about
+    the same however many chunks came before.
+
+    sources records, for every chunk in input order, the content ID of the
+    kept chunk it ended up in, so every indexed chunk maps back to all of
+    its source positions.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=NUM_PERM, bands=LSH_BANDS, shingle_size=SHINGLE_SIZE):
+        if num_perm % bands:
+            raise ValueError(f"❌ num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.rows = num_perm // bands
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []  # Signature of every kept chunk
+        self.kept_ids = array("q")
+        self.sources = array("q")
+        self.duplicates = 0
+
+    def add(self, text, cid=None):
+        """Returns True if the chunk is kept, False if it collapsed into an earlier one."""
+        cid = chunk_id(text) if cid is None else cid
+        signature = self.hasher.signature(text)
+        keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(len(self._buckets))]
+
+        best, best_similarity = None, 0.0
+        candidates = {kept for bucket, key in zip(self._buckets, keys) for kept in bucket.get(key, ())}
+        for kept in candidates:
+            similarity = np.count_nonzero(self._signatures[kept] == signature) / len(signature)
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = kept, similarity
+
+        if best is not None:
+            self.sources.append(self.kept_ids[best])
+            self.duplicates += 1
+            return False
+
+        kept = len(self._signatures)
+        self._signatures.append(signature)
+        self.kept_ids.append(cid)
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(kept)
+        self.sources.append(cid)
+        return True
+
+    def filter(self, texts):
+        """Yields the kept texts of a stream of chunks."""
+        for text in texts:
+            text = text.strip()
+            if self.add(text):
+                yield text
+
+    def save(self, path):
+        """Writes the source mapping: the kept chunk ID of every input chunk, in input order."""
+        np.save(path, np.frombuffer(self.sources, dtype=np.int64))
+
+
+def load_sources(path):
+    """Kept chunk ID of every source chunk position, or None if chunks were not deduplicated."""
+    return np.load(path, mmap_mode="r") if os.path.exists(path) else None
+
+
+def dedupe_chunks(text_chunks, threshold=DEDUP_THRESHOLD):
+    """Collapses near-duplicate chunks. Returns the kept chunks and the source mapping (see NearDuplicateFilter)."""
+    dedup = NearDuplicateFilter(threshold)
+    kept = list(dedup.filter(text_chunks))
+    return kept, np.frombuffer(dedup.sources, dtype=np.int64).copy()
+
+
+def sentence_key(sentence):
+    """Case-, punctuation- and whitespace-insensitive form of a sentence."""
+    return RE_SPACES.sub(" ", RE_NON_WORD.sub("", sentence.lower())).strip()
+
+
+def dedupe_sentences(sentences):
+    """Drops repeated sentences (ignoring case, punctuation and spacing), keeping the first of each."""
+    seen = set()
+    unique = []
+    for sentence in sentences:
+        key = sentence_key(sentence)
+        if key not in seen:
+            seen.add(key)
+            unique.append(sentence)
+    return unique
+
+
+if __name__ == "__main__":
+    paths = data_paths(DATA_DIR)
+    parser = argparse.ArgumentParser(description="Collapse near-duplicate chunks before embedding.")
+    parser.add_argument("--input", default=paths["tokenized_chunks"], help="Chunks file, one chunk per line.")
+    parser.add_argument("--output", default=paths["deduplicated_chunks"], help="Deduplicated chunks file.")
+    parser.add_argument("--sources", default=paths["chunk_sources"], help="Where to save the source position mapping.")
+    parser.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD, help="Estimated Jaccard similarity at which chunks collapse.")
+    args = parser.parse_args()
+    if os.path.abspath(args.output) == os.path.abspath(args.input):
+        # The source positions in the mapping index the input, so it must be kept
+        parser.error("--output must differ from --input, the source mapping points into the input chunks")
+
+    print("📂 Loading tokenized chunks...")
+    text_chunks = load_chunks(args.input)
+    kept, sources = dedupe_chunks(text_chunks, args.threshold)
+
+    with open(args.output + ".tmp", "w", encoding="utf-8") as file:
+        for text in kept:
+            file.write(text + "\n\n")
+    os.replace(args.output + ".tmp", args.output)
+    np.save(args.sources, sources)
+    print(f"✅ Kept {len(kept)} of {len(text_chunks)} chunks ({len(text_chunks) - len(kept)} near-duplicates collapsed)")
@@ -17,7 +17,7 @@ def search_es(query):
     }
     
     # Replace 'your_index_name' with the actual index name you're using
-    index_name = "my_index"  # Modify this with the correct index name
+    index_name = "slm_index"  # Written by index_passages.py
     response = es.search(index=index_name, body=body)
     
     # Extract the hits from the Elasticsearch response
@@ -1,36 +1,314 @@
+import argparse
+import hashlib
+import json
 import os
-import faiss
-import torch
-from sentence_transformers import SentenceTransformer
+import time
+import numpy as np
+from config import EMBEDDING_MODEL_NAME, ENCODER_BACKEND
+from encoders import BACKENDS, EncoderPool
+from chunks import chunk_ids, indexed_chunks_path, load_chunks
+from index_factory import (INDEX_TYPES, METRICS, PRECISIONS, add_vectors, build_index, default_benchmark_configs,
+                           default_search_params, format_precision_report, format_report, load_index,
+                           load_index_meta, precision_report, recall_report, save_index,
+                           supports_removal)
+from vector_math import index_metric, normalize
 
 # Define paths
 DATA_PATH = "K:/slm_project/data/tokenized_chunks.txt"
 EMBEDDING_PATH = "K:/slm_project/data/embeddings.index"
+VECTORS_PATH = "K:/slm_project/data/embeddings.vectors.npy"  # Cached chunk embeddings, one row per chunk ID
+IDS_PATH = "K:/slm_project/data/embeddings.ids.npy"  # Chunk IDs of the cached rows
+BUNDLE_PATH = "K:/slm_project/data/index_bundle"  # Memory-mappable copy of the index, opened by retrieval.py
+CHECKPOINT_PATH = "K:/slm_project/data/embeddings.build.json"  # Progress of an unfinished encoding run
 
-# Load the SBERT model (this will convert text into meaningful numerical representations)
-print("📥 Loading SBERT model for embeddings...")
-model = SentenceTransformer("all-MiniLM-L6-v2")  # Lightweight and fast!
+# Build settings
+EMBED_BATCH_SIZE = 256  # Chunks per encoder task, and per checkpoint
+COPY_BLOCK_ROWS = 65536  # Rows copied at a time when assembling the embedding cache
+PROGRESS_INTERVAL = 5.0  # Seconds between progress reports
 
-# Load tokenized text chunks
-print("📂 Loading tokenized chunks...")
-with open(DATA_PATH, "r", encoding="utf-8") as file:
-    text_chunks = file.readlines()
 
-# Convert text chunks into embeddings
-print("🔍 Generating embeddings for text chunks...")
-embeddings = model.encode(text_chunks, convert_to_tensor=True)
+def _work_key(added_ids, batch_size, pool):
+    """Identifies one encoding run, so a checkpoint is only resumed for the same chunks, batches and encoder."""
+    digest = hashlib.blake2b(np.ascontiguousarray(added_ids, dtype=np.int64).tobytes(), digest_size=16)
+    digest.update(f"{batch_size}|{pool.backend}|{pool.model_name}".encode("utf-8"))
+    return digest.hexdigest()
 
-# Convert embeddings to a NumPy array for FAISS
-embeddings = embeddings.cpu().numpy()
 
-# Create FAISS index for efficient similarity search
-print("⚡ Initializing FAISS index...")
-dimension = embeddings.shape[1]  # Get the embedding vector size
-index = faiss.IndexFlatL2(dimension)  # L2 (Euclidean) distance for similarity search
-index.add(embeddings)
+def _load_checkpoint(checkpoint_path, key):
+    """State of an interrupted run of the same work, or None."""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r", encoding="utf-8") as file:
+        state = json.load(file)
+    return state if state.get("key") == key else None
 
-# Save FAISS index to disk
-print("💾 Saving FAISS index for future use...")
-faiss.write_index(index, EMBEDDING_PATH)
 
-print(f"✅ Embeddings stored successfully in {EMBEDDING_PATH}")
+def _save_checkpoint(checkpoint_path, state):
+    with open(checkpoint_path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(state, file)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+def encode_resumable(pool, texts, key, partial_path, checkpoint_path=CHECKPOINT_PATH, batch_size=EMBED_BATCH_SIZE):
+    """
+    Encodes texts batch by batch through an EncoderPool into a raw float32 file.
+
+    Every completed batch is appended to partial_path and recorded in the
+    checkpoint, so a run that is interrupted (or crashes) continues after the
+    last completed batch when started again with the same key. Progress and
+    throughput are reported every PROGRESS_INTERVAL seconds. Returns the
+    number of rows and their dimension.
+    """
+    state = _load_checkpoint(checkpoint_path, key) if os.path.exists(partial_path) else None
+    if state is None:
+        state = {"key": key, "batches": 0, "rows": 0, "dimension": None}
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    else:
+        print(f"♻️ Resuming after batch {state['batches']} ({state['rows']} of {len(texts)} chunks already encoded)")
+        with open(partial_path, "r+b") as file:
+            file.truncate(state["rows"] * state["dimension"] * 4)  # Drop rows written after the last checkpoint
+
+    start_batch = state["batches"]
+    batches = (texts[i:i + batch_size] for i in range(start_batch * batch_size, len(texts), batch_size))
+    started = last_report = time.perf_counter()
+    encoded = 0
+    with open(partial_path, "ab") as partial:
+        for vectors in pool.imap(batches):
+            vectors = normalize(vectors)
+            partial.write(vectors.tobytes())
+            partial.flush()
+            encoded += len(vectors)
+            state.update(batches=state["batches"] + 1, rows=state["rows"] + len(vectors), dimension=vectors.shape[1])
+            _save_checkpoint(checkpoint_path, state)
+
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                rate = encoded / (now - started)
+                print(f"⏳ {state['rows']}/{len(texts)} chunks ({state['rows'] / len(texts):.0%}), "
+                      f"{rate:.0f} chunks/s, ETA {(len(texts) - state['rows']) / rate:.0f}s")
+                last_report = now
+
+    seconds = time.perf_counter() - started
+    if encoded:
+        print(f"⚡ Encoded {encoded} chunks in {seconds:.1f}s ({encoded / seconds:.0f} chunks/s, {pool.workers} workers)")
+    return state["rows"], state["dimension"]
+
+
+def _finish_cache_commit(vectors_path, ids_path):
+    """Moves fully written .tmp.npy cache files into place, if a commit marker says both were complete."""
+    marker = vectors_path + ".commit"
+    if not os.path.exists(marker):
+        return
+    for path in (ids_path, vectors_path):
+        if os.path.exists(path + ".tmp.npy"):
+            os.replace(path + ".tmp.npy", path)
+    os.remove(marker)
+
+
+def _commit_cache(vectors_path, ids_path):
+    """
+    Replaces the vectors and ids files together with their .tmp.npy versions.
+
+    The marker is written once both new files are complete. If the process
+    dies between the two replacements, the next run finishes them before
+    reading the cache, so vectors are never paired with another build's ids.
+    """
+    open(vectors_path + ".commit", "w").close()
+    _finish_cache_commit(vectors_path, ids_path)
+
+
+def update_embedding_cache(pool, text_chunks, ids, vectors_path=VECTORS_PATH, ids_path=IDS_PATH,
+                           checkpoint_path=CHECKPOINT_PATH, batch_size=EMBED_BATCH_SIZE):
+    """
+    Brings the cached chunk embeddings in line with the current chunks.
+
+    Only chunks whose content ID is not cached yet are encoded, streamed in
+    batches through the encoder pool (resumably, see encode_resumable); rows
+    of chunks that no longer exist are dropped. Identical chunks share one
+    row. The new cache is assembled block by block from the old one and the
+    new rows, so no step holds every embedding in memory.
+
+    Returns (cache_ids, cache_vectors, added_ids, removed_ids), with
+    cache_vectors memory-mapped. Added rows are the last len(added_ids) rows
+    of cache_vectors.
+    """
+    unique_ids, first_positions = np.unique(ids, return_index=True)
+
+    _finish_cache_commit(vectors_path, ids_path)  # From a run that died while replacing the cache
+    if os.path.exists(vectors_path) and os.path.exists(ids_path):
+        old_ids = np.load(ids_path)
+        old_vectors = np.load(vectors_path, mmap_mode="r")
+    else:
+        old_ids = np.zeros(0, dtype=np.int64)
+        old_vectors = None
+
+    kept = np.isin(old_ids, unique_ids)
+    added = ~np.isin(unique_ids, old_ids)
+    added_ids = unique_ids[added]
+    removed_ids = old_ids[~kept]
+
+    print(f"🔍 Encoding {len(added_ids)} new or changed chunks ({int(kept.sum())} cached, {len(removed_ids)} removed)...")
+    partial_path = vectors_path + ".partial"
+    rows, dimension = encode_resumable(pool, [text_chunks[p] for p in first_positions[added]],
+                                       _work_key(added_ids, batch_size, pool), partial_path, checkpoint_path, batch_size)
+    if old_vectors is not None:
+        if dimension is not None and dimension != old_vectors.shape[1]:
+            raise ValueError(f"❌ Cached embeddings have {old_vectors.shape[1]} dimensions, the encoder {dimension}; "
+                             f"delete {vectors_path} to re-encode everything")
+        dimension = old_vectors.shape[1]
+    if dimension is None:
+        raise ValueError("❌ No chunks to embed!")
+
+    kept_rows = np.flatnonzero(kept)
+    cache_ids = np.concatenate([old_ids[kept], added_ids])
+    output = np.lib.format.open_memmap(vectors_path + ".tmp.npy", mode="w+", dtype=np.float32,
+                                       shape=(len(cache_ids), dimension))
+    for start in range(0, len(kept_rows), COPY_BLOCK_ROWS):
+        block = kept_rows[start:start + COPY_BLOCK_ROWS]
+        output[start:start + len(block)] = old_vectors[block]
+    if rows:
+        partial = np.memmap(partial_path, dtype=np.float32, mode="r", shape=(rows, dimension))
+        for start in range(0, rows, COPY_BLOCK_ROWS):
+            block = partial[start:start + COPY_BLOCK_ROWS]
+            output[len(kept_rows) + start:len(kept_rows) + start + len(block)] = block
+        del partial
+    output.flush()
+    del output, old_vectors  # Unmapped before the files are replaced
+
+    np.save(ids_path + ".tmp.npy", cache_ids)
+    _commit_cache(vectors_path, ids_path)
+    for path in (partial_path, checkpoint_path):
+        if os.path.exists(path):
+            os.remove(path)
+    return cache_ids, np.load(vectors_path, mmap_mode="r"), added_ids, removed_ids
+
+
+def update_index(cache_ids, cache_vectors, added_ids, removed_ids, index_type="flat",
+                 build_params=None, search_params=None, full_rebuild=False, index_path=EMBEDDING_PATH):
+    """
+    Applies added / removed chunks to the stored FAISS index, or rebuilds it.
+
+    The existing index is updated in place when it was built with content IDs
+    and the same type and build settings; otherwise (or if removal is
+    impossible, as for HNSW) it is rebuilt from the cached vectors.
+    """
+    build_params = build_params or {}
+    meta = load_index_meta(index_path) if os.path.exists(index_path) else None
+
+    incremental = (not full_rebuild and meta is not None
+                   and meta.get("id_scheme") == "content_hash"
+                   and meta.get("index_type") == index_type
+                   and all(meta["build_params"].get(key) == value for key, value in build_params.items())
+                   and (len(removed_ids) == 0 or supports_removal(index_type)))
+
+    index = None
+    if incremental:
+        print(f"♻️ Updating FAISS index in place (+{len(added_ids)} / -{len(removed_ids)})...")
+        index, _ = load_index(index_path)
+        if len(removed_ids):
+            index.remove_ids(np.ascontiguousarray(removed_ids, dtype=np.int64))
+        if len(added_ids):
+            add_vectors(index, cache_vectors[len(cache_vectors) - len(added_ids):], added_ids, index_metric(meta))
+        if index.ntotal == len(cache_ids):
+            build_params = meta["build_params"]
+            search_params = {**meta.get("search_params", {}), **(search_params or {})}
+        else:
+            print("⚠️ Index and embedding cache disagree, rebuilding from scratch...")
+            index = None
+
+    if index is None:
+        print(f"⚡ Initializing FAISS index ({index_type})...")
+        index, build_params = build_index(cache_vectors, index_type, ids=cache_ids, **build_params)
+        search_params = {**default_search_params(index_type), **(search_params or {})}
+
+    # Save FAISS index to disk
+    print("💾 Saving FAISS index for future use...")
+    return save_index(index, index_path, index_type, build_params, search_params, id_scheme="content_hash")
+
+
+def _sample_queries(embeddings, num_queries, seed):
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(embeddings.shape[0], size=min(num_queries, embeddings.shape[0]), replace=False)
+    return embeddings[sample]
+
+
+def benchmark(embeddings, k=10, num_queries=200, seed=0):
+    """Prints recall@k and latency of every index type against the exact Flat baseline."""
+    queries = _sample_queries(embeddings, num_queries, seed)
+    configs = default_benchmark_configs(*embeddings.shape)
+    rows = recall_report(embeddings, queries, configs, k=k)
+    print(format_report(rows, k=k))
+    return rows
+
+
+def benchmark_precision(embeddings, index_type="flat", k=10, num_queries=200, seed=0, **build_params):
+    """Prints memory, recall@k and latency of each storage precision, with and without exact re-ranking."""
+    queries = _sample_queries(embeddings, num_queries, seed)
+    rows = precision_report(embeddings, queries, k=k, index_type=index_type, **build_params)
+    print(format_precision_report(rows, k=k))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed tokenized chunks and build the FAISS index.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="FAISS index type to build.")
+    parser.add_argument("--nlist", type=int, help="IVF lists (default: ~4*sqrt(n)).")
+    parser.add_argument("--pq-m", type=int, help="IVF-PQ sub-quantizers.")
+    parser.add_argument("--pq-nbits", type=int, help="IVF-PQ bits per code.")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW neighbours per node.")
+    parser.add_argument("--encoder", choices=BACKENDS, default=ENCODER_BACKEND, help="Encoder backend (see encoders.py).")
+    parser.add_argument("--metric", choices=METRICS, default="ip", help="Similarity: inner product of normalized vectors (cosine) or L2.")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32", help="Vector storage precision (fp16 / int8 are 2x / 4x smaller).")
+    parser.add_argument("--nprobe", type=int, help="IVF lists scanned per query, stored with the index.")
+    parser.add_argument("--ef-search", type=int, help="HNSW search depth, stored with the index.")
+    parser.add_argument("--full-rebuild", action="store_true", help="Rebuild the index from all cached vectors instead of updating it.")
+    parser.add_argument("--benchmark", action="store_true", help="Report recall@k vs latency for every index type instead of saving.")
+    parser.add_argument("--precision-report", action="store_true", help="Report memory and recall@k of each precision for --index-type instead of saving.")
+    parser.add_argument("--k", type=int, default=10, help="k for the recall@k benchmark.")
+    parser.add_argument("--bundle", choices=("faiss", "npy"), help="Also write a memory-mappable index bundle (see index_bundle.py).")
+    parser.add_argument("--workers", type=int, help="Encoder processes (default: one per core, 1 = in-process).")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks per encoder task and checkpoint.")
+    args = parser.parse_args()
+
+    # Load tokenized text chunks
+    print("📂 Loading tokenized chunks...")
+    text_chunks = load_chunks(indexed_chunks_path(DATA_PATH))
+    ids = chunk_ids(text_chunks)
+
+    # Convert new or changed text chunks into embeddings; every encoder process loads its own SBERT model
+    with EncoderPool(args.encoder, EMBEDDING_MODEL_NAME, args.workers) as pool:
+        print(f"📥 Encoding with {pool.workers} {args.encoder} worker(s), {pool.threads} thread(s) each...")
+        cache_ids, cache_vectors, added_ids, removed_ids = update_embedding_cache(pool, text_chunks, ids,
+                                                                                  batch_size=args.batch_size)
+
+    if args.benchmark:
+        print(f"📊 Benchmarking index types on {cache_vectors.shape[0]} vectors...")
+        benchmark(cache_vectors, k=args.k)
+        return
+
+    build_params = {key: value for key, value in (("nlist", args.nlist), ("pq_m", args.pq_m),
+                                                  ("pq_nbits", args.pq_nbits), ("hnsw_m", args.hnsw_m))
+                    if value is not None}
+
+    if args.precision_report:
+        print(f"📊 Comparing storage precisions of {args.index_type} on {cache_vectors.shape[0]} vectors...")
+        benchmark_precision(cache_vectors, args.index_type, k=args.k, metric=args.metric, **build_params)
+        return
+
+    build_params.update(metric=args.metric, precision=args.precision)
+    search_params = {key: value for key, value in (("nprobe", args.nprobe), ("ef_search", args.ef_search))
+                     if value is not None and key in default_search_params(args.index_type)}
+    update_index(cache_ids, cache_vectors, added_ids, removed_ids, args.index_type,
+                 build_params, search_params, full_rebuild=args.full_rebuild)
+    if args.bundle:
+        from index_bundle import write_bundle
+
+        print("📦 Writing memory-mappable index bundle...")
+        write_bundle(BUNDLE_PATH, EMBEDDING_PATH, EMBEDDING_MODEL_NAME, args.bundle, VECTORS_PATH, IDS_PATH)
+
+    print(f"✅ Embeddings stored successfully in {EMBEDDING_PATH}")
+
+
+if __name__ == "__main__":
+    main()
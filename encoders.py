@@ -0,0 +1,386 @@
+import argparse
+import inspect
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from config import (DATA_DIR, EMBEDDING_MODEL_NAME, ENCODER_BACKEND, ENCODER_PARITY_TOLERANCE, ENCODER_THREADS,
+                    ONNX_DIR, data_paths)
+from vector_math import normalize
+
+BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+ONNX_OPSET = 14
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model.int8.onnx"
+ENCODER_CONFIG_FILE = "encoder.json"  # Pooling, normalization and window of the exported model
+
+
+def set_torch_threads(threads=None, interop_threads=None):
+    """Sets PyTorch intra-op and inter-op thread counts (None keeps the defaults)."""
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            pass  # Can only be set once, before PyTorch starts any parallel work
+
+
+def load_torch_encoder(model_name=EMBEDDING_MODEL_NAME, quantize=False, threads=None, interop_threads=None):
+    """
+    The SentenceTransformer model, optionally with dynamic int8 quantization of its Linear layers.
+
+    SentenceTransformer.encode already sorts its input by length, so batches carry little padding.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    set_torch_threads(threads, interop_threads)
+    model = SentenceTransformer(model_name, device="cpu" if quantize else None)
+    if quantize:
+        import torch
+
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def onnx_dir(model_name=EMBEDDING_MODEL_NAME, root=ONNX_DIR):
+    return os.path.join(root, model_name.replace("/", "__"))
+
+
+def _pooling_mode(pooling):
+    """"mean" or "cls" pooling of a sentence-transformers Pooling module."""
+    config = pooling.get_config_dict()
+    mode = config.get("pooling_mode")  # sentence-transformers 6+; older versions have one flag per mode
+    if mode is None:
+        mode = "cls" if config.get("pooling_mode_cls_token") else "mean" if config.get("pooling_mode_mean_tokens") else None
+    if mode not in ("mean", "cls"):
+        raise ValueError(f"❌ Unsupported pooling for the ONNX backend: {config}")
+    return mode
+
+
+def export_onnx(model_name=EMBEDDING_MODEL_NAME, output_dir=None, quantize=True):
+    """
+    Exports the transformer of a SentenceTransformer model to ONNX, with its tokenizer.
+
+    Pooling and normalization run in NumPy (see OnnxEncoder), so the graph
+    only maps token IDs to token embeddings. With quantize, a copy with
+    dynamically int8-quantized weights is written as well.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = output_dir or onnx_dir(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer, pooling = model[0], model[1]
+    tokenizer = transformer.tokenizer
+
+    dummy = tokenizer(["An example sentence to trace the model with."], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    axes = {0: "batch", 1: "sequence"}
+    # The TorchScript exporter takes dynamic_axes as is; newer PyTorch defaults to the dynamo exporter (needs onnxscript)
+    exporter = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    print(f"📦 Exporting {model_name} to ONNX...")
+    with torch.no_grad():
+        torch.onnx.export(TokenEmbeddings(transformer.auto_model.eval()), tuple(dummy[name] for name in input_names),
+                          os.path.join(output_dir, ONNX_MODEL_FILE), input_names=input_names,
+                          output_names=["token_embeddings"],
+                          dynamic_axes={name: axes for name in input_names + ["token_embeddings"]},
+                          opset_version=ONNX_OPSET, **exporter)
+    tokenizer.save_pretrained(output_dir)
+
+    config = {"model_name": model_name, "dimension": model.get_sentence_embedding_dimension(),
+              "max_seq_length": model.max_seq_length,
+              "pooling": _pooling_mode(pooling),
+              "normalize": any(type(module).__name__ == "Normalize" for module in model)}
+    with open(os.path.join(output_dir, ENCODER_CONFIG_FILE), "w", encoding="utf-8") as file:
+        json.dump(config, file, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print("🗜️ Quantizing ONNX weights to int8...")
+        quantize_dynamic(os.path.join(output_dir, ONNX_MODEL_FILE), os.path.join(output_dir, ONNX_INT8_MODEL_FILE),
+                         weight_type=QuantType.QInt8)
+    return output_dir
+
+
+class OnnxEncoder:
+    """
+    Runs an exported encoder with ONNX Runtime, as a drop-in for SentenceTransformer.encode.
+
+    Sentences are tokenized once, sorted by token count and batched longest
+    first, so each batch is padded only to its own longest sentence.
+    """
+
+    def __init__(self, model_dir, quantized=False, threads=None, interop_threads=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, ENCODER_CONFIG_FILE), "r", encoding="utf-8") as file:
+            self.config = json.load(file)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        if interop_threads:
+            options.inter_op_num_threads = interop_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        path = os.path.join(model_dir, ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+        self.max_seq_length = self.config["max_seq_length"]
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def _pool(self, token_embeddings, attention_mask):
+        if self.config["pooling"] == "cls":
+            return token_embeddings[:, 0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        """Embeds sentences as a float32 (N, d) array (a single string gives a (d,) vector)."""
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        embeddings = np.zeros((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        if not sentences:
+            return embeddings
+
+        encoded = self.tokenizer(sentences, truncation=True, max_length=self.max_seq_length)
+        lengths = np.array([len(ids) for ids in encoded["input_ids"]])
+        order = np.argsort(-lengths, kind="stable")
+
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            width = int(lengths[rows[0]])
+            feeds = {}
+            for name in self.input_names:
+                fill = self.tokenizer.pad_token_id if name == "input_ids" else 0
+                batch = np.full((len(rows), width), fill, dtype=np.int64)
+                if name in encoded:
+                    for i, row in enumerate(rows):
+                        batch[i, :lengths[row]] = encoded[name][row]
+                feeds[name] = batch
+            token_embeddings = self.session.run(None, feeds)[0]
+            embeddings[rows] = self._pool(token_embeddings, feeds["attention_mask"])
+
+        if self.config["normalize"]:
+            embeddings = normalize(embeddings)
+        return embeddings[0] if single else embeddings
+
+
+def load_encoder(backend=ENCODER_BACKEND, model_name=EMBEDDING_MODEL_NAME, threads=None, interop_threads=None):
+    """
+    Loads the sentence encoder for a backend:
+
+    - "torch": SentenceTransformer in eager PyTorch (the reference)
+    - "torch_int8": the same with dynamically int8-quantized Linear layers
+    - "onnx" / "onnx_int8": ONNX Runtime on an export in ONNX_DIR (exported on first use)
+
+    Every backend has SentenceTransformer's encode() and
+    get_sentence_embedding_dimension(). threads defaults to ENCODER_THREADS.
+    """
+    threads = threads or ENCODER_THREADS or None
+    if backend in ("torch", "torch_int8"):
+        return load_torch_encoder(model_name, backend == "torch_int8", threads, interop_threads)
+    if backend in ("onnx", "onnx_int8"):
+        return OnnxEncoder(ensure_exported(backend, model_name), backend == "onnx_int8", threads, interop_threads)
+    raise ValueError(f"❌ Unknown encoder backend: {backend} (expected one of {', '.join(BACKENDS)})")
+
+
+def ensure_exported(backend, model_name=EMBEDDING_MODEL_NAME):
+    """Exports the ONNX model an "onnx" / "onnx_int8" backend needs, if missing. Returns its directory."""
+    model_dir = onnx_dir(model_name)
+    quantized = backend == "onnx_int8"
+    if not os.path.exists(os.path.join(model_dir, ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)):
+        export_onnx(model_name, model_dir, quantize=quantized)
+    return model_dir
+
+
+_worker_encoder = None  # Encoder of an EncoderPool worker process
+
+
+def _init_pool_worker(backend, model_name, threads):
+    global _worker_encoder
+    _worker_encoder = load_encoder(backend, model_name, threads=threads, interop_threads=1)
+
+
+def _encode_in_worker(texts, batch_size):
+    return np.asarray(_worker_encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+
+
+class EncoderPool:
+    """
+    Encodes batches of texts in worker processes, each holding its own encoder.
+
+    workers defaults to one per core, and each worker gets an equal share of
+    the cores as intra-op threads. imap() keeps at most two batches per
+    worker in flight and yields results in input order, so memory stays flat
+    however many batches are fed in. workers=1 encodes in-process.
+    """
+
+    def __init__(self, backend=ENCODER_BACKEND, model_name=EMBEDDING_MODEL_NAME, workers=None, threads=None):
+        cores = os.cpu_count() or 1
+        self.backend = backend
+        self.model_name = model_name
+        self.workers = workers or cores
+        self.threads = threads or max(cores // self.workers, 1)
+        self._encoder = None
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start(self):
+        if self.workers == 1:
+            self._encoder = self._encoder or load_encoder(self.backend, self.model_name, threads=self.threads)
+        elif self._executor is None:
+            if self.backend in ("onnx", "onnx_int8"):
+                ensure_exported(self.backend, self.model_name)  # Once here, not racing in every worker
+            # Spawned, not forked: a forked copy of an initialized PyTorch runtime can deadlock
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_pool_worker,
+                                                 initargs=(self.backend, self.model_name, self.threads))
+
+    def imap(self, batches, batch_size=64):
+        """Yields the float32 embedding matrix of every batch (a list of texts), in order."""
+        self._start()
+        if self._executor is None:
+            for texts in batches:
+                yield np.asarray(self._encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+            return
+
+        pending = deque()
+        for texts in batches:
+            pending.append(self._executor.submit(_encode_in_worker, texts, batch_size))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        self._encoder = None
+
+
+def parity_check(encoder, reference, texts, batch_size=64, tolerance=ENCODER_PARITY_TOLERANCE):
+    """
+    Cosine similarity between an encoder's embeddings and reference embeddings of the same texts.
+
+    reference is an encoder or a precomputed (N, d) array. Passes when
+    every text stays at or above tolerance.
+    """
+    if not isinstance(reference, np.ndarray):
+        reference = reference.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    embeddings = encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    cosines = np.einsum("ij,ij->i", normalize(embeddings), normalize(reference))
+    return {"min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean()),
+            "below_tolerance": int((cosines < tolerance).sum()), "passed": bool(cosines.min() >= tolerance)}
+
+
+def throughput(encoder, texts, batch_size=64, repeats=3):
+    """Best texts per second over repeats passes, after one warm-up batch."""
+    encoder.encode(texts[:batch_size], batch_size=batch_size, convert_to_numpy=True)
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best
+
+
+def compare_backends(texts, backends=BACKENDS, model_name=EMBEDDING_MODEL_NAME, threads=None, interop_threads=None,
+                     batch_size=64, repeats=3, tolerance=ENCODER_PARITY_TOLERANCE):
+    """Load time, throughput and parity with the torch backend of every backend, as a list of rows."""
+    reference_encoder = load_torch_encoder(model_name, threads=threads or ENCODER_THREADS or None,
+                                           interop_threads=interop_threads)
+    reference = reference_encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+    rows = []
+    for backend in backends:
+        print(f"⏱️ Measuring {backend}...")
+        start = time.perf_counter()
+        encoder = reference_encoder if backend == "torch" else load_encoder(backend, model_name, threads, interop_threads)
+        load_seconds = time.perf_counter() - start
+        row = {"backend": backend, "load_seconds": load_seconds,
+               "texts_per_second": throughput(encoder, texts, batch_size, repeats)}
+        row.update(parity_check(encoder, reference, texts, batch_size, tolerance))
+        rows.append(row)
+    return rows
+
+
+def format_backend_report(rows, tolerance=ENCODER_PARITY_TOLERANCE):
+    """Formats compare_backends() rows as a text table."""
+    base = next((row["texts_per_second"] for row in rows if row["backend"] == "torch"), None)
+    lines = [f"{'backend':<11} {'load s':>7} {'texts/s':>9} {'speedup':>8} {'min cos':>8} {'mean cos':>9} "
+             f"{'parity @' + str(tolerance):>13}"]
+    for row in rows:
+        speedup = f"{row['texts_per_second'] / base:.2f}x" if base else "-"
+        lines.append(f"{row['backend']:<11} {row['load_seconds']:>7.2f} {row['texts_per_second']:>9.1f} {speedup:>8} "
+                     f"{row['min_cosine']:>8.4f} {row['mean_cosine']:>9.4f} {'ok' if row['passed'] else 'FAIL':>13}")
+    return "\n".join(lines)
+
+
+def sample_texts(path, limit):
+    """Up to limit non-empty lines of a text file (e.g. the sentence index's sentences.txt)."""
+    texts = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                texts.append(line.strip())
+                if len(texts) >= limit:
+                    break
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, check and compare sentence encoder backends.")
+    parser.add_argument("--export", action="store_true", help="Export the model to ONNX (and int8 ONNX) into ONNX_DIR.")
+    parser.add_argument("--compare", nargs="*", choices=BACKENDS, help="Compare throughput and parity of these backends (default: all).")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME, help="SentenceTransformer model.")
+    parser.add_argument("--texts", default=data_paths(DATA_DIR)["sentences"], help="Text file with one sample text per line.")
+    parser.add_argument("--limit", type=int, default=2000, help="Sample texts to encode.")
+    parser.add_argument("--threads", type=int, help="Intra-op threads (default: ENCODER_THREADS or the library default).")
+    parser.add_argument("--interop-threads", type=int, help="Inter-op threads.")
+    parser.add_argument("--batch-size", type=int, default=64, help="Texts encoded per batch.")
+    parser.add_argument("--tolerance", type=float, default=ENCODER_PARITY_TOLERANCE, help="Lowest acceptable cosine similarity to torch.")
+    args = parser.parse_args()
+
+    if args.export:
+        print(f"✅ Exported to {export_onnx(args.model)}")
+
+    if args.compare is not None:
+        texts = sample_texts(args.texts, args.limit)
+        print(f"📊 Comparing encoder backends on {len(texts)} texts...")
+        rows = compare_backends(texts, args.compare or BACKENDS, args.model, args.threads, args.interop_threads,
+                                args.batch_size, tolerance=args.tolerance)
+        print(format_backend_report(rows, args.tolerance))
+        if not all(row["passed"] for row in rows):
+            raise SystemExit("❌ A backend's embeddings drifted below the parity tolerance")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import numpy as np
+
+RRF_K = 60  # Rank damping constant from the original reciprocal rank fusion paper
+
+
+def reciprocal_rank_fusion(ranked_lists, weights=None, k=RRF_K, top_k=None):
+    """
+    Merges ranked result lists by weighted reciprocal rank fusion.
+
+    ranked_lists maps a backend name to its ranked document keys (best
+    first); each document scores sum(weight / (k + rank)) over the lists it
+    appears in. Returns [(key, fused_score)] sorted best first.
+    """
+    weights = weights or {}
+    scores = {}
+    for name, keys in ranked_lists.items():
+        weight = weights.get(name, 1.0)
+        for rank, key in enumerate(keys, 1):
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return fused[:top_k] if top_k else fused
+
+
+def weighted_score_fusion(scored_lists, weights=None, top_k=None):
+    """
+    Merges scored result lists by a weighted sum of min-max normalized scores.
+
+    scored_lists maps a backend name to [(key, score)] with higher scores
+    better. Returns [(key, fused_score)] sorted best first.
+    """
+    weights = weights or {}
+    scores = {}
+    for name, results in scored_lists.items():
+        if not results:
+            continue
+        raw = np.array([score for _, score in results], dtype=np.float64)
+        spread = raw.max() - raw.min()
+        normalized = (raw - raw.min()) / spread if spread > 0 else np.ones_like(raw)
+        weight = weights.get(name, 1.0)
+        for (key, _), score in zip(results, normalized):
+            scores[key] = scores.get(key, 0.0) + weight * score
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return fused[:top_k] if top_k else fused
+
+
+def fuse(vector_results, lexical_lists, method="rrf", weights=None, k=RRF_K, top_k=None):
+    """
+    Merges one query's [(key, score)] vector results with one or more lexical result lists.
+
+    Every lexical list (e.g. one per corpus, whose scores are not comparable)
+    is a separate ranking sharing the "lexical" weight equally, so lexical
+    evidence weighs the same however many lists there are. method is "rrf"
+    or "weighted" (see weighted_score_fusion). Returns [(key, fused_score)].
+    """
+    weights = weights or {}
+    names = [f"lexical{i}" for i in range(len(lexical_lists))]
+    lexical_weight = weights.get("lexical", 1.0) / max(len(lexical_lists), 1)
+    weights = {"vector": weights.get("vector", 1.0), **{name: lexical_weight for name in names}}
+    if method == "rrf":
+        ranked = {"vector": [key for key, _ in vector_results]}
+        ranked.update((name, [key for key, _ in results]) for name, results in zip(names, lexical_lists))
+        return reciprocal_rank_fusion(ranked, weights, k=k, top_k=top_k)
+    return weighted_score_fusion({"vector": vector_results, **dict(zip(names, lexical_lists))}, weights, top_k=top_k)
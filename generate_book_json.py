@@ -1,30 +1,38 @@
 import json
 import os
+from chunks import indexed_chunks_path, load_chunks
+from chunk_store import ChunkStore, write_chunk_store
 
 # Define data paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # src/retrieval/
 DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, "../../data"))  # Points to data/
 
-input_file = os.path.join(DATA_DIR, "tokenized_chunks.txt")
+input_file = indexed_chunks_path(os.path.join(DATA_DIR, "tokenized_chunks.txt"))  # dedup.py's output if newer
 output_file = os.path.join(DATA_DIR, "book.json")
+chunk_store_prefix = os.path.join(DATA_DIR, "chunks")
 
 # ✅ Check if input file exists
 if not os.path.exists(input_file):
     print(f"❌ ERROR: {input_file} not found! Cannot generate book.json.")
     exit(1)
 
-# ✅ Read all passages WITHOUT removing duplicates
-with open(input_file, "r", encoding="utf-8") as f:
-    passages = [line.strip() for line in f if line.strip()]  # Keep all 958 lines
+# ✅ Read all passages WITHOUT removing duplicates and store them in the shared chunk store
+passages = load_chunks(input_file)  # Keep all 958 lines
+write_chunk_store(passages, chunk_store_prefix)
+del passages
 
 # ✅ Print passage count to debug
-print(f"📥 DEBUG: Loaded {len(passages)} raw passages from tokenized_chunks.txt")
+store = ChunkStore(chunk_store_prefix)
+print(f"📥 DEBUG: Loaded {len(store)} raw passages from tokenized_chunks.txt into {chunk_store_prefix}.bin")
 
-# ✅ Convert to structured JSON, assigning a unique ID to each passage (even if duplicate)
-book_data = [{"id": idx, "text": passage} for idx, passage in enumerate(passages)]
-
-# ✅ Save structured JSON
+# ✅ Export structured JSON, assigning a unique ID to each passage (even if duplicate), streamed from the store
 with open(output_file, "w", encoding="utf-8") as f:
-    json.dump(book_data, f, indent=4, ensure_ascii=False)
-
-print(f"✅ Book JSON file created: {output_file} ({len(book_data)} passages)")
+    f.write("[")
+    for idx, passage in enumerate(store):
+        if idx:
+            f.write(",\n")
+        json.dump({"id": idx, "chunk_id": int(store.ids[idx]), "text": passage}, f, ensure_ascii=False)
+    f.write("]\n")
+
+print(f"✅ Book JSON file created: {output_file} ({len(store)} passages)")
+store.close()
@@ -0,0 +1,283 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import faiss
+import numpy as np
+from config import DATA_DIR, EMBEDDING_MODEL_NAME, data_paths
+from index_factory import load_index_meta, set_search_params
+from vector_math import index_metric, prepare_vectors
+
+# Bundle layout
+BUNDLE_FORMAT = 1  # Bumped whenever the layout below changes
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"  # storage "faiss": the FAISS index, opened memory-mapped
+VECTORS_FILE = "vectors.npy"  # storage "npy": raw float32 vectors, searched exactly from a memory map
+IDS_FILE = "ids.npy"  # storage "npy": chunk ID of every vector row
+STORAGES = ("faiss", "npy")
+VERIFY_MODES = ("none", "quick", "full")
+
+QUICK_CHECK_BYTES = 1 << 20  # Bytes hashed at each end of a file by the quick check
+HASH_BLOCK_BYTES = 1 << 22
+SEARCH_BLOCK_ROWS = 65536  # Vectors scored at once by MmapFlatIndex
+
+
+def mmap_flags():
+    """
+    FAISS IO flags that open an index read-only and memory-mapped.
+
+    IO_FLAG_MMAP_IFC (FAISS >= 1.10) maps the vectors of flat, scalar-quantized,
+    HNSW and IVF indexes; older versions can only map IVF inverted lists.
+    """
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def file_checksum(path, quick=False):
+    """BLAKE2b of a file, or of its size and first and last QUICK_CHECK_BYTES when quick (cost independent of size)."""
+    digest = hashlib.blake2b(digest_size=16)
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        if quick:
+            digest.update(str(size).encode("ascii"))
+            digest.update(file.read(QUICK_CHECK_BYTES))
+            file.seek(max(size - QUICK_CHECK_BYTES, 0))
+            digest.update(file.read(QUICK_CHECK_BYTES))
+        else:
+            for block in iter(lambda: file.read(HASH_BLOCK_BYTES), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return {"bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class MmapFlatIndex:
+    """
+    Exact search over a memory-mapped (n, d) float32 vector file.
+
+    Answers search() like a FAISS IndexIDMap: (distances, labels) with
+    similarities (metric "ip") or squared L2 distances (metric "l2"), padded
+    with -1 labels. Vectors are scored SEARCH_BLOCK_ROWS at a time, so only
+    the pages being read are resident, and every process mapping the file
+    shares them through the page cache.
+    """
+
+    def __init__(self, vectors, ids, metric="ip"):
+        if len(vectors) != len(ids):
+            raise ValueError(f"❌ {len(vectors)} vectors but {len(ids)} IDs")
+        self.vectors = vectors
+        self.ids = ids
+        self.metric = metric
+        self.d = vectors.shape[1]
+        self.ntotal = len(vectors)
+
+    def search(self, queries, k):
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        sign = 1.0 if self.metric == "ip" else -1.0  # Internally higher is better
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+
+        for start in range(0, self.ntotal, SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores = queries @ block.T
+            if self.metric != "ip":
+                scores = 2 * scores - (block * block).sum(axis=1) - (queries * queries).sum(axis=1)[:, None]
+            rows = np.hstack([best_rows, np.broadcast_to(np.arange(start, start + len(block)), scores.shape)])
+            scores = np.hstack([best_scores, scores])
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]  # Best k of the previous best and this block
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        labels = np.where(best_rows >= 0, np.asarray(self.ids)[np.maximum(best_rows, 0)], -1)
+        distances = np.where(best_rows >= 0, sign * best_scores, -sign * np.inf).astype(np.float32)
+        return distances, labels.astype(np.int64)
+
+
+def write_bundle(bundle_dir, index_path, model_name=EMBEDDING_MODEL_NAME, storage="faiss",
+                 vectors_path=None, ids_path=None):
+    """
+    Writes a versioned, self-describing copy of a built index into bundle_dir.
+
+    storage "faiss" copies the FAISS index; "npy" stores the raw vectors of a
+    full-precision Flat index (from the embedding cache at vectors_path /
+    ids_path) for MmapFlatIndex. The manifest records the model, dimension,
+    metric, chunk count and checksums that open_bundle() validates. The new
+    bundle replaces the old one only once it is complete.
+    """
+    if storage not in STORAGES:
+        raise ValueError(f"❌ Unknown bundle storage: {storage}")
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"❌ FAISS index file not found: {index_path}")
+    meta = load_index_meta(index_path)
+    build_params = meta.get("build_params", {})
+    metric = index_metric(meta)
+
+    tmp_dir = bundle_dir.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    if storage == "faiss":
+        shutil.copyfile(index_path, os.path.join(tmp_dir, INDEX_FILE))
+        dimension, count = meta.get("dimension"), meta.get("ntotal")
+        if dimension is None or count is None:  # Indexes saved before these were recorded
+            index = faiss.read_index(index_path, mmap_flags())
+            dimension, count = index.d, index.ntotal
+    else:
+        if meta.get("index_type") != "flat" or build_params.get("precision", "fp32") != "fp32":
+            raise ValueError("❌ npy bundles hold exact vectors, build a full-precision flat index first")
+        if meta.get("id_scheme") != "content_hash":
+            raise ValueError("❌ npy bundles need an index built with content IDs (embedding.py or ingest.py)")
+        vectors = np.load(vectors_path, mmap_mode="r")
+        ids = np.load(ids_path)
+        if len(vectors) != len(ids) or len(ids) != meta.get("ntotal", len(ids)):
+            raise ValueError("❌ Embedding cache does not match the index, rebuild it first")
+        output = np.lib.format.open_memmap(os.path.join(tmp_dir, VECTORS_FILE), mode="w+", dtype=np.float32,
+                                           shape=vectors.shape)
+        for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+            output[start:start + SEARCH_BLOCK_ROWS] = prepare_vectors(vectors[start:start + SEARCH_BLOCK_ROWS], metric)
+        output.flush()
+        del output
+        np.save(os.path.join(tmp_dir, IDS_FILE), ids.astype(np.int64))
+        dimension, count = vectors.shape[1], len(ids)
+
+    files = {}
+    for name in sorted(os.listdir(tmp_dir)):
+        path = os.path.join(tmp_dir, name)
+        files[name] = {"bytes": os.path.getsize(path), "blake2b": file_checksum(path),
+                       "quick": file_checksum(path, quick=True)}
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": hashlib.blake2b("".join(f["blake2b"] for f in files.values()).encode("ascii"),
+                                   digest_size=8).hexdigest(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "model_name": model_name,
+        "dimension": int(dimension),
+        "metric": metric,
+        "precision": build_params.get("precision", "fp32"),
+        "index_type": meta.get("index_type", "flat"),
+        "id_scheme": meta.get("id_scheme", "position"),
+        "count": int(count),
+        "storage": storage,
+        "build_params": build_params,
+        "search_params": meta.get("search_params", {}),
+        "source": {"path": os.path.basename(index_path), **_file_stat(index_path)},
+        "files": files,
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+
+    # Swap in the complete bundle; processes that still map the old files keep reading them
+    old_dir = bundle_dir.rstrip("/\\") + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(bundle_dir):
+        os.replace(bundle_dir, old_dir)
+    os.replace(tmp_dir, bundle_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+
+def read_manifest(bundle_dir):
+    path = os.path.join(bundle_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"❌ Index bundle manifest not found: {path}")
+    with open(path, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"❌ Unsupported index bundle format {manifest.get('format')}, rebuild with index_bundle.py")
+    return manifest
+
+
+def verify_bundle(bundle_dir, manifest=None, mode="quick"):
+    """
+    Checks the bundle files against the manifest and raises ValueError on a mismatch.
+
+    "quick" compares sizes and the hashes of both file ends, so it costs the
+    same for any index size; "full" hashes every byte; "none" only checks sizes.
+    """
+    if mode not in VERIFY_MODES:
+        raise ValueError(f"❌ Unknown verify mode: {mode}")
+    manifest = manifest or read_manifest(bundle_dir)
+    for name, expected in manifest["files"].items():
+        path = os.path.join(bundle_dir, name)
+        if not os.path.exists(path) or os.path.getsize(path) != expected["bytes"]:
+            raise ValueError(f"❌ Index bundle file missing or truncated: {path}")
+        if mode != "none":
+            key = "quick" if mode == "quick" else "blake2b"
+            if file_checksum(path, quick=mode == "quick") != expected[key]:
+                raise ValueError(f"❌ Index bundle checksum mismatch: {path}")
+    return manifest
+
+
+def is_stale(manifest, bundle_dir):
+    """True if the index the bundle was written from has since been rebuilt next to it."""
+    source = manifest.get("source", {})
+    path = os.path.join(os.path.dirname(os.path.abspath(bundle_dir)), source.get("path", ""))
+    if not source.get("path") or not os.path.exists(path):
+        return False
+    return _file_stat(path) != {"bytes": source["bytes"], "mtime_ns": source["mtime_ns"]}
+
+
+def open_bundle(bundle_dir, model_name=None, verify="quick", nprobe=None, ef_search=None):
+    """
+    Opens a bundle read-only and memory-mapped, after validating its manifest.
+
+    The index pages live in the OS page cache, so every process that opens
+    the same bundle shares one physical copy and opening it does not read the
+    vectors. Raises ValueError if the bundle was built for another model or
+    its files do not match the manifest. Returns (index, meta) like
+    index_factory.load_index.
+    """
+    manifest = verify_bundle(bundle_dir, mode=verify)
+    if model_name is not None and manifest["model_name"] != model_name:
+        raise ValueError(f"❌ Index bundle was built with {manifest['model_name']}, not {model_name}")
+
+    if manifest["storage"] == "faiss":
+        index = faiss.read_index(os.path.join(bundle_dir, INDEX_FILE), mmap_flags())
+        search_params = dict(manifest.get("search_params", {}))
+        if nprobe is not None:
+            search_params["nprobe"] = nprobe
+        if ef_search is not None:
+            search_params["ef_search"] = ef_search
+        set_search_params(index, **search_params)
+    else:
+        index = MmapFlatIndex(np.load(os.path.join(bundle_dir, VECTORS_FILE), mmap_mode="r"),
+                              np.load(os.path.join(bundle_dir, IDS_FILE), mmap_mode="r"), manifest["metric"])
+
+    if index.d != manifest["dimension"] or index.ntotal != manifest["count"]:
+        raise ValueError(f"❌ Index bundle holds {index.ntotal}x{index.d} vectors, manifest says "
+                         f"{manifest['count']}x{manifest['dimension']}")
+    meta = {key: manifest[key] for key in ("index_type", "id_scheme", "dimension", "build_params", "search_params")}
+    meta.update(ntotal=manifest["count"], bundle_version=manifest["version"])
+    return index, meta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write, verify or describe a memory-mappable index bundle.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Data directory holding the built index.")
+    parser.add_argument("--storage", choices=STORAGES, default="faiss", help="FAISS index file or raw NumPy vectors (flat fp32 only).")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME, help="Embedding model recorded in the manifest.")
+    parser.add_argument("--verify", choices=VERIFY_MODES, help="Only verify the existing bundle.")
+    parser.add_argument("--info", action="store_true", help="Only print the manifest of the existing bundle.")
+    args = parser.parse_args()
+
+    paths = data_paths(args.data_dir)
+    bundle_dir = paths["index_bundle"]
+    if args.info:
+        print(json.dumps(read_manifest(bundle_dir), indent=2))
+    elif args.verify:
+        start = time.perf_counter()
+        manifest = verify_bundle(bundle_dir, mode=args.verify)
+        print(f"✅ Bundle {manifest['version']} verified ({args.verify}) in {1000 * (time.perf_counter() - start):.1f} ms")
+    else:
+        manifest = write_bundle(bundle_dir, paths["embeddings_index"], args.model, args.storage,
+                                paths["embedding_vectors"], paths["embedding_ids"])
+        print(f"✅ Bundle {manifest['version']} written to {bundle_dir} "
+              f"({manifest['count']} vectors, {manifest['index_type']}, {manifest['storage']})")
@@ -0,0 +1,367 @@
+import json
+import math
+import os
+import time
+import faiss
+import numpy as np
+from vector_math import DEFAULT_METRIC, DEFAULT_RERANK_FACTOR, prepare_vectors, rerank_exact
+
+# Supported FAISS index types, similarity metrics and vector storage precisions
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+METRICS = ("ip", "l2")  # "ip": inner product of L2-normalized vectors (cosine), "l2": Euclidean distance
+PRECISIONS = ("fp32", "fp16", "int8")  # fp16 / int8 store scalar-quantized vectors (2x / 4x smaller)
+
+# Default build and query-time settings
+DEFAULT_PQ_M = 16  # Sub-quantizers per vector (must divide the embedding dimension)
+DEFAULT_PQ_NBITS = 8  # Bits per sub-quantizer code
+DEFAULT_HNSW_M = 32  # Graph neighbours per node
+DEFAULT_EF_CONSTRUCTION = 200
+DEFAULT_NPROBE = 8  # IVF lists scanned per query
+DEFAULT_EF_SEARCH = 64  # HNSW candidate list size per query
+DEFAULT_PRECISION = "fp32"
+ADD_BLOCK_ROWS = 65536  # Vectors normalized and added to an index at a time
+MAX_TRAIN_VECTORS = 262144  # Vectors sampled for training IVF / PQ / scalar quantizers
+
+_FAISS_METRICS = {"ip": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+_SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+
+
+def default_nlist(num_vectors):
+    """Number of IVF lists: ~4·sqrt(n), keeping at least 39 training points per list."""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+
+def meta_path(index_path):
+    """Path of the JSON file stored alongside a FAISS index."""
+    return index_path + ".json"
+
+
+def create_index(dimension, index_type="flat", num_vectors=0, nlist=None,
+                 pq_m=DEFAULT_PQ_M, pq_nbits=DEFAULT_PQ_NBITS,
+                 hnsw_m=DEFAULT_HNSW_M, ef_construction=DEFAULT_EF_CONSTRUCTION,
+                 metric=DEFAULT_METRIC, precision=DEFAULT_PRECISION):
+    """
+    Creates an empty FAISS index of the requested type, metric and storage precision.
+
+    Returns the index and the build parameters that were actually used, so
+    they can be stored next to the index.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"❌ Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    if metric not in METRICS:
+        raise ValueError(f"❌ Unknown metric '{metric}', expected one of {METRICS}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"❌ Unknown precision '{precision}', expected one of {PRECISIONS}")
+    if index_type == "ivf_pq" and precision != "fp32":
+        raise ValueError("❌ ivf_pq already stores compressed PQ codes, use precision fp32")
+
+    faiss_metric = _FAISS_METRICS[metric]
+    params = {"metric": metric, "precision": precision}
+    if index_type == "flat":
+        if precision == "fp32":
+            index = faiss.IndexFlatIP(dimension) if metric == "ip" else faiss.IndexFlatL2(dimension)
+        else:
+            index = faiss.IndexScalarQuantizer(dimension, _SQ_TYPES[precision], faiss_metric)
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(num_vectors)
+        quantizer = faiss.IndexFlatIP(dimension) if metric == "ip" else faiss.IndexFlatL2(dimension)
+        params["nlist"] = nlist
+        if index_type == "ivf_flat" and precision == "fp32":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss_metric)
+        elif index_type == "ivf_flat":
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, _SQ_TYPES[precision], faiss_metric)
+        else:
+            if dimension % pq_m:
+                raise ValueError(f"❌ pq_m={pq_m} must divide the embedding dimension {dimension}")
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits, faiss_metric)
+            params.update(pq_m=pq_m, pq_nbits=pq_nbits)
+    else:
+        if precision == "fp32":
+            index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss_metric)
+        else:
+            index = faiss.IndexHNSWSQ(dimension, _SQ_TYPES[precision], hnsw_m, faiss_metric)
+        index.hnsw.efConstruction = ef_construction
+        params.update(hnsw_m=hnsw_m, ef_construction=ef_construction)
+
+    return index, params
+
+
+def train_index(index, embeddings):
+    """Trains IVF / PQ / scalar quantizer indexes on the given vectors (no-op for float Flat and HNSW)."""
+    if index.is_trained:
+        return
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        if embeddings.shape[0] < base.nlist:
+            raise ValueError(f"❌ Need at least {base.nlist} vectors to train {base.nlist} IVF lists, got {embeddings.shape[0]}")
+    index.train(embeddings)
+
+
+def with_ids(index, index_type):
+    """
+    Makes an index accept explicit int64 IDs.
+
+    IVF indexes store IDs natively (and support removal); Flat and HNSW are
+    wrapped in IndexIDMap2.
+    """
+    return index if index_type in ("ivf_flat", "ivf_pq") else faiss.IndexIDMap2(index)
+
+
+def supports_removal(index_type):
+    """Whether vectors can be deleted from an index of this type (HNSW graphs cannot)."""
+    return index_type != "hnsw"
+
+
+def add_vectors(index, embeddings, ids=None, metric=DEFAULT_METRIC, block_rows=ADD_BLOCK_ROWS):
+    """
+    Adds vectors (optionally under explicit IDs) block by block.
+
+    Only one block is normalized in memory at a time, so embeddings can be a
+    memory map much larger than RAM.
+    """
+    for start in range(0, embeddings.shape[0], block_rows):
+        block = prepare_vectors(embeddings[start:start + block_rows], metric)
+        if ids is None:
+            index.add(block)
+        else:
+            index.add_with_ids(block, np.ascontiguousarray(ids[start:start + block_rows], dtype=np.int64))
+
+
+def build_index(embeddings, index_type="flat", ids=None, **build_params):
+    """
+    Creates, trains and fills an index of the requested type.
+
+    With ids, vectors are stored under those IDs instead of their row numbers.
+    Vectors are L2-normalized first for the (default) inner product metric.
+    Training uses at most MAX_TRAIN_VECTORS sampled rows and vectors are
+    added in blocks, so embeddings may be a memory map.
+    """
+    metric = build_params.get("metric", DEFAULT_METRIC)
+    num_vectors = embeddings.shape[0]
+    index, params = create_index(embeddings.shape[1], index_type, num_vectors=num_vectors, **build_params)
+    if not index.is_trained:
+        sample = np.arange(num_vectors) if num_vectors <= MAX_TRAIN_VECTORS else \
+            np.sort(np.random.default_rng(0).choice(num_vectors, MAX_TRAIN_VECTORS, replace=False))
+        train_index(index, prepare_vectors(embeddings[sample], metric))
+    if ids is not None:
+        index = with_ids(index, index_type)
+    add_vectors(index, embeddings, ids, metric)
+    return index, params
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Applies query-time settings (nprobe for IVF, efSearch for HNSW) where the index supports them."""
+    space = faiss.ParameterSpace()
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else faiss.downcast_index(index)
+
+    if nprobe is not None and isinstance(base, faiss.IndexIVF):
+        space.set_index_parameter(index, "nprobe", nprobe)
+    if ef_search is not None and isinstance(base, faiss.IndexHNSW):
+        space.set_index_parameter(index, "efSearch", ef_search)
+
+
+def default_search_params(index_type):
+    """Query-time settings stored for a newly built index."""
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return {"nprobe": DEFAULT_NPROBE}
+    if index_type == "hnsw":
+        return {"ef_search": DEFAULT_EF_SEARCH}
+    return {}
+
+
+def save_index(index, index_path, index_type, build_params=None, search_params=None, id_scheme="position"):
+    """
+    Writes the FAISS index and its type and settings alongside it.
+
+    id_scheme records what search results mean: "position" (row number in
+    the chunk list) or "content_hash" (chunks.chunk_id of the chunk text).
+    """
+    faiss.write_index(index, index_path)
+    meta = {
+        "index_type": index_type,
+        "id_scheme": id_scheme,
+        "dimension": index.d,
+        "ntotal": index.ntotal,
+        "build_params": build_params or {},
+        "search_params": search_params if search_params is not None else default_search_params(index_type),
+    }
+    with open(meta_path(index_path), "w", encoding="utf-8") as file:
+        json.dump(meta, file, indent=2)
+    return meta
+
+
+def load_index_meta(index_path):
+    """Reads the settings stored next to an index (indexes built before they existed are Flat)."""
+    if not os.path.exists(meta_path(index_path)):
+        return {"index_type": "flat", "id_scheme": "position", "build_params": {"metric": "l2", "precision": "fp32"},
+                "search_params": {}}
+    with open(meta_path(index_path), "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def load_index(index_path, nprobe=None, ef_search=None):
+    """
+    Loads a FAISS index and applies its stored query-time settings.
+
+    Explicit nprobe / ef_search arguments override the stored values.
+    """
+    index = faiss.read_index(index_path)
+    meta = load_index_meta(index_path)
+    search_params = dict(meta.get("search_params", {}))
+    if nprobe is not None:
+        search_params["nprobe"] = nprobe
+    if ef_search is not None:
+        search_params["ef_search"] = ef_search
+    set_search_params(index, **search_params)
+    return index, meta
+
+
+def index_bytes(index):
+    """Serialized size of an index, a close proxy for its memory footprint."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def _search_latency(index, queries, k):
+    """Searches one query at a time, returning result ids and per-query latencies in milliseconds."""
+    ids = np.empty((queries.shape[0], k), dtype=np.int64)
+    latencies = np.empty(queries.shape[0])
+    for i in range(queries.shape[0]):
+        start = time.perf_counter()
+        _, ids[i:i + 1] = index.search(queries[i:i + 1], k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return ids, latencies
+
+
+def recall_at_k(ids, ground_truth):
+    """Mean fraction of the exact top-k neighbours found in the approximate top-k."""
+    k = ground_truth.shape[1]
+    hits = [len(np.intersect1d(found, exact)) for found, exact in zip(ids, ground_truth)]
+    return float(np.mean(hits)) / k
+
+
+def recall_report(embeddings, queries, configs, k=10):
+    """
+    Measures recall@k and query latency of each index configuration against exact Flat search.
+
+    Each config is a dict with "index_type", optional build parameters, and
+    optional lists "nprobe" / "ef_search" of query-time values to sweep.
+    Returns one row per (config, query-time setting).
+    """
+    embeddings = prepare_vectors(embeddings)
+    queries = prepare_vectors(queries)
+
+    exact, _ = build_index(embeddings, "flat")
+    ground_truth, flat_latencies = _search_latency(exact, queries, k)
+    rows = [{"index_type": "flat", "build_params": {}, "search_params": {}, "build_seconds": 0.0,
+             "recall": 1.0, "p50_ms": float(np.percentile(flat_latencies, 50)),
+             "p95_ms": float(np.percentile(flat_latencies, 95))}]
+
+    for config in configs:
+        config = dict(config)
+        index_type = config.pop("index_type")
+        nprobes = config.pop("nprobe", [None])
+        ef_searches = config.pop("ef_search", [None])
+
+        start = time.perf_counter()
+        index, build_params = build_index(embeddings, index_type, **config)
+        build_seconds = time.perf_counter() - start
+
+        for nprobe in nprobes:
+            for ef_search in ef_searches:
+                set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+                ids, latencies = _search_latency(index, queries, k)
+                search_params = {key: value for key, value in (("nprobe", nprobe), ("ef_search", ef_search)) if value is not None}
+                rows.append({
+                    "index_type": index_type,
+                    "build_params": build_params,
+                    "search_params": search_params,
+                    "build_seconds": build_seconds,
+                    "recall": recall_at_k(ids, ground_truth),
+                    "p50_ms": float(np.percentile(latencies, 50)),
+                    "p95_ms": float(np.percentile(latencies, 95)),
+                })
+
+    return rows
+
+
+def precision_report(embeddings, queries, k=10, index_type="flat", rerank_factor=DEFAULT_RERANK_FACTOR, **build_params):
+    """
+    Measures what each storage precision costs in recall and saves in memory.
+
+    Every precision is compared with exact fp32 search over the same vectors,
+    with and without exact re-ranking of rerank_factor * k candidates from
+    the full-precision vectors. Returns one row per (precision, re-rank).
+    """
+    from chunks import ChunkIdLookup
+
+    metric = build_params.get("metric", DEFAULT_METRIC)
+    embeddings = prepare_vectors(embeddings, metric)
+    queries = prepare_vectors(queries, metric)
+    ids = np.arange(embeddings.shape[0], dtype=np.int64)
+    lookup = ChunkIdLookup(ids)
+
+    exact, _ = build_index(embeddings, "flat", metric=metric)
+    ground_truth, _ = _search_latency(exact, queries, k)
+
+    rows = []
+    for precision in PRECISIONS:
+        if index_type == "ivf_pq" and precision != "fp32":
+            continue
+        start = time.perf_counter()
+        index, params = build_index(embeddings, index_type, ids=ids, precision=precision, **build_params)
+        build_seconds = time.perf_counter() - start
+        set_search_params(index, **default_search_params(index_type))
+        size = index_bytes(index)
+
+        for rerank in ((False, True) if precision != "fp32" or index_type == "ivf_pq" else (False,)):
+            latencies = np.empty(queries.shape[0])
+            found = np.empty((queries.shape[0], k), dtype=np.int64)
+            for i in range(queries.shape[0]):
+                start = time.perf_counter()
+                _, labels = index.search(queries[i:i + 1], k * rerank_factor if rerank else k)
+                if rerank:
+                    _, labels = rerank_exact(queries[i:i + 1], labels, embeddings, lookup, k, metric)
+                found[i] = labels[0, :k]
+                latencies[i] = (time.perf_counter() - start) * 1000
+            rows.append({"index_type": index_type, "precision": precision, "rerank": rerank,
+                         "build_params": params, "memory_mb": size / 2**20, "build_seconds": build_seconds,
+                         "recall": recall_at_k(found, ground_truth),
+                         "p50_ms": float(np.percentile(latencies, 50)),
+                         "p95_ms": float(np.percentile(latencies, 95))})
+    return rows
+
+
+def format_precision_report(rows, k=10):
+    """Formats precision_report() rows as a text table."""
+    base = next((row["memory_mb"] for row in rows if row["precision"] == "fp32"), None)
+    lines = [f"{'index':<10} {'precision':<10} {'rerank':<7} {'memory MB':>10} {'vs fp32':>8} "
+             f"{'recall@' + str(k):>9} {'p50 ms':>8} {'p95 ms':>8}"]
+    for row in rows:
+        ratio = f"{base / row['memory_mb']:.1f}x" if base and row["memory_mb"] else "-"
+        lines.append(f"{row['index_type']:<10} {row['precision']:<10} {'yes' if row['rerank'] else 'no':<7} "
+                     f"{row['memory_mb']:>10.2f} {ratio:>8} {row['recall']:>9.3f} "
+                     f"{row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f}")
+    return "\n".join(lines)
+
+
+def default_benchmark_configs(num_vectors, dimension):
+    """A sweep over every index type with a few query-time settings each."""
+    configs = [{"index_type": "hnsw", "ef_search": [16, 32, 64, 128]}]
+    nlist = default_nlist(num_vectors)
+    nprobes = sorted({p for p in (1, 4, 8, 16, 32) if p <= nlist})
+    if nlist > 1:
+        configs.append({"index_type": "ivf_flat", "nprobe": nprobes})
+        if dimension % DEFAULT_PQ_M == 0 and num_vectors >= 2 ** DEFAULT_PQ_NBITS:
+            configs.append({"index_type": "ivf_pq", "nprobe": nprobes})
+    return configs
+
+
+def format_report(rows, k=10):
+    """Formats recall_report() rows as a text table."""
+    lines = [f"{'index':<10} {'build params':<34} {'search':<16} {'recall@' + str(k):>9} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8}"]
+    for row in rows:
+        build = ", ".join(f"{key}={value}" for key, value in row["build_params"].items())
+        search = ", ".join(f"{key}={value}" for key, value in row["search_params"].items())
+        lines.append(f"{row['index_type']:<10} {build:<34} {search:<16} {row['recall']:>9.3f} "
+                     f"{row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f} {row['build_seconds']:>8.2f}")
+    return "\n".join(lines)
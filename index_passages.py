@@ -1,57 +1,169 @@
-from elasticsearch import Elasticsearch
+import argparse
+import hashlib
 import json
-from sentence_transformers import SentenceTransformer
 import os
+import time
+import numpy as np
+from elasticsearch import Elasticsearch, helpers
+from config import EMBEDDING_MODEL_NAME
+from encoders import load_encoder
+from chunk_store import ChunkStore
 
-# Connect to Elasticsearch
-es = Elasticsearch("http://localhost:9200")
+# Elasticsearch connection (override with ES_URL or --es-url, e.g. to point at a local stand-in server)
+ES_URL = os.environ.get("ES_URL", "http://localhost:9200")
+INDEX_NAME = "slm_index"
 
-# Load passages from book.json
-book_path = r"K:\slm_project\data\book.json"
-if not os.path.exists(book_path):
-    raise FileNotFoundError(f"❌ File not found: {book_path}")
+# Passages come from the shared, memory-mapped chunk store (written by generate_book_json.py)
+CHUNK_STORE_PATH = r"K:\slm_project\data\chunks"
+CHECKPOINT_PATH = r"K:\slm_project\data\index_passages.checkpoint.json"
 
-with open(book_path, "r", encoding="utf-8") as f:
-    book_data = json.load(f)
+# Bulk-loading defaults
+ENCODE_BATCH_SIZE = 256  # Passages encoded per model call
+BULK_CHUNK_SIZE = 500  # Documents per bulk request
+BULK_THREADS = 4  # Concurrent bulk requests (parallel_bulk)
+CHECKPOINT_EVERY = 5000  # Documents between checkpoint writes
 
-# Ensure the data is a list of dictionaries
-if not isinstance(book_data, list):
-    raise ValueError("❌ Expected JSON to be a list of dictionaries!")
 
-# Extract passages (only text fields)
-passages = [entry["text"] for entry in book_data if "text" in entry]
+def store_fingerprint(passages):
+    """Identifies the chunk store contents, so a checkpoint is only reused for the same passages."""
+    return hashlib.blake2b(np.ascontiguousarray(passages.ids).tobytes(), digest_size=16).hexdigest()
 
-if not passages:
-    raise ValueError("❌ No valid passages found in book.json!")
 
-# Load embedding model
-model = SentenceTransformer("all-MiniLM-L6-v2")
+def load_checkpoint(checkpoint_path, index_name, fingerprint):
+    """Position to resume from, or 0 if there is no matching checkpoint."""
+    if not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path, "r", encoding="utf-8") as file:
+        checkpoint = json.load(file)
+    if checkpoint.get("index") != index_name or checkpoint.get("fingerprint") != fingerprint:
+        print("⚠️ Checkpoint belongs to a different index or chunk store, starting from 0.")
+        return 0
+    return checkpoint["next_position"]
 
-def index_passages():
-    index_name = "slm_index"
 
-    # Create index with mapping if it doesn’t exist (Fixing deprecated `exists()` usage)
-    if not es.indices.exists(index=index_name, allow_no_indices=True):
-        es.indices.create(index=index_name, body={
-            "mappings": {
-                "properties": {
-                    "text": {"type": "text"},
-                    "embedding": {"type": "dense_vector", "dims": 384}  # Adjust for model
-                }
+def save_checkpoint(checkpoint_path, index_name, fingerprint, next_position):
+    with open(checkpoint_path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump({"index": index_name, "fingerprint": fingerprint, "next_position": next_position}, file)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+def create_index(es, index_name, dims):
+    """Create index with mapping if it doesn’t exist."""
+    if not es.indices.exists(index=index_name):
+        es.indices.create(index=index_name, mappings={
+            "properties": {
+                "text": {"type": "text"},
+                "chunk_id": {"type": "long"},
+                "position": {"type": "integer"},
+                "embedding": {"type": "dense_vector", "dims": dims}
             }
         })
 
-    for i, passage in enumerate(passages):
-        embedding = model.encode(passage).tolist()
-        
-        doc = {
-            "text": passage,
-            "embedding": embedding
-        }
-        es.index(index=index_name, id=i, document=doc)
-    
-    print(f"✅ Indexed {len(passages)} passages into Elasticsearch.")
-
-# Run indexing
-index_passages()
-print(f"📦 Total passages loaded: {len(passages)}")
+
+def begin_bulk_load(es, index_name):
+    """Disables refreshes and replicas for the load, returning the settings to restore afterwards."""
+    settings = es.indices.get_settings(index=index_name)[index_name]["settings"]["index"]
+    original = {
+        "refresh_interval": settings.get("refresh_interval", "1s"),
+        "number_of_replicas": settings.get("number_of_replicas", "1"),
+    }
+    es.indices.put_settings(index=index_name, settings={"refresh_interval": "-1", "number_of_replicas": 0})
+    return original
+
+
+def end_bulk_load(es, index_name, original):
+    """Restores refresh / replica settings and makes the loaded documents searchable."""
+    es.indices.put_settings(index=index_name, settings=original)
+    es.indices.refresh(index=index_name)
+
+
+def iter_actions(passages, model, index_name, start=0, encode_batch_size=ENCODE_BATCH_SIZE):
+    """Yields bulk index actions, encoding passages a batch at a time."""
+    for batch_start in range(start, len(passages), encode_batch_size):
+        batch_end = min(batch_start + encode_batch_size, len(passages))
+        texts = passages[batch_start:batch_end]
+        embeddings = model.encode(texts, batch_size=min(encode_batch_size, 64), convert_to_numpy=True)
+
+        for position, text, embedding in zip(range(batch_start, batch_end), texts, embeddings):
+            chunk_id = int(passages.ids[position])
+            yield {
+                "_index": index_name,
+                "_id": str(chunk_id),  # Content ID, the same label FAISS returns
+                "_source": {"text": text, "chunk_id": chunk_id, "position": position, "embedding": embedding.tolist()},
+            }
+
+
+def index_passages(es, passages, model, index_name=INDEX_NAME, chunk_size=BULK_CHUNK_SIZE,
+                   thread_count=BULK_THREADS, encode_batch_size=ENCODE_BATCH_SIZE,
+                   start=0, checkpoint_path=None):
+    """
+    Bulk-indexes passages from position start onwards.
+
+    Documents stream from batched encoding into helpers.parallel_bulk (or
+    streaming_bulk with one thread). Progress is checkpointed so a failed
+    run can resume from the last acknowledged document.
+    """
+    create_index(es, index_name, model.get_sentence_embedding_dimension())
+    fingerprint = store_fingerprint(passages) if checkpoint_path else None
+
+    actions = iter_actions(passages, model, index_name, start, encode_batch_size)
+    if thread_count > 1:
+        results = helpers.parallel_bulk(es, actions, thread_count=thread_count, chunk_size=chunk_size)
+    else:
+        results = helpers.streaming_bulk(es, actions, chunk_size=chunk_size)
+
+    original = begin_bulk_load(es, index_name)
+    started = time.perf_counter()
+    next_position = start
+    try:
+        # Results come back in action order, so each success advances the resume point by one
+        for ok, info in results:
+            next_position += 1
+            if checkpoint_path and (next_position - start) % CHECKPOINT_EVERY == 0:
+                save_checkpoint(checkpoint_path, index_name, fingerprint, next_position)
+            if (next_position - start) % chunk_size == 0 or next_position == len(passages):
+                elapsed = time.perf_counter() - started
+                print(f"📦 {next_position}/{len(passages)} passages indexed "
+                      f"({(next_position - start) / elapsed:.0f} docs/s)", flush=True)
+    finally:
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, index_name, fingerprint, next_position)
+        end_bulk_load(es, index_name, original)
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Indexed {next_position - start} passages into Elasticsearch in {elapsed:.1f}s "
+          f"({(next_position - start) / max(elapsed, 1e-9):.0f} docs/s).")
+    return next_position
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-index chunk store passages into Elasticsearch.")
+    parser.add_argument("--es-url", default=ES_URL, help="Elasticsearch URL.")
+    parser.add_argument("--index", default=INDEX_NAME, help="Target index name.")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE, help="Documents per bulk request.")
+    parser.add_argument("--threads", type=int, default=BULK_THREADS, help="Concurrent bulk requests.")
+    parser.add_argument("--encode-batch-size", type=int, default=ENCODE_BATCH_SIZE, help="Passages encoded per model call.")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint.")
+    parser.add_argument("--start", type=int, help="Start at this passage position (overrides --resume).")
+    args = parser.parse_args()
+
+    es = Elasticsearch(args.es_url)
+    passages = ChunkStore(CHUNK_STORE_PATH)
+    if not len(passages):
+        raise ValueError("❌ No valid passages found in the chunk store!")
+
+    start = args.start or 0
+    if args.start is None and args.resume:
+        start = load_checkpoint(CHECKPOINT_PATH, args.index, store_fingerprint(passages))
+        print(f"♻️ Resuming from passage {start}")
+
+    # Load embedding model
+    model = load_encoder(model_name=EMBEDDING_MODEL_NAME)
+
+    index_passages(es, passages, model, args.index, chunk_size=args.chunk_size, thread_count=args.threads,
+                   encode_batch_size=args.encode_batch_size, start=start, checkpoint_path=CHECKPOINT_PATH)
+    print(f"📦 Total passages loaded: {len(passages)}")
+
+
+if __name__ == "__main__":
+    main()
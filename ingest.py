@@ -0,0 +1,428 @@
+import argparse
+import os
+import queue
+import threading
+import time
+from array import array
+import numpy as np
+import metrics
+from config import (BOOK_PATH, CHUNK_MAX_TOKENS, DATA_DIR, DEDUP_THRESHOLD, EMBEDDING_MODEL_NAME, ENCODER_BACKEND,
+                    SHARDS_DIR, data_paths)
+from chunks import chunk_id
+from chunk_store import ChunkStoreWriter
+from index_factory import (INDEX_TYPES, PRECISIONS, build_index, create_index, default_search_params, save_index,
+                           with_ids)
+from vector_math import normalize
+
+# Pipeline defaults
+QUEUE_SIZE = 64  # Items buffered between two stages
+EMBED_BATCH_SIZE = 128  # Chunks encoded per batch
+COPY_BLOCK_ROWS = 65536  # Rows copied at a time when finalizing .npy files
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Raised inside a stage when another stage failed and the pipeline is shutting down."""
+
+
+class StageStats:
+    """Items produced and wall time of one pipeline stage."""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.started = None
+        self.finished = None
+
+    @property
+    def seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def __str__(self):
+        rate = self.items / self.seconds if self.seconds else 0.0
+        return f"{self.name:<11} {self.items:>9} {self.unit:<10} {self.seconds:>8.1f}s {rate:>10.1f} {self.unit}/s"
+
+
+class Pipeline:
+    """
+    Runs generator stages on their own threads, connected by bounded queues.
+
+    Each stage is a function taking an iterable of its inputs (the first
+    stage takes none) and yielding outputs. Bounded queues keep memory flat:
+    a fast stage blocks once its consumer falls QUEUE_SIZE items behind. If
+    any stage fails, the others stop and the error is re-raised by run().
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.stages = []
+        self.stats = []
+        self._stop = threading.Event()
+        self._errors = []
+
+    def add(self, name, fn, unit="items", count=None):
+        """Appends a stage; count(item) gives how many units an output item stands for (default 1)."""
+        self.stages.append((fn, count or (lambda item: 1)))
+        self.stats.append(StageStats(name, unit))
+        return self
+
+    def _put(self, outbox, item):
+        while not self._stop.is_set():
+            try:
+                outbox.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _Stopped()
+
+    def _drain(self, inbox):
+        while True:
+            try:
+                item = inbox.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise _Stopped()
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _run_stage(self, position, inbox, outbox):
+        fn, count = self.stages[position]
+        stats = self.stats[position]
+        stats.started = time.perf_counter()
+        failed = False
+        try:
+            outputs = fn(self._drain(inbox)) if inbox is not None else fn()
+            for item in outputs:
+                stats.items += count(item)
+                if outbox is not None:
+                    self._put(outbox, item)
+            if outbox is not None:
+                self._put(outbox, _DONE)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            failed = True
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            stats.finished = time.perf_counter()
+            metrics.observe("ingest", stats.seconds, error=failed, step=stats.name)
+            metrics.count("ingest", stats.items, step=stats.name)
+
+    def run(self):
+        queues = [None] + [queue.Queue(self.queue_size) for _ in self.stages[1:]] + [None]
+        threads = [threading.Thread(target=self._run_stage, args=(i, queues[i], queues[i + 1]),
+                                    name=f"ingest-{self.stats[i].name}", daemon=True)
+                   for i in range(len(self.stages))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+        return self.stats
+
+
+class NpyStreamWriter:
+    """Appends float32 rows to a .npy file without knowing the row count up front."""
+
+    def __init__(self, path, dimension):
+        self.path = path
+        self.dimension = dimension
+        self.rows = 0
+        self._raw = open(path + ".raw", "wb")
+
+    def append(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=np.float32).reshape(-1, self.dimension)
+        self._raw.write(rows.tobytes())
+        self.rows += rows.shape[0]
+
+    def close(self):
+        """Copies the raw rows into a proper .npy file block by block, so memory stays flat."""
+        self._raw.close()
+        output = np.lib.format.open_memmap(self.path + ".tmp.npy", mode="w+", dtype=np.float32,
+                                           shape=(self.rows, self.dimension))
+        if self.rows:
+            raw = np.memmap(self.path + ".raw", dtype=np.float32, mode="r", shape=(self.rows, self.dimension))
+            for start in range(0, self.rows, COPY_BLOCK_ROWS):
+                output[start:start + COPY_BLOCK_ROWS] = raw[start:start + COPY_BLOCK_ROWS]
+            del raw
+        output.flush()
+        del output
+        os.remove(self.path + ".raw")
+        os.replace(self.path + ".tmp.npy", self.path)
+        return np.load(self.path, mmap_mode="r")
+
+    def abort(self):
+        """Closes and deletes the partly written files."""
+        self._raw.close()
+        for path in (self.path + ".raw", self.path + ".tmp.npy"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class EmbeddedBatch:
+    """A batch of chunks with their chunk vectors (first occurrences only) and sentence vectors."""
+
+    def __init__(self, texts, ids, vector_ids, vectors, sentences, sentence_counts, sentence_vectors):
+        self.texts = texts
+        self.ids = ids
+        self.vector_ids = vector_ids
+        self.vectors = vectors
+        self.sentences = sentences
+        self.sentence_counts = sentence_counts
+        self.sentence_vectors = sentence_vectors
+
+    def __len__(self):
+        return len(self.texts)
+
+
+class IndexWriter:
+    """
+    Final stage: appends embedded batches to the chunk store, FAISS index,
+    embedding cache and sentence index, all laid out as retrieval.py and
+    embedding.py expect.
+
+    Flat and HNSW indexes are filled batch by batch; IVF and int8 indexes
+    need training, so they are built at the end from the memory-mapped vectors.
+    """
+
+    def __init__(self, paths, dimension, index_type="flat", precision="fp32"):
+        self.paths = paths
+        self.index_type = index_type
+        self.precision = precision
+        self.chunks = ChunkStoreWriter(paths["chunk_store"])
+        self.vectors = NpyStreamWriter(paths["embedding_vectors"], dimension)
+        self.vector_ids = array("q")
+        self.sentence_vectors = NpyStreamWriter(paths["sentence_embeddings"], dimension)
+        self.sentence_offsets = array("q", [0])
+        self.chunk_ids = array("q")
+        self._sentences = open(paths["sentences"] + ".tmp", "w", encoding="utf-8")
+
+        self.build_params = {}
+        self.index = None
+        if index_type not in ("ivf_flat", "ivf_pq"):
+            index, self.build_params = create_index(dimension, index_type, precision=precision)
+            if index.is_trained:
+                self.index = with_ids(index, index_type)
+
+    def add(self, batch):
+        for text, cid, count in zip(batch.texts, batch.ids, batch.sentence_counts):
+            self.chunks.append(text, cid)
+            self.chunk_ids.append(cid)
+            self.sentence_offsets.append(self.sentence_offsets[-1] + count)
+        for sentence in batch.sentences:
+            self._sentences.write(sentence + "\n")
+        self.sentence_vectors.append(batch.sentence_vectors)
+
+        if len(batch.vector_ids):
+            self.vectors.append(batch.vectors)
+            self.vector_ids.extend(batch.vector_ids)
+            if self.index is not None:
+                self.index.add_with_ids(np.ascontiguousarray(batch.vectors, dtype=np.float32), np.asarray(batch.vector_ids, dtype=np.int64))
+
+    def close(self):
+        self.chunks.close()
+        self._sentences.close()
+        os.replace(self.paths["sentences"] + ".tmp", self.paths["sentences"])
+        self.sentence_vectors.close()
+        np.save(self.paths["sentence_offsets"], np.frombuffer(self.sentence_offsets, dtype=np.int64))
+        np.save(self.paths["sentence_chunk_ids"], np.frombuffer(self.chunk_ids, dtype=np.int64))
+
+        vectors = self.vectors.close()
+        vector_ids = np.frombuffer(self.vector_ids, dtype=np.int64)
+        np.save(self.paths["embedding_ids"], vector_ids)
+
+        if self.index is None:
+            print(f"⚡ Training and filling {self.index_type} index from {len(vector_ids)} vectors...")
+            self.index, self.build_params = build_index(vectors, self.index_type, ids=vector_ids, precision=self.precision)
+        return save_index(self.index, self.paths["embeddings_index"], self.index_type, self.build_params,
+                          default_search_params(self.index_type), id_scheme="content_hash")
+
+    def abort(self):
+        """Closes every output and deletes their temporary files after a failed run; earlier outputs stay."""
+        self.chunks.abort()
+        self.vectors.abort()
+        self.sentence_vectors.abort()
+        self._sentences.close()
+        if os.path.exists(self.paths["sentences"] + ".tmp"):
+            os.remove(self.paths["sentences"] + ".tmp")
+
+
+def _tee(items, path, separator):
+    """Passes items through while writing them to an intermediate file."""
+    with open(path, "w", encoding="utf-8") as file:
+        for item in items:
+            file.write(item + separator)
+            yield item
+
+
+def run_ingest(pdf_path=BOOK_PATH, data_dir=DATA_DIR, index_type="flat", workers=None,
+               batch_size=EMBED_BATCH_SIZE, queue_size=QUEUE_SIZE, skip_first_n_pages=2,
+               chunk_size=CHUNK_MAX_TOKENS, keep_intermediate=False, build_bm25=False, model=None,
+               precision="fp32", encoder_backend=ENCODER_BACKEND, dedup_threshold=DEDUP_THRESHOLD,
+               bundle_storage=None):
+    """
+    Runs the whole ingestion pipeline for one book:
+    page → cleaned paragraph → chunk → near-duplicate filter → embedding batch → index writer.
+
+    Chunks with estimated Jaccard similarity of at least dedup_threshold to
+    an earlier chunk are not indexed; chunk_sources.npy maps every source
+    chunk to the chunk it collapsed into. dedup_threshold=None keeps all.
+    bundle_storage ("faiss" or "npy") also writes an index bundle that
+    retrieval.py opens memory-mapped.
+
+    Returns the per-stage statistics.
+    """
+    from nltk.tokenize import sent_tokenize
+    from dedup import NearDuplicateFilter
+    from preprocessing import preprocess_iter
+    from text_extraction import iter_pages, iter_paragraphs
+    from tokenization import iter_chunks
+
+    if model is None:
+        from encoders import load_encoder
+
+        print(f"📥 Loading SBERT model for embeddings ({encoder_backend})...")
+        model = load_encoder(encoder_backend, EMBEDDING_MODEL_NAME)
+
+    os.makedirs(data_dir, exist_ok=True)
+    paths = data_paths(data_dir)
+    writer = IndexWriter(paths, model.get_sentence_embedding_dimension(), index_type, precision)
+
+    def extract():
+        paragraphs = iter_paragraphs(iter_pages(pdf_path, skip_first_n_pages, workers))
+        return _tee(paragraphs, paths["extracted_text"], "\n\n") if keep_intermediate else paragraphs
+
+    def preprocess(paragraphs):
+        lines = (line for paragraph in paragraphs for line in paragraph.split("\n"))
+        cleaned = (text for text in preprocess_iter(lines, lowercase=True, workers=workers) if text)
+        return _tee(cleaned, paths["preprocessed_text"], "\n") if keep_intermediate else cleaned
+
+    def chunk(lines):
+        chunks = iter_chunks((sentence for line in lines for sentence in sent_tokenize(line)), chunk_size=chunk_size)
+        return _tee(chunks, paths["tokenized_chunks"], "\n\n") if keep_intermediate else chunks
+
+    near_duplicates = NearDuplicateFilter(dedup_threshold) if dedup_threshold else None
+
+    def dedup(chunks):
+        return near_duplicates.filter(chunks)
+
+    def embed(chunks):
+        seen = set()
+
+        def encode_batch(texts):
+            texts = [text.strip() for text in texts]
+            ids = [chunk_id(text) for text in texts]
+            fresh = [i for i, cid in enumerate(ids) if cid not in seen and not seen.add(cid)]
+            vectors = normalize(model.encode([texts[i] for i in fresh], batch_size=64, convert_to_numpy=True)) if fresh else np.zeros((0,))
+
+            per_chunk = [[" ".join(s.split()) for s in sent_tokenize(text) if s.strip()] for text in texts]
+            sentences = [s for chunk_sentences in per_chunk for s in chunk_sentences]
+            sentence_vectors = normalize(model.encode(sentences, batch_size=64, convert_to_numpy=True)) if sentences else np.zeros((0,))
+            return EmbeddedBatch(texts, ids, [ids[i] for i in fresh], vectors,
+                                 sentences, [len(s) for s in per_chunk], sentence_vectors)
+
+        batch = []
+        for text in chunks:
+            batch.append(text)
+            if len(batch) >= batch_size:
+                yield encode_batch(batch)
+                batch = []
+        if batch:
+            yield encode_batch(batch)
+
+    def write(batches):
+        for batch in batches:
+            writer.add(batch)
+            yield batch
+
+    pipeline = Pipeline(queue_size)
+    pipeline.add("extract", extract, "paragraphs")
+    pipeline.add("preprocess", preprocess, "lines")
+    pipeline.add("chunk", chunk, "chunks")
+    if near_duplicates is not None:
+        pipeline.add("dedup", dedup, "chunks")
+    pipeline.add("embed", embed, "chunks", count=len)
+    pipeline.add("write", write, "chunks", count=len)
+
+    started = time.perf_counter()
+    try:
+        stats = pipeline.run()
+        with metrics.timer("ingest", step="finalize"):
+            meta = writer.close()
+    except BaseException:
+        writer.abort()  # No half-written files are left behind; the previous build stays usable
+        raise
+    if near_duplicates is not None:
+        near_duplicates.save(paths["chunk_sources"])
+        metrics.count("dedup", near_duplicates.duplicates)
+        print(f"🧹 Collapsed {near_duplicates.duplicates} near-duplicate chunks")
+    elif os.path.exists(paths["chunk_sources"]):
+        os.remove(paths["chunk_sources"])  # Stale mapping of an earlier deduplicated build
+
+    if build_bm25:
+        from bm25 import BM25Index
+        from chunk_store import ChunkStore
+
+        print("🔍 Building BM25 index...")
+        store = ChunkStore(paths["chunk_store"])
+        BM25Index.build(store, store.ids).save(paths["bm25"])
+        store.close()
+
+    if bundle_storage:
+        from index_bundle import write_bundle
+
+        print("📦 Writing memory-mappable index bundle...")
+        write_bundle(paths["index_bundle"], paths["embeddings_index"], EMBEDDING_MODEL_NAME, bundle_storage,
+                     paths["embedding_vectors"], paths["embedding_ids"])
+
+    print(f"\n📊 Ingestion finished in {time.perf_counter() - started:.1f}s ({meta['ntotal']} vectors, {meta['index_type']} index)")
+    for stage in stats:
+        print(f"   {stage}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a book: extract → preprocess → chunk → embed → index, streaming.")
+    parser.add_argument("--pdf", default=BOOK_PATH, help="PDF to ingest.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory for the index files.")
+    parser.add_argument("--corpus", help="Ingest as a named corpus into the shard registry (data dir SHARDS_DIR/NAME).")
+    parser.add_argument("--title", help="Title stored with --corpus.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="FAISS index type.")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32", help="Vector storage precision of the index.")
+    parser.add_argument("--encoder", default=ENCODER_BACKEND, help="Encoder backend: torch, torch_int8, onnx or onnx_int8 (see encoders.py).")
+    parser.add_argument("--workers", type=int, help="PDF extraction processes (default: one per CPU).")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks encoded per batch.")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Items buffered between stages.")
+    parser.add_argument("--skip-pages", type=int, default=2, help="Initial PDF pages to skip.")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_MAX_TOKENS, help="Tokens per chunk (capped at the encoder window).")
+    parser.add_argument("--keep-intermediate", action="store_true", help="Also write the extracted, preprocessed and chunked text files.")
+    parser.add_argument("--bm25", action="store_true", help="Also build the in-process BM25 index.")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD, help="MinHash Jaccard similarity at which chunks collapse.")
+    parser.add_argument("--no-dedup", action="store_true", help="Index every chunk, including near-duplicates.")
+    parser.add_argument("--bundle", choices=("faiss", "npy"), help="Also write a memory-mappable index bundle (see index_bundle.py).")
+    args = parser.parse_args()
+
+    data_dir = os.path.join(SHARDS_DIR, args.corpus) if args.corpus else args.data_dir
+    run_ingest(args.pdf, data_dir, args.index_type, args.workers, args.batch_size, args.queue_size,
+               args.skip_pages, args.chunk_size, args.keep_intermediate, args.bm25, precision=args.precision,
+               encoder_backend=args.encoder, dedup_threshold=None if args.no_dedup else args.dedup_threshold,
+               bundle_storage=args.bundle)
+
+    if args.corpus:
+        from shards import ShardRegistry
+
+        ShardRegistry(SHARDS_DIR).register(args.corpus, title=args.title or os.path.basename(args.pdf),
+                                           pdf=os.path.abspath(args.pdf))
+        print(f"📚 Registered corpus {args.corpus}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+class ElasticsearchBackend:
+    """Lexical (BM25) chunk search served by the Elasticsearch index written by index_passages.py."""
+
+    name = "elasticsearch"
+
+    def __init__(self, es, index_name):
+        self.es = es
+        self.index_name = index_name
+
+    def search(self, queries, top_k, timeout=None):
+        """
+        Searches all queries in one msearch round trip.
+
+        Returns, for each query, [(chunk_id, score)] best first.
+        """
+        searches = []
+        for query in queries:
+            searches.append({"index": self.index_name})
+            searches.append({"query": {"match": {"text": query}}, "size": top_k, "_source": ["chunk_id"]})
+
+        client = self.es.options(request_timeout=timeout) if timeout else self.es
+        response = client.msearch(searches=searches)
+
+        results = []
+        for item in response["responses"]:
+            if "error" in item:
+                raise RuntimeError(f"❌ Elasticsearch query failed: {item['error']}")
+            results.append([(int(hit["_source"].get("chunk_id", hit["_id"])), hit["_score"])
+                            for hit in item["hits"]["hits"]])
+        return results
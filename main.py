@@ -1,23 +1,81 @@
 import argparse
-from src.retrieval.retrieval import retrieve_best_sentence, generate_fallback_response
+import json
+import sys
+from itertools import islice
+from src.retrieval.retrieval import get_engine, generate_fallback_response
+from src.retrieval.answer_cache import AnswerCache
+from src.retrieval.metrics import configure_logging
+from src.retrieval.config import TOP_K
+
+def read_questions(stream):
+    """Yields (id, question) pairs from a JSONL stream, one object or string per line."""
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if isinstance(record, str):
+            yield line_number, record
+        else:
+            yield record.get("id", line_number), record["question"]
+
+def run_batch(input_path, output_path=None, batch_size=64, top_k=TOP_K, engine=None):
+    """Answers questions streamed from a JSONL file (or stdin) and writes answers as JSONL."""
+    engine = engine or get_engine()
+    infile = sys.stdin if input_path == "-" else open(input_path, "r", encoding="utf-8")
+    outfile = sys.stdout if output_path in (None, "-") else open(output_path, "w", encoding="utf-8")
+
+    try:
+        questions = read_questions(infile)
+        while True:
+            batch = list(islice(questions, batch_size))
+            if not batch:
+                break
+
+            all_answers = engine.retrieve_best_sentences([question for _, question in batch], top_k=top_k, batch_size=batch_size)
+            for (question_id, question), answers in zip(batch, all_answers):
+                fallback = not answers
+                record = {
+                    "id": question_id,
+                    "question": question,
+                    "answers": [generate_fallback_response(question)] if fallback else answers,
+                    "fallback": fallback,
+                }
+                outfile.write(json.dumps(record, ensure_ascii=False) + "\n")
+            outfile.flush()
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
 
 def main():
     parser = argparse.ArgumentParser(description="Retrieve answers from FAISS and Elasticsearch.")
     parser.add_argument("query", nargs="?", type=str, help="Enter your question to retrieve answers.")
+    parser.add_argument("--batch", metavar="PATH", help="Answer questions from a JSONL file ('-' for stdin).")
+    parser.add_argument("--output", metavar="PATH", help="Write batch answers to this JSONL file (default: stdout).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Questions encoded and searched together in batch mode.")
+    parser.add_argument("--no-cache", action="store_true", help="Search every question instead of reusing answers to repeated ones.")
     args = parser.parse_args()
+    configure_logging()  # Retrieval status messages go to stderr
+    engine = get_engine() if args.no_cache else AnswerCache(get_engine())
+
+    if args.batch:
+        run_batch(args.batch, args.output, batch_size=args.batch_size, engine=engine)
+        return
 
     while True:
         # If no query was passed via CLI, ask the user interactively
         if not args.query:
             args.query = input("\n❓ Enter your question (or type 'exit' to quit): ")
-        
+
         if args.query.lower() == "exit":
             print("👋 Exiting the program.")
             break
 
-        answers = retrieve_best_sentence(args.query)
+        answers = engine.retrieve_best_sentence(args.query)
 
-        if "❌ No relevant answer found!" in answers:
+        if not answers:
             print("⚠️ No relevant answer found! Generating a fallback response...")
             fallback_answer = generate_fallback_response(args.query)
             print(f"💡 Fallback Answer: {fallback_answer}")
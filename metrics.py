@@ -0,0 +1,329 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Toggles (environment variables, so every entry point picks them up)
+ENABLED = os.environ.get("SLM_METRICS", "1") != "0"  # Set SLM_METRICS=0 to turn every timer into a no-op
+LOG_FORMAT = os.environ.get("SLM_LOG_FORMAT", "text")  # "text" or "json" (one JSON object per line)
+LOG_LEVEL = os.environ.get("SLM_LOG_LEVEL", "INFO")  # DEBUG also logs every timed stage
+PROFILE_SAMPLE_RATE = float(os.environ.get("SLM_PROFILE_SAMPLE_RATE", "0"))  # Fraction of requests run under cProfile
+
+# Latency buckets in seconds, from sub-millisecond index lookups to multi-second model loads
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("slm")
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, None, value) for key, value in self._values.items()]
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(key), "value": value} for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            values[slot] += 1
+            values[-1] += value
+
+    def samples(self):
+        rows = []
+        with self._lock:
+            for key, values in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                    cumulative += count
+                    rows.append((self.name + "_bucket", key, {"le": bound}, cumulative))
+                rows.append((self.name + "_sum", key, None, values[-1]))
+                rows.append((self.name + "_count", key, None, cumulative))
+        return rows
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(key), "count": sum(values[:-1]), "sum": values[-1],
+                     "mean": values[-1] / max(sum(values[:-1]), 1)}
+                    for key, values in self._values.items()]
+
+
+class Registry:
+    """Named counters and histograms, exportable as Prometheus text or JSON."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _metric(self, cls, name, help_text, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, help_text, **kwargs)
+        return metric
+
+    def counter(self, name, help_text=""):
+        return self._metric(Counter, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=LATENCY_BUCKETS):
+        return self._metric(Histogram, name, help_text, buckets=buckets)
+
+    def export_prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key, extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict."""
+        return {metric.name: {"type": metric.kind, "values": metric.snapshot()}
+                for metric in list(self._metrics.values())}
+
+    def reset(self):
+        """Zeroes every metric (the metric objects themselves stay registered)."""
+        for metric in list(self._metrics.values()):
+            with metric._lock:
+                metric._values.clear()
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("slm_stage_seconds", "Time spent per pipeline or query stage.")
+STAGE_ERRORS = REGISTRY.counter("slm_stage_errors_total", "Stages that raised an exception.")
+ITEMS = REGISTRY.counter("slm_items_total", "Items processed per stage.")
+
+
+class _NullTimer:
+    """Shared no-op timer returned while metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("stage", "labels", "start")
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.stage, time.perf_counter() - self.start, error=exc_type is not None, **self.labels)
+        return False
+
+
+def observe(stage, seconds, error=False, **labels):
+    """Records one stage duration (and an error, if it failed)."""
+    if not ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+    if error:
+        STAGE_ERRORS.inc(stage=stage, **labels)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"⏱️ {stage} took {1000 * seconds:.2f}ms",
+                     extra={"fields": {"stage": stage, "seconds": seconds, "error": error, **labels}})
+
+
+def timer(stage, **labels):
+    """Context manager timing a block as one observation of stage."""
+    return _Timer(stage, labels) if ENABLED else _NULL_TIMER
+
+
+def timed(stage, **labels):
+    """Decorator timing every call of a function as one observation of stage."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _Timer(stage, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(stage, amount=1, **labels):
+    """Adds to the item counter of stage."""
+    if ENABLED:
+        ITEMS.inc(amount, stage=stage, **labels)
+
+
+def set_enabled(enabled):
+    global ENABLED
+    ENABLED = bool(enabled)
+
+
+def export_prometheus():
+    return REGISTRY.export_prometheus()
+
+
+def snapshot():
+    return REGISTRY.snapshot()
+
+
+_profiling = threading.local()
+
+
+def profile_worker(fn):
+    """
+    Wraps fn before it is handed to a worker thread, so profiled() covers it too.
+
+    cProfile only sees the thread that enabled it. If the submitting thread
+    is inside profiled(), fn runs under its own profiler whose stats are
+    merged into that report (when fn finishes before the block ends);
+    otherwise fn is returned unchanged.
+    """
+    session = getattr(_profiling, "session", None)
+    if session is None:
+        return fn
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Python builds that allow only one active profiler
+            profiler = None
+        previous, _profiling.session = getattr(_profiling, "session", None), session  # Work handed on is profiled too
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _profiling.session = previous
+            if profiler is not None:
+                profiler.disable()
+                with session["lock"]:
+                    if session["open"]:
+                        session["profilers"].append(profiler)
+    return run
+
+
+@contextmanager
+def profiled(force=False, sample_rate=None, top=25):
+    """
+    Runs the block under cProfile when forced or sampled, yielding a dict.
+
+    After the block, the dict holds "stats" (the top functions by cumulative
+    time as text) if the block was profiled; it stays empty otherwise, so
+    unsampled requests pay only one random() call. Work the block submits
+    to worker threads is included if it was wrapped with profile_worker.
+    """
+    result = {}
+    rate = PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if not force and (rate <= 0 or random.random() >= rate):
+        yield result
+        return
+
+    session = {"lock": threading.Lock(), "open": True, "profilers": []}
+    profiler = cProfile.Profile()
+    _profiling.session = session
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        _profiling.session = None
+        with session["lock"]:
+            session["open"] = False
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        for worker in session["profilers"]:
+            stats.add(worker)
+        stats.sort_stats("cumulative").print_stats(top)
+        result["stats"] = stream.getvalue()
+        if not force:
+            logger.info("profile", extra={"fields": {"profile": result["stats"]}})
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with any extra "fields" merged in."""
+
+    def format(self, record):
+        entry = {"ts": round(record.created, 6), "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=None, log_format=None, stream=None):
+    """Sends "slm" log records to stderr, as plain messages or JSON lines (SLM_LOG_FORMAT)."""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if (log_format or LOG_FORMAT) == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.handlers[:] = [handler]
+    logger.setLevel(level or LOG_LEVEL)
+    logger.propagate = False
+    return logger
@@ -1,11 +1,13 @@
+import argparse
 import re
 import unicodedata
 import nltk
 import os
 import logging
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
 
 # Ensure correct NLTK data path
 nltk.data.path.append("C:/Users/kravi/AppData/Roaming/nltk_data")
@@ -23,6 +25,9 @@ for resource in nltk_resources:
 RE_EXTRA_SPACES = re.compile(r"\s+")
 RE_FIX_JOINED_WORDS = re.compile(r"(\d*)([a-z]+)([A-Z])")  # Fix words stuck together
 RE_CLEAN_TEXT = re.compile(r"[^a-zA-Z0-9.,!?'\-\s\"]")  # Keep punctuation & essential characters
+RE_AFTER_QUESTION = re.compile(r"(?<=\?)\s*([A-Z])")  # Capital letter following a question mark
+
+PREPROCESS_BATCH_SIZE = 512  # Lines per worker task
 
 
 def normalize_text(text):
@@ -41,6 +46,10 @@ def clean_text(text, lowercase=False):
     return text
 
 
+def _lower_match(match):
+    return match.group(1).lower()
+
+
 def preprocess_text(text, lowercase=False):
     """Preprocess text while maintaining sentence structure and punctuation."""
     if not text.strip():  # Skip empty input
@@ -57,7 +66,7 @@ def preprocess_text(text, lowercase=False):
         if sent:
             # Capitalize first letter of each sentence if needed
             sent = sent[0].upper() + sent[1:] if sent and sent[0].islower() else sent
-            sent = re.sub(r'(?<=\?)\s*([A-Z])', lambda m: m.group(1).lower(), sent)  # Fix: '"?" He' → '"?" he'
+            sent = RE_AFTER_QUESTION.sub(_lower_match, sent)  # Fix: '"?" He' → '"?" he'
             processed_sentences.append(sent)
 
     return " ".join(processed_sentences)  # Join sentences with proper spacing
@@ -70,25 +79,82 @@ def full_preprocessing_pipeline(text, lowercase=False):
     return preprocess_text(text, lowercase)
 
 
+def preprocess_lines(lines, lowercase=False):
+    """Worker task: runs the full pipeline over a batch of lines."""
+    return [full_preprocessing_pipeline(line, lowercase) for line in lines]
+
+
+def _batches(lines, batch_size):
+    lines = iter(lines)
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def preprocess_iter(lines, lowercase=False, workers=None, batch_size=PREPROCESS_BATCH_SIZE):
+    """
+    Yields the preprocessed form of every line, in input order.
+
+    Lines are sharded into batches of batch_size and preprocessed in a
+    process pool. Only a bounded number of batches is in flight, so memory
+    stays flat for arbitrarily long inputs. workers=1 runs in-process.
+    """
+    task = partial(preprocess_lines, lowercase=lowercase)
+    if workers == 1:
+        for batch in _batches(lines, batch_size):
+            yield from task(batch)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = workers * 2
+        pending = deque()
+        for batch in _batches(lines, batch_size):
+            pending.append(executor.submit(task, batch))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def preprocess_file(input_path, output_path, lowercase=False, workers=None, batch_size=PREPROCESS_BATCH_SIZE):
+    """Preprocesses a text file line by line into output_path, keeping line order. Returns the line count."""
+    count = 0
+    with open(input_path, "r", encoding="utf-8") as infile, open(output_path, "w", encoding="utf-8") as outfile:
+        for processed_line in preprocess_iter(infile, lowercase, workers, batch_size):
+            outfile.write(processed_line + "\n")
+            count += 1
+    return count
+
+
 if __name__ == "__main__":
+    # Configure logging (only when run as a script, so importing this module leaves logging alone)
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
     BASE_DIR = os.path.abspath("K:/slm_project/data/")
-    input_file = os.path.join(BASE_DIR, "extracted_text_cleaned.txt")
-    output_file = os.path.join(BASE_DIR, "preprocessed_text.txt")
+
+    parser = argparse.ArgumentParser(description="Preprocess extracted book text line by line.")
+    parser.add_argument("--input", default=os.path.join(BASE_DIR, "extracted_text_cleaned.txt"), help="Extracted text file.")
+    parser.add_argument("--output", default=os.path.join(BASE_DIR, "preprocessed_text.txt"), help="Preprocessed text file.")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per CPU, 1 = in-process).")
+    parser.add_argument("--batch-size", type=int, default=PREPROCESS_BATCH_SIZE, help="Lines per worker task.")
+    args = parser.parse_args()
+    input_file, output_file = args.input, args.output
 
     if not os.path.exists(input_file):
         logging.error(f"Input file not found at {input_file}")
     else:
         logging.info(f"Processing text from {input_file}")
-        with open(input_file, "r", encoding="utf-8") as infile, open(output_file, "w", encoding="utf-8") as outfile:
-            for line in infile:
-                processed_line = full_preprocessing_pipeline(line, lowercase=True)  # Set lowercase=True if needed
-                outfile.write(processed_line + "\n")
+        line_count = preprocess_file(input_file, output_file, lowercase=True,  # Set lowercase=True if needed
+                                     workers=args.workers, batch_size=args.batch_size)
 
-        logging.info(f"✅ Preprocessed text saved to: {output_file}")
+        logging.info(f"✅ Preprocessed {line_count} lines, saved to: {output_file}")
 
         # Print sample output
         with open(output_file, "r", encoding="utf-8") as file:
-            processed_text = file.read()
+            processed_text = file.read(500)
 
         logging.info("🔍 Sample Preprocessed Text (First 500 characters):")
-        print(processed_text[:500])
+        print(processed_text)
@@ -0,0 +1,199 @@
+import threading
+import time
+import numpy as np
+import metrics
+from config import ANSWER_MIN_SCORE, CROSS_ENCODER_MODEL, RERANK_CANDIDATES, RERANK_TIME_BUDGET_MS
+from dedup import sentence_key
+from vector_math import normalize
+
+CROSS_ENCODER_BATCH_SIZE = 64  # Question-sentence pairs scored per cross-encoder call
+
+SKIPPED = metrics.REGISTRY.counter("slm_rerank_skipped_total", "Questions answered without the cross-encoder because the time budget ran out.")
+
+
+def pool_candidates(sentence_index, query_embeddings, top_chunk_indices):
+    """
+    Gathers the stored sentences of every retrieved chunk, per query, with their similarity to the query.
+
+    All candidate rows of all queries are scored with a single row-wise dot
+    product against the normalized query embeddings, so scores are cosine
+    similarities whatever the index metric. Returns one (sentences, scores)
+    pair per query; chunk indices outside the chunk list (padding) are skipped.
+    """
+    sentences, sentence_offsets, sentence_embeddings, _ = sentence_index
+    num_chunks = len(sentence_offsets) - 1
+
+    owners, rows = [], []
+    for q, chunk_indices in enumerate(top_chunk_indices):
+        for idx in chunk_indices:
+            if 0 <= idx < num_chunks and sentence_offsets[idx + 1] > sentence_offsets[idx]:
+                rows.append(np.arange(sentence_offsets[idx], sentence_offsets[idx + 1]))
+                owners.append(np.full(len(rows[-1]), q))
+
+    candidates = [([], np.zeros(0, dtype=np.float32)) for _ in top_chunk_indices]
+    if not rows:
+        return candidates
+
+    rows, owners = np.concatenate(rows), np.concatenate(owners)
+    query_embeddings = normalize(query_embeddings)
+    scores = np.einsum("ij,ij->i", np.asarray(sentence_embeddings[rows]), query_embeddings[owners]).astype(np.float32)
+    bounds = np.searchsorted(owners, np.arange(len(top_chunk_indices) + 1))
+    for q in range(len(top_chunk_indices)):
+        start, end = bounds[q], bounds[q + 1]
+        candidates[q] = ([sentences[row] for row in rows[start:end]], scores[start:end])
+    return candidates
+
+
+def merge_candidates(groups):
+    """Pools the (sentences, scores) candidates of one query gathered from several sources (e.g. shards)."""
+    groups = list(groups)
+    return ([sentence for sentences, _ in groups for sentence in sentences],
+            np.concatenate([scores for _, scores in groups]) if groups else np.zeros(0, dtype=np.float32))
+
+
+def top_indices(score_lists, k):
+    """
+    Best k positions of every score list, best first, ranked globally per list.
+
+    The lists are padded into one (N, L) matrix, so a single argpartition
+    selects the candidates of all queries; only those k are then sorted.
+    """
+    width = max((len(scores) for scores in score_lists), default=0)
+    if width == 0:
+        return [np.zeros(0, dtype=np.int64) for _ in score_lists]
+    padded = np.full((len(score_lists), width), -np.inf, dtype=np.float32)
+    for q, scores in enumerate(score_lists):
+        padded[q, :len(scores)] = scores
+
+    k = min(k, width)
+    best = np.argpartition(-padded, k - 1, axis=1)[:, :k] if k < width else np.tile(np.arange(width), (len(padded), 1))
+    best = np.take_along_axis(best, np.argsort(-np.take_along_axis(padded, best, axis=1), axis=1, kind="stable"), axis=1)
+    return [row[:min(k, len(scores))] for row, scores in zip(best, score_lists)]
+
+
+class SentenceReranker:
+    """
+    Ranks the pooled candidate sentences of all retrieved chunks globally.
+
+    Candidates are ranked by their bi-encoder similarity to the question, so
+    a chunk contributes as many sentences as are among the best. A question
+    whose best sentence scores below min_score gets no answers (the caller
+    falls back). With a cross_encoder (a sentence_transformers CrossEncoder,
+    or its model name, loaded on first use), the top num_candidates of every
+    question are re-scored in as few batches as possible.
+
+    Cross-encoding stops once time_budget_ms per question has been spent (or
+    the next batch would overrun it); the remaining questions keep their
+    bi-encoder ranking.
+    """
+
+    def __init__(self, min_score=ANSWER_MIN_SCORE, cross_encoder=CROSS_ENCODER_MODEL,
+                 num_candidates=RERANK_CANDIDATES, time_budget_ms=RERANK_TIME_BUDGET_MS,
+                 batch_size=CROSS_ENCODER_BATCH_SIZE):
+        self.min_score = min_score
+        self.num_candidates = num_candidates
+        self.time_budget_ms = time_budget_ms
+        self.batch_size = batch_size
+        self.stats = {"questions": 0, "misses": 0, "cross_encoded": 0, "budget_skips": 0}
+        self._cross_encoder = cross_encoder or None
+        self._lock = threading.Lock()
+
+    def report(self):
+        with self._lock:
+            return dict(self.stats)
+
+    @property
+    def cross_encoder(self):
+        if isinstance(self._cross_encoder, str):
+            with self._lock:
+                if isinstance(self._cross_encoder, str):
+                    from sentence_transformers import CrossEncoder
+
+                    self._cross_encoder = CrossEncoder(self._cross_encoder)
+        return self._cross_encoder
+
+    def warm_up(self):
+        """
+        Loads the cross-encoder and runs one pair through it, so the first question stays within its time budget.
+
+        Returns the seconds this took, or None without a cross-encoder.
+        """
+        if self._cross_encoder is None:
+            return None
+        start = time.perf_counter()
+        self.cross_encoder.predict([("warm up", "warm up")], show_progress_bar=False)
+        return time.perf_counter() - start
+
+    def _shortlists(self, candidates, depth):
+        """Per query: the top (up to depth) distinct sentences and their scores, or None for a miss."""
+        shortlists = []
+        ranked = top_indices([scores for _, scores in candidates], 2 * depth)  # Headroom for repeated sentences
+        for (sentences, scores), order in zip(candidates, ranked):
+            if not len(order) or scores[order[0]] < self.min_score:
+                shortlists.append(None)
+                continue
+            seen, kept = set(), []
+            for i in order:
+                key = sentence_key(sentences[i])
+                if key not in seen:  # Overlapping chunks share sentences; each one is returned only once
+                    seen.add(key)
+                    kept.append(i)
+                    if len(kept) == depth:
+                        break
+            shortlists.append(([sentences[i] for i in kept], scores[kept]))
+        return shortlists
+
+    def _cross_encode(self, queries, shortlists, deadline):
+        """Re-orders shortlists by cross-encoder score, whole questions at a time, until the deadline."""
+        pending = [q for q, shortlist in enumerate(shortlists) if shortlist is not None and len(shortlist[0]) > 1]
+        seconds_per_pair = 0.0
+        while pending:
+            batch, pairs = [], []
+            while pending and (not pairs or len(pairs) + len(shortlists[pending[0]][0]) <= self.batch_size):
+                q = pending.pop(0)
+                batch.append(q)
+                pairs.extend((queries[q], sentence) for sentence in shortlists[q][0])
+            if time.perf_counter() + seconds_per_pair * len(pairs) > deadline:
+                pending[:0] = batch
+                break
+
+            start = time.perf_counter()
+            scores = np.asarray(self.cross_encoder.predict(pairs, batch_size=len(pairs), show_progress_bar=False),
+                               dtype=np.float32).reshape(len(pairs), -1)[:, -1]
+            seconds = time.perf_counter() - start
+            seconds_per_pair = seconds / len(pairs)
+            metrics.observe("cross_encoder", seconds)
+
+            position = 0
+            for q in batch:
+                sentences, _ = shortlists[q]
+                cross_scores = scores[position:position + len(sentences)]
+                position += len(sentences)
+                order = np.argsort(-cross_scores, kind="stable")
+                shortlists[q] = ([sentences[i] for i in order], cross_scores[order])
+            with self._lock:
+                self.stats["cross_encoded"] += len(batch)
+
+        if pending:
+            SKIPPED.inc(len(pending))
+            with self._lock:
+                self.stats["budget_skips"] += len(pending)
+
+    def rerank(self, queries, candidates, max_sentences):
+        """
+        Best sentences for each query from its pooled (sentences, scores) candidates.
+
+        Returns, per query, up to max_sentences sentences best first, or an
+        empty list if no candidate reaches min_score.
+        """
+        depth = max(max_sentences, self.num_candidates if self.cross_encoder is not None else 0)  # Loads the model
+        start = time.perf_counter()
+        shortlists = self._shortlists(candidates, depth)
+        if self.cross_encoder is not None:
+            self._cross_encode(queries, shortlists, start + self.time_budget_ms / 1000 * len(queries))
+
+        misses = sum(shortlist is None for shortlist in shortlists)
+        with self._lock:
+            self.stats["questions"] += len(queries)
+            self.stats["misses"] += misses
+        return [[] if shortlist is None else shortlist[0][:max_sentences] for shortlist in shortlists]
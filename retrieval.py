@@ -1,61 +1,630 @@
+import json
+import logging
 import os
-import faiss
-import torch
-import numpy as np
-import nltk
-from nltk.tokenize import sent_tokenize
-from sentence_transformers import SentenceTransformer
+import time
 import random
-from elasticsearch import Elasticsearch
-
-# Ensure NLTK sentence tokenizer is available
-nltk.download("punkt")
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import numpy as np
+import metrics
+from config import (EMBEDDING_MODEL_NAME, ENCODER_BACKEND, LEXICAL_BACKEND, RETRIEVAL_MIN_SCORE, RETRIEVAL_SCORE_GAP,
+                    SENTENCES_PER_CHUNK, TOP_K, data_paths)
+from chunk_store import ChunkStore
+from dedup import load_sources
+from fusion import RRF_K, fuse
+from lexical import ElasticsearchBackend
+from rerank import SentenceReranker, pool_candidates
+from sentence_index import load_sentence_index
+from vector_math import DEFAULT_RERANK_FACTOR, index_metric, prepare_vectors, rerank_exact
 
 # Paths
 EMBEDDING_PATH = "K:/slm_project/data/embeddings.index"
-DATA_PATH = "K:/slm_project/data/tokenized_chunks.txt"
+VECTORS_PATH = "K:/slm_project/data/embeddings.vectors.npy"  # Full-precision chunk vectors, for exact re-ranking
+VECTOR_IDS_PATH = "K:/slm_project/data/embeddings.ids.npy"
+CHUNK_STORE_PATH = "K:/slm_project/data/chunks"
+CHUNK_SOURCES_PATH = "K:/slm_project/data/chunk_sources.npy"  # Written when near-duplicate chunks were collapsed
+BUNDLE_PATH = "K:/slm_project/data/index_bundle"  # Preferred over EMBEDDING_PATH when present (index_bundle.py)
+CALIBRATION_PATH = "K:/slm_project/data/retrieval_calibration.json"  # Thresholds written by calibrate_retrieval.py
+BM25_PATH = "K:/slm_project/data/bm25"
 
 # Elasticsearch settings
 ES_HOST = "localhost"
 ES_PORT = 9200
 ES_SCHEME = "http"
-INDEX_NAME = "my_index"
+INDEX_NAME = "slm_index"  # Written by index_passages.py
+
+# Hybrid search settings
+LEXICAL_TIMEOUT = 0.25  # Seconds to wait for the lexical backend before answering vector-only
+LEXICAL_COOLDOWN = 30.0  # Seconds to skip the lexical backend after it failed or timed out
+FUSION_WEIGHTS = {"vector": 1.0, "lexical": 1.0}
+
+logger = logging.getLogger("slm.retrieval")
+
+CHUNKS_KEPT = metrics.REGISTRY.histogram("slm_chunks_per_question", "Chunks kept per question by adaptive retrieval.",
+                                         buckets=(0, 1, 2, 3, 5, 8, 13, 21))
+
+
+def adaptive_keep(scores, min_score=RETRIEVAL_MIN_SCORE, score_gap=RETRIEVAL_SCORE_GAP):
+    """
+    Mask of the (N, k) best-first similarities worth processing.
+
+    A result is kept if it scores no more than score_gap below the best
+    result of its query. A query whose best result is below min_score keeps
+    nothing: it is a miss.
+    """
+    best = scores[:, :1]
+    return (scores >= best - score_gap) & (best >= min_score)
+
+
+def files_version(paths):
+    """(size, mtime) of every file in paths, None for missing ones; changes whenever one of them is rewritten."""
+    version = []
+    for path in paths:
+        stat = os.stat(path) if path and os.path.exists(path) else None
+        version.append((stat.st_size, stat.st_mtime_ns) if stat else None)
+    return tuple(version)
+
+
+def data_dir_version(data_dir):
+    """RetrievalEngine.index_version() of the engine from_data_dir(data_dir) would open, without opening it."""
+    paths = data_paths(data_dir)
+    return files_version([paths["embeddings_index"], paths["chunk_store"] + ".ids.npy", paths["sentence_embeddings"],
+                          os.path.join(paths["index_bundle"], "manifest.json")])
+
+
+def _observe_kept(positions):
+    for kept in (positions >= 0).sum(axis=1):
+        CHUNKS_KEPT.observe(int(kept))
+
+
+class RetrievalEngine:
+    """
+    Answers questions by hybrid search (FAISS + a lexical backend) and the precomputed sentence index.
+
+    Nothing is loaded on construction: the SBERT model, FAISS index, text
+    chunks, sentence index and Elasticsearch client are loaded on first use,
+    or all at once by warm_up(). The time spent loading each component is
+    recorded in load_times, and per-backend search latencies in
+    backend_stats. A model passed in is used instead of loading SBERT, and
+    stage_callback, if set, is called as (stage, seconds) after each
+    "encode", "faiss", "rerank", "lexical" and "sentences" stage of a search.
+    encoder_backend picks how the model runs (see encoders.load_encoder).
+
+    Indexes storing fp16 / int8 (or PQ) vectors are searched for
+    rerank_factor * top_k candidates, which are then re-scored exactly from
+    the memory-mapped full-precision vectors.
+
+    If an index bundle exists at bundle_path it is opened memory-mapped and
+    read-only instead of reading the FAISS index into memory, so worker
+    processes share one copy; bundle_verify picks its check ("quick",
+    "full" or "none", see index_bundle.verify_bundle).
+
+    Answer sentences are picked from all retrieved chunks together by
+    reranker (a rerank.SentenceReranker), which returns no sentences when
+    none is relevant enough.
+
+    With adaptive, top_k is an upper bound: chunks scoring more than score_gap
+    below the best one are dropped, and a question whose best chunk is below
+    min_score is a miss that skips the lexical wait and all sentence work.
+    Thresholds not passed in come from the calibration file written by
+    calibrate_retrieval.py, else from config. They are cosine similarities,
+    so indexes built with the L2 metric are never cut.
+    """
+
+    def __init__(self, embedding_path=EMBEDDING_PATH, chunk_store_path=CHUNK_STORE_PATH, sentence_paths=None,
+                 model_name=EMBEDDING_MODEL_NAME, es_host=ES_HOST, es_port=ES_PORT,
+                 es_scheme=ES_SCHEME, es_index=INDEX_NAME, nprobe=None, ef_search=None,
+                 lexical_backend=LEXICAL_BACKEND, bm25_path=BM25_PATH, fusion="rrf", fusion_weights=None, rrf_k=RRF_K,
+                 lexical_timeout=LEXICAL_TIMEOUT, lexical_cooldown=LEXICAL_COOLDOWN, verbose=True,
+                 model=None, stage_callback=None, vectors_path=VECTORS_PATH, vector_ids_path=VECTOR_IDS_PATH,
+                 rerank_factor=None, encoder_backend=ENCODER_BACKEND, chunk_sources_path=CHUNK_SOURCES_PATH,
+                 bundle_path=BUNDLE_PATH, bundle_verify="quick", reranker=None, adaptive=True,
+                 min_score=None, score_gap=None, calibration_path=CALIBRATION_PATH):
+        self.embedding_path = embedding_path
+        self.chunk_store_path = chunk_store_path
+        self.sentence_paths = sentence_paths or {}
+        self.model_name = model_name
+        self.encoder_backend = encoder_backend
+        self.es_host = es_host
+        self.es_port = es_port
+        self.es_scheme = es_scheme
+        self.es_index = es_index
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.lexical_backend = lexical_backend
+        self.bm25_path = bm25_path
+        self.fusion = fusion
+        self.fusion_weights = dict(fusion_weights or FUSION_WEIGHTS)
+        self.rrf_k = rrf_k
+        self.lexical_timeout = lexical_timeout
+        self.lexical_cooldown = lexical_cooldown
+        self.verbose = verbose
+        self.stage_callback = stage_callback
+        self.vectors_path = vectors_path
+        self.vector_ids_path = vector_ids_path
+        self.chunk_sources_path = chunk_sources_path
+        self.bundle_path = bundle_path
+        self.bundle_verify = bundle_verify
+        self.reranker = reranker or SentenceReranker()
+        self.adaptive = adaptive
+        self.min_score = min_score
+        self.score_gap = score_gap
+        self.calibration_path = calibration_path
+        self.rerank_factor = rerank_factor
+        self.index_meta = None
+
+        self.load_times = {}
+        self.backend_stats = {name: {"calls": 0, "errors": 0, "timeouts": 0, "total_seconds": 0.0, "last_seconds": 0.0}
+                              for name in ("vector", "lexical")}
+        self._components = {} if model is None else {"model": model}
+        self._model_owned = model is None
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self._lexical_retry_at = 0.0
+
+    @classmethod
+    def from_data_dir(cls, data_dir, **kwargs):
+        """Engine over the artifacts that ingest.py writes into data_dir."""
+        paths = data_paths(data_dir)
+        sentence_paths = {
+            "embeddings_path": paths["sentence_embeddings"],
+            "offsets_path": paths["sentence_offsets"],
+            "chunk_ids_path": paths["sentence_chunk_ids"],
+            "sentences_path": paths["sentences"],
+        }
+        return cls(embedding_path=paths["embeddings_index"], chunk_store_path=paths["chunk_store"],
+                   sentence_paths=sentence_paths, bm25_path=paths["bm25"], vectors_path=paths["embedding_vectors"],
+                   vector_ids_path=paths["embedding_ids"], chunk_sources_path=paths["chunk_sources"],
+                   bundle_path=paths["index_bundle"], calibration_path=paths["retrieval_calibration"], **kwargs)
+
+    def _log(self, message, level=logging.INFO):
+        # Status goes through logging (stderr, see metrics.configure_logging) so batch output on stdout stays clean
+        if self.verbose:
+            logger.log(level, message)
+
+    def _get(self, name):
+        """Returns a loaded component, loading it (once, thread-safely) on first access. None is a loaded result too."""
+        if name in self._components:
+            return self._components[name]
+        with self._lock:
+            if name not in self._components:
+                start = time.perf_counter()
+                component = getattr(self, f"_load_{name}")()
+                self.load_times[name] = time.perf_counter() - start
+                metrics.observe("load", self.load_times[name], component=name)
+                self._components[name] = component
+            return self._components[name]
+
+    def _load_model(self):
+        from encoders import load_encoder
+
+        self._log(f"📥 Loading SBERT model ({self.encoder_backend})...")
+        return load_encoder(self.encoder_backend, self.model_name)
+
+    def _load_index(self):
+        if self.bundle_path and os.path.isdir(self.bundle_path):
+            from index_bundle import is_stale, open_bundle, read_manifest
+
+            if not is_stale(read_manifest(self.bundle_path), self.bundle_path):
+                self._log("📂 Opening memory-mapped index bundle...")
+                index, self.index_meta = open_bundle(self.bundle_path, self.model_name, self.bundle_verify,
+                                                     nprobe=self.nprobe, ef_search=self.ef_search)
+                return index
+            self._log("⚠️ Index bundle is older than the FAISS index, rebuild it with index_bundle.py", logging.WARNING)
+        from index_factory import load_index
+
+        if not os.path.exists(self.embedding_path):
+            raise FileNotFoundError(f"❌ FAISS index file not found: {self.embedding_path}")
+        self._log("📂 Loading FAISS index...")
+        index, self.index_meta = load_index(self.embedding_path, nprobe=self.nprobe, ef_search=self.ef_search)
+        return index
+
+    def _load_text_chunks(self):
+        # Memory-mapped, so every worker process shares one copy through the page cache
+        self._log("📂 Opening chunk store...")
+        text_chunks = ChunkStore(self.chunk_store_path)
+
+        if len(text_chunks) == 0:
+            raise ValueError("❌ No valid text chunks found!")
+        return text_chunks
+
+    def _load_sentence_index(self):
+        # Precomputed sentence index, built offline by sentence_index.py
+        self._log("📂 Loading sentence index...")
+        sentence_index = load_sentence_index(**self.sentence_paths)
+        if not np.array_equal(sentence_index[3], self.chunk_lookup.ids):
+            raise ValueError("❌ Sentence index does not match text chunks, rebuild with sentence_index.py")
+        return sentence_index
+
+    def _load_exact_vectors(self):
+        # Memory-mapped: re-ranking reads only the candidate rows
+        from chunks import ChunkIdLookup
+
+        if not (os.path.exists(self.vectors_path) and os.path.exists(self.vector_ids_path)):
+            self._log("⚠️ Full-precision vectors not found, quantized results are not re-ranked", logging.WARNING)
+            return None
+        return np.load(self.vectors_path, mmap_mode="r"), ChunkIdLookup(np.load(self.vector_ids_path))
+
+    def _load_chunk_sources(self):
+        sources = load_sources(self.chunk_sources_path)
+        if sources is None:
+            return None
+        order = np.argsort(sources, kind="stable")
+        return sources[order], order  # Kept chunk IDs sorted, with the source position of each
+
+    def _load_thresholds(self):
+        thresholds = {"min_score": RETRIEVAL_MIN_SCORE, "score_gap": RETRIEVAL_SCORE_GAP}
+        if self.calibration_path and os.path.exists(self.calibration_path):
+            with open(self.calibration_path, "r", encoding="utf-8") as file:
+                calibration = json.load(file)
+            thresholds.update({key: calibration[key] for key in thresholds if key in calibration})
+        for key in thresholds:
+            if getattr(self, key) is not None:
+                thresholds[key] = getattr(self, key)
+        return thresholds
+
+    def _load_chunk_lookup(self):
+        return self.text_chunks.lookup
+
+    def _load_es(self):
+        from elasticsearch import Elasticsearch
+
+        return Elasticsearch([{'host': self.es_host, 'port': self.es_port, 'scheme': self.es_scheme}])
+
+    def _load_lexical(self):
+        if self.lexical_backend == "elasticsearch":
+            return ElasticsearchBackend(self.es, self.es_index)
+        if self.lexical_backend == "bm25":
+            from bm25 import BM25Index
+
+            self._log("📂 Loading BM25 index...")
+            return BM25Index.load(self.bm25_path)
+        raise ValueError(f"❌ Unknown lexical backend: {self.lexical_backend}")
 
-# Load the SBERT model for question encoding
-print("📥 Loading SBERT model...")
-model = SentenceTransformer("all-MiniLM-L6-v2")
+    def _load_executor(self):
+        return ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
 
-# Load FAISS index
-if not os.path.exists(EMBEDDING_PATH):
-    raise FileNotFoundError(f"❌ FAISS index file not found: {EMBEDDING_PATH}")
-print("📂 Loading FAISS index...")
-index = faiss.read_index(EMBEDDING_PATH)
+    @property
+    def model(self):
+        return self._get("model")
 
-# Load text chunks
-if not os.path.exists(DATA_PATH):
-    raise FileNotFoundError(f"❌ Text data file not found: {DATA_PATH}")
+    @property
+    def index(self):
+        return self._get("index")
 
-print("📂 Loading text chunks...")
-with open(DATA_PATH, "r", encoding="utf-8") as file:
-    text_chunks = [line.strip() for line in file.readlines() if line.strip()]
+    @property
+    def text_chunks(self):
+        return self._get("text_chunks")
 
-if len(text_chunks) == 0:
-    raise ValueError("❌ No valid text chunks found!")
+    @property
+    def chunk_lookup(self):
+        return self._get("chunk_lookup")
 
-# Initialize the Elasticsearch client
-es = Elasticsearch([{'host': ES_HOST, 'port': ES_PORT, 'scheme': ES_SCHEME}])
+    @property
+    def sentence_index(self):
+        return self._get("sentence_index")
 
-# Check the connection
-if es.ping():
-    print("🚀 Elasticsearch is connected!")
-else:
-    print("❌ Elasticsearch connection failed!")
+    @property
+    def es(self):
+        return self._get("es")
+
+    @property
+    def lexical(self):
+        return self._get("lexical")
+
+    def warm_up(self, include_es=False):
+        """Loads every component up front and returns the per-component load times in seconds."""
+        self.model
+        self.index
+        self.text_chunks
+        self.chunk_lookup
+        self.sentence_index
+        seconds = self.reranker.warm_up()
+        if seconds is not None:
+            self.load_times["cross_encoder"] = seconds
+
+        if include_es:
+            if self.es.ping():
+                self._log("🚀 Elasticsearch is connected!")
+            else:
+                self._log("❌ Elasticsearch connection failed!", logging.ERROR)
+
+        for name, seconds in self.load_times.items():
+            self._log(f"⏱️ {name} loaded in {seconds:.3f}s")
+        return dict(self.load_times)
+
+    def _record(self, backend, seconds, error=False):
+        with self._stats_lock:
+            stats = self.backend_stats[backend]
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["total_seconds"] += seconds
+            stats["last_seconds"] = seconds
+
+    def latency_report(self):
+        """Mean and last search latency per backend in milliseconds, with error and timeout counts."""
+        with self._stats_lock:
+            return {name: {"calls": stats["calls"], "errors": stats["errors"], "timeouts": stats["timeouts"],
+                           "mean_ms": 1000 * stats["total_seconds"] / max(stats["calls"], 1),
+                           "last_ms": 1000 * stats["last_seconds"]}
+                    for name, stats in self.backend_stats.items()}
+
+    @property
+    def metric(self):
+        """Similarity metric of the loaded index ("ip" for cosine on normalized vectors, "l2" for older indexes)."""
+        self.index
+        return index_metric(self.index_meta)
+
+    def _rerank_candidates(self, top_k):
+        """Candidates to fetch per query before exact re-ranking, or 0 to skip re-ranking."""
+        self.index
+        factor = self.rerank_factor
+        if factor is None:
+            params = self.index_meta.get("build_params", {})
+            quantized = params.get("precision", "fp32") != "fp32" or self.index_meta.get("index_type") == "ivf_pq"
+            factor = DEFAULT_RERANK_FACTOR if quantized else 1
+        if factor <= 1 or self.index_meta.get("id_scheme") != "content_hash" or self._get("exact_vectors") is None:
+            return 0
+        return top_k * factor
+
+    def _stage(self, stage, start):
+        """Reports the time since start for one search stage and returns the current time."""
+        now = time.perf_counter()
+        metrics.observe(stage, now - start)
+        if self.stage_callback is not None:
+            self.stage_callback(stage, now - start)
+        return now
+
+    def _search_lexical(self, queries, top_k):
+        start = time.perf_counter()
+        try:
+            results = self.lexical.search(queries, top_k, timeout=self.lexical_timeout)
+        except Exception:
+            self._record("lexical", time.perf_counter() - start, error=True)
+            metrics.observe("lexical", time.perf_counter() - start, error=True)
+            raise
+        self._record("lexical", time.perf_counter() - start)
+        self._stage("lexical", start)
+        return results
+
+    def _submit_lexical(self, queries, top_k):
+        """Starts the lexical search on a worker thread, unless it is disabled or cooling down after a failure."""
+        if not self.lexical_backend or time.monotonic() < self._lexical_retry_at:
+            return None
+        return self._get("executor").submit(metrics.profile_worker(self._search_lexical), queries, top_k)
+
+    def _collect_lexical(self, future, deadline):
+        """Waits for the lexical results until the deadline; None means answer vector-only."""
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0.0))
+        except FutureTimeout:
+            # The late search still records its own latency when it finishes
+            with self._stats_lock:
+                self.backend_stats["lexical"]["timeouts"] += 1
+            self._log("⚠️ Lexical search timed out, answering from FAISS only", logging.WARNING)
+        except Exception as e:
+            self._log(f"⚠️ Lexical search failed ({e}), answering from FAISS only", logging.WARNING)
+        self._lexical_retry_at = time.monotonic() + self.lexical_cooldown
+        return None
+
+    def _fuse(self, vector_results, lexical_lists, top_k):
+        """Merges one query's [(key, score)] vector results with its lexical result lists."""
+        return fuse(vector_results, lexical_lists, self.fusion, self.fusion_weights, k=self.rrf_k, top_k=top_k)
+
+    def search_chunks(self, queries, top_k=TOP_K, batch_size=32, query_embeddings=None):
+        """
+        Finds the top_k chunks of each query by hybrid FAISS + lexical search.
+
+        Returns the query embeddings and an (N, top_k) array of chunk
+        positions, padded with -1. See search_scored().
+        """
+        query_embeddings, positions, _ = self.search_scored(queries, top_k, batch_size, query_embeddings)
+        return query_embeddings, positions
+
+    def encode(self, queries, batch_size=32):
+        """Encodes questions into query vectors for this engine's index metric."""
+        query_embeddings = self.model.encode(queries, batch_size=batch_size, convert_to_numpy=True)
+        return prepare_vectors(query_embeddings, self.metric)
+
+    def search_components(self, queries, top_k=TOP_K, batch_size=32, query_embeddings=None):
+        """
+        Searches FAISS and the lexical backend without fusing their results.
+
+        Returns the query embeddings, the (N, top_k) vector positions (padded
+        with -1) and similarities (-inf padding), and per query the lexical
+        [(position, score)] hits, or None when answering vector-only. With
+        adaptive retrieval, weak vector results are dropped and misses get
+        no lexical hits. See search_scored().
+        """
+        lexical_future = self._submit_lexical(queries, top_k)
+
+        start = time.perf_counter()
+        if query_embeddings is None:
+            query_embeddings = self.encode(queries, batch_size)
+        else:
+            query_embeddings = prepare_vectors(query_embeddings, self.metric)
+        encoded = self._stage("encode", start)
+        # The lexical search ran during encoding too; its budget starts now, so large batches do not use it up
+        deadline = time.monotonic() + self.lexical_timeout
+        candidates = self._rerank_candidates(top_k)
+        distances, labels = self.index.search(query_embeddings, candidates or top_k)
+        searched = self._stage("faiss", encoded)
+        if candidates:
+            vectors, lookup = self._get("exact_vectors")
+            scores, labels = rerank_exact(query_embeddings, labels, vectors, lookup, top_k, self.metric)
+            self._stage("rerank", searched)
+        else:
+            scores = distances if self.metric == "ip" else -distances  # Higher is better from here on
+        vector_positions = self.chunk_positions(labels)
+        scores = np.where(vector_positions >= 0, scores, -np.inf).astype(np.float32)
+        misses = np.zeros(len(queries), dtype=bool)
+        if self.adaptive and self.metric == "ip":
+            keep = adaptive_keep(scores, **self._get("thresholds")) & (vector_positions >= 0)
+            misses = ~keep[:, 0]
+            vector_positions = np.where(keep, vector_positions, -1)
+            scores = np.where(keep, scores, -np.inf).astype(np.float32)
+            metrics.count("early_miss", int(misses.sum()))
+        self._record("vector", time.perf_counter() - start)
+        _observe_kept(vector_positions)
+
+        if misses.all():
+            if lexical_future is not None:
+                lexical_future.cancel()  # Nothing to fuse with; a running search still records its own latency
+            return query_embeddings, vector_positions, scores, None
+        lexical_results = self._collect_lexical(lexical_future, deadline)
+        if lexical_results is None:
+            return query_embeddings, vector_positions, scores, None
+
+        lexical_hits = []
+        for q, hits in enumerate(lexical_results):
+            positions = self.chunk_lookup.positions([cid for cid, _ in hits]) if not misses[q] else []
+            lexical_hits.append([(int(p), score) for p, (_, score) in zip(positions, hits) if p >= 0])
+        return query_embeddings, vector_positions, scores, lexical_hits
+
+    def search_scored(self, queries, top_k=TOP_K, batch_size=32, query_embeddings=None):
+        """
+        Finds the top_k chunks of each query and their scores.
+
+        The lexical backend runs on a worker thread while the questions are
+        encoded and searched in FAISS, so a batch costs the slower of the two
+        rather than their sum. Results are merged by reciprocal rank fusion
+        (or weighted score fusion). If the lexical backend fails or misses
+        its timeout, the vector results are returned on their own.
+
+        Questions already encoded by the same model (e.g. once for several
+        shards) can be passed as query_embeddings to skip encoding.
+
+        Returns the query embeddings, an (N, top_k) array of chunk positions
+        padded with -1, and their (N, top_k) scores (higher is better, -inf
+        for padding): similarities when answering vector-only, fused scores
+        otherwise. With adaptive retrieval, weak vector results are dropped
+        before fusion and misses get no results at all.
+        """
+        query_embeddings, vector_positions, scores, lexical_hits = self.search_components(
+            queries, top_k, batch_size, query_embeddings)
+        if lexical_hits is None:
+            return query_embeddings, vector_positions, scores
+
+        fused_positions = np.full((len(queries), top_k), -1, dtype=np.int64)
+        fused_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        for q, hits in enumerate(lexical_hits):
+            vector_results = [(int(p), float(score)) for p, score in zip(vector_positions[q], scores[q]) if p >= 0]
+            merged = self._fuse(vector_results, [hits], top_k)
+            fused_positions[q, :len(merged)] = [p for p, _ in merged]
+            fused_scores[q, :len(merged)] = [score for _, score in merged]
+        return query_embeddings, fused_positions, fused_scores
+
+    def search_lexical(self, query, top_k=2):
+        """Searches the configured lexical backend (Elasticsearch or in-process BM25) for relevant text."""
+        hits = self.lexical.search([query], top_k)[0]
+        positions = self.chunk_lookup.positions([cid for cid, _ in hits])
+        return [(self.text_chunks[p], score) for p, (_, score) in zip(positions, hits) if p >= 0]
+
+    def search_es(self, query, top_k=2):
+        """Searches Elasticsearch for relevant text."""
+        body = {"query": {"match": {"text": query}}}
+        with metrics.timer("es"):
+            response = self.es.search(index=self.es_index, body=body, size=top_k)
+        return [(hit["_source"]["text"], hit["_score"]) for hit in response["hits"]["hits"]]
+
+    def chunk_positions(self, labels):
+        """Maps FAISS result labels to positions in text_chunks (-1 where there is no chunk)."""
+        self.index  # The stored id scheme is known once the index is loaded
+        if self.index_meta.get("id_scheme") == "content_hash":
+            return self.chunk_lookup.positions(labels)
+        return labels
+
+    def source_positions(self, position):
+        """Source chunk positions (before near-duplicate collapsing) that the stored chunk at position stands for."""
+        sources = self._get("chunk_sources")
+        if sources is None:
+            return np.array([position])
+        kept_ids, order = sources
+        cid = self.text_chunks.ids[position]
+        return order[np.searchsorted(kept_ids, cid, "left"):np.searchsorted(kept_ids, cid, "right")]
+
+    def sentence_candidates(self, query_embeddings, top_chunk_indices):
+        """Every stored sentence of the retrieved chunks, per query, with its similarity (see rerank.pool_candidates)."""
+        return pool_candidates(self.sentence_index, query_embeddings, top_chunk_indices)
+
+    def retrieve_best_sentences(self, queries, top_k=TOP_K, batch_size=32, query_embeddings=None):
+        """
+        Retrieves the most relevant sentences for a batch of questions.
+
+        Encodes all questions in one model call (unless their embeddings are
+        passed in), searches FAISS with a single (N, d) query matrix and fuses
+        the results with the lexical backend. The sentences of all retrieved
+        chunks are then ranked together; a question gets an empty list when
+        none is relevant enough, and callers answer it with
+        generate_fallback_response.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+
+        query_embeddings, top_chunk_indices = self.search_chunks(queries, top_k=top_k, batch_size=batch_size,
+                                                                 query_embeddings=query_embeddings)
+        if (top_chunk_indices < 0).all():
+            return [[] for _ in queries]  # Every question missed, no sentence work needed
+
+        start = time.perf_counter()
+        candidates = self.sentence_candidates(query_embeddings, top_chunk_indices)
+        answers = self.reranker.rerank(queries, candidates, SENTENCES_PER_CHUNK * top_k)
+        self._stage("sentences", start)
+        return answers
+
+    def retrieve_best_sentence(self, query: str, top_k=TOP_K):
+        """Retrieves the most relevant sentences using FAISS and Elasticsearch."""
+        return self.retrieve_best_sentences([query], top_k=top_k)[0]
+
+    def index_version(self):
+        """
+        Identifies the index files on disk by size and modification time.
+
+        Changes whenever the FAISS index (or its bundle), chunk store or
+        sentence index is rebuilt, so answers cached for the old files can be dropped.
+        """
+        return files_version([self.embedding_path, self.chunk_store_path + ".ids.npy",
+                              self.sentence_paths.get("embeddings_path"),
+                              self.bundle_path and os.path.join(self.bundle_path, "manifest.json")])
+
+    def close(self):
+        """Drops every loaded component (the model is kept if it was passed in), so its memory can be freed."""
+        with self._lock:
+            components, self._components = self._components, {}
+            if not self._model_owned:
+                self._components["model"] = components["model"]
+        executor = components.get("executor")
+        if executor is not None:
+            executor.shutdown(wait=False)
+        text_chunks = components.get("text_chunks")
+        if text_chunks is not None:
+            text_chunks.close()
+        self.index_meta = None
+        self.load_times.clear()
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+def get_engine():
+    """Returns the shared process-wide engine, created (but not loaded) on first call."""
+    global _default_engine
+    if _default_engine is None:
+        with _default_engine_lock:
+            if _default_engine is None:
+                _default_engine = RetrievalEngine()
+    return _default_engine
 
 def search_es(query, top_k=2):
     """Searches Elasticsearch for relevant text."""
-    body = {"query": {"match": {"text": query}}}
-    response = es.search(index=INDEX_NAME, body=body, size=top_k)
-    return [(hit["_source"]["text"], hit["_score"]) for hit in response["hits"]["hits"]]
+    return get_engine().search_es(query, top_k=top_k)
+
+def search_lexical(query, top_k=2):
+    """Searches the configured lexical backend for relevant text."""
+    return get_engine().search_lexical(query, top_k=top_k)
 
 def generate_fallback_response(question):
     """Generate a fallback response when no relevant answer is found."""
@@ -70,21 +639,10 @@ def generate_fallback_response(question):
     ]
     return random.choice(templates) if keywords else "No exact answer, but the book covers relevant themes."
 
-def retrieve_best_sentence(query: str, top_k=5):
+def retrieve_best_sentences(queries, top_k=TOP_K, batch_size=32):
+    """Retrieves the most relevant sentences for a batch of questions."""
+    return get_engine().retrieve_best_sentences(queries, top_k=top_k, batch_size=batch_size)
+
+def retrieve_best_sentence(query: str, top_k=TOP_K):
     """Retrieves the most relevant sentences using FAISS and Elasticsearch."""
-    query_embedding = model.encode([query], convert_to_tensor=True).cpu().numpy()
-    distances, top_chunk_indices = index.search(query_embedding, top_k)
-    retrieved_sentences = []
-
-    for idx in top_chunk_indices[0]:  
-        if idx < len(text_chunks):
-            chunk = text_chunks[idx]
-            sentences = sent_tokenize(chunk)
-            sentence_embeddings = model.encode(sentences, convert_to_tensor=True).cpu().numpy()
-            similarities = np.dot(sentence_embeddings, query_embedding.T).flatten()
-            
-            # Get top 2 most relevant sentences
-            best_sentence_indices = np.argsort(similarities)[-2:][::-1]  
-            retrieved_sentences.extend([sentences[i] for i in best_sentence_indices])
-    
-    return retrieved_sentences if retrieved_sentences else ["❌ No relevant answer found!"]
+    return get_engine().retrieve_best_sentence(query, top_k=top_k)
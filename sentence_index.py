@@ -0,0 +1,157 @@
+import os
+import numpy as np
+from config import EMBEDDING_MODEL_NAME
+from chunks import chunk_ids, indexed_chunks_path, load_chunks
+from vector_math import normalize
+
+# Paths
+DATA_PATH = "K:/slm_project/data/tokenized_chunks.txt"
+SENTENCE_EMBEDDINGS_PATH = "K:/slm_project/data/sentence_embeddings.npy"
+SENTENCE_OFFSETS_PATH = "K:/slm_project/data/sentence_offsets.npy"
+SENTENCE_CHUNK_IDS_PATH = "K:/slm_project/data/sentence_chunk_ids.npy"
+SENTENCES_PATH = "K:/slm_project/data/sentences.txt"
+
+
+def split_chunks(text_chunks):
+    """
+    Splits every chunk into sentences.
+
+    Returns the flat sentence list and an offsets array of length
+    len(text_chunks) + 1, so the sentences of chunk i are
+    sentences[offsets[i]:offsets[i + 1]].
+    """
+    from nltk.tokenize import sent_tokenize
+
+    sentences = []
+    offsets = np.zeros(len(text_chunks) + 1, dtype=np.int64)
+
+    for i, chunk in enumerate(text_chunks):
+        sentences.extend(" ".join(s.split()) for s in sent_tokenize(chunk) if s.strip())
+        offsets[i + 1] = len(sentences)
+
+    return sentences, offsets
+
+
+def build_sentence_index(text_chunks, model, batch_size=64, ids=None, previous=None):
+    """
+    Splits chunks into sentences and encodes every sentence once.
+
+    With previous (the tuple returned by load_sentence_index), sentences of
+    chunks whose content ID is unchanged are copied over instead of being
+    split and encoded again.
+
+    Embeddings are L2-normalized, so ranking sentences against a normalized
+    question embedding scores them by cosine similarity, like the chunk index.
+
+    Returns (sentences, offsets, embeddings, ids).
+    """
+    ids = chunk_ids(text_chunks) if ids is None else np.asarray(ids, dtype=np.int64)
+    dimension = model.get_sentence_embedding_dimension()
+
+    reusable = {}
+    if previous is not None:
+        for position, previous_id in enumerate(previous[3]):
+            reusable.setdefault(int(previous_id), position)
+
+    fresh_positions = [i for i, cid in enumerate(ids) if int(cid) not in reusable]
+    fresh_sentences, fresh_offsets = split_chunks([text_chunks[i] for i in fresh_positions])
+    print(f"🔍 Encoding {len(fresh_sentences)} sentences from {len(fresh_positions)} new or changed chunks "
+          f"({len(ids) - len(fresh_positions)} chunks reused)...")
+
+    if fresh_sentences:
+        fresh_embeddings = model.encode(fresh_sentences, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=True)
+        fresh_embeddings = np.ascontiguousarray(fresh_embeddings, dtype=np.float32)
+    else:
+        fresh_embeddings = np.zeros((0, dimension), dtype=np.float32)
+
+    # Assemble the index in chunk order from reused and freshly encoded rows
+    fresh_slot = {position: slot for slot, position in enumerate(fresh_positions)}
+    sentences, copies = [], []
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+
+    for i, cid in enumerate(ids):
+        if i in fresh_slot:
+            source_sentences, source_offsets, source_embeddings, slot = fresh_sentences, fresh_offsets, fresh_embeddings, fresh_slot[i]
+        else:
+            source_sentences, source_offsets, source_embeddings, slot = previous[0], previous[1], previous[2], reusable[int(cid)]
+        start, end = source_offsets[slot], source_offsets[slot + 1]
+        sentences.extend(source_sentences[start:end])
+        copies.append((offsets[i], source_embeddings, start, end))
+        offsets[i + 1] = offsets[i] + (end - start)
+
+    embeddings = np.empty((len(sentences), dimension), dtype=np.float32)
+    for target, source_embeddings, start, end in copies:
+        embeddings[target:target + end - start] = source_embeddings[start:end]
+
+    return sentences, offsets, normalize(embeddings), ids
+
+
+def save_sentence_index(sentences, offsets, embeddings, ids,
+                        embeddings_path=SENTENCE_EMBEDDINGS_PATH,
+                        offsets_path=SENTENCE_OFFSETS_PATH,
+                        chunk_ids_path=SENTENCE_CHUNK_IDS_PATH,
+                        sentences_path=SENTENCES_PATH):
+    """Save sentence embeddings, chunk → sentence offsets, chunk IDs and sentence texts next to the FAISS index."""
+    np.save(embeddings_path, embeddings)
+    np.save(offsets_path, offsets)
+    np.save(chunk_ids_path, ids)
+    with open(sentences_path, "w", encoding="utf-8") as file:
+        for sentence in sentences:
+            file.write(sentence + "\n")
+
+
+def load_sentence_index(embeddings_path=SENTENCE_EMBEDDINGS_PATH,
+                        offsets_path=SENTENCE_OFFSETS_PATH,
+                        chunk_ids_path=SENTENCE_CHUNK_IDS_PATH,
+                        sentences_path=SENTENCES_PATH,
+                        mmap=True):
+    """
+    Load a precomputed sentence index as (sentences, offsets, embeddings, ids).
+
+    Embeddings are memory-mapped read-only by default, so only the rows
+    touched by a query are paged in.
+    """
+    for path in (embeddings_path, offsets_path, chunk_ids_path, sentences_path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"❌ Sentence index file not found: {path} (run sentence_index.py)")
+
+    embeddings = np.load(embeddings_path, mmap_mode="r" if mmap else None)
+    offsets = np.load(offsets_path)
+    ids = np.load(chunk_ids_path)
+    with open(sentences_path, "r", encoding="utf-8") as file:
+        sentences = file.read().splitlines()
+
+    if len(sentences) != embeddings.shape[0] or offsets[-1] != len(sentences) or len(ids) + 1 != len(offsets):
+        raise ValueError("❌ Sentence index files are inconsistent, rebuild with sentence_index.py")
+
+    return sentences, offsets, embeddings, ids
+
+
+if __name__ == "__main__":
+    import nltk
+    from encoders import load_encoder
+
+    try:
+        nltk.data.find("tokenizers/punkt")
+    except LookupError:
+        nltk.download("punkt")
+
+    print("📥 Loading SBERT model for sentence embeddings...")
+    model = load_encoder(model_name=EMBEDDING_MODEL_NAME)
+
+    print("📂 Loading tokenized chunks...")
+    text_chunks = load_chunks(indexed_chunks_path(DATA_PATH))
+
+    # Reuse sentences of unchanged chunks from the previous build (loaded fully, since it gets overwritten)
+    try:
+        previous = load_sentence_index(mmap=False)
+    except (FileNotFoundError, ValueError):
+        previous = None
+
+    print("🔍 Splitting chunks into sentences and encoding them...")
+    sentences, offsets, embeddings, ids = build_sentence_index(text_chunks, model, previous=previous)
+
+    print("💾 Saving sentence index...")
+    save_sentence_index(sentences, offsets, embeddings, ids)
+
+    print(f"✅ Indexed {len(sentences)} sentences from {len(text_chunks)} chunks into {SENTENCE_EMBEDDINGS_PATH}")
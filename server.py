@@ -0,0 +1,292 @@
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler
+import metrics
+from answer_cache import AnswerCache
+from config import SHARD_MEMORY_BUDGET_MB, TOP_K
+from retrieval import generate_fallback_response, get_engine
+from shards import ShardedRetriever
+
+# Micro-batching defaults
+MAX_BATCH_SIZE = 32  # Questions encoded and searched together
+MAX_WAIT_MS = 5.0  # How long the first question of a batch waits for others to join
+MAX_QUEUE = 256  # Questions waiting for a batch before new requests are rejected
+REQUEST_TIMEOUT = 10.0  # Seconds a request waits for its answer
+RETRY_AFTER = 1  # Seconds clients are asked to back off when the queue is full
+DEFAULT_TOP_K = TOP_K
+
+BATCH_SIZES = metrics.REGISTRY.histogram("slm_batch_size", "Questions answered per micro-batch.",
+                                         buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+REJECTED = metrics.REGISTRY.counter("slm_requests_rejected_total", "Questions rejected because the queue was full.")
+
+
+class Overloaded(Exception):
+    """Raised when the request queue is full."""
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent questions into batches for the retrieval engine.
+
+    A single worker thread takes the first waiting question, then keeps
+    collecting until max_batch_size questions are gathered or max_wait_ms
+    has passed, and answers the whole batch with one encoder call and one
+    FAISS search. The queue is bounded: submit() raises Overloaded once
+    max_queue questions are waiting, so callers can shed load instead of
+    piling up latency.
+    """
+
+    def __init__(self, engine, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, max_queue=MAX_QUEUE):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(max_queue)
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "rejected": 0, "batches": 0, "errors": 0, "batch_seconds": 0.0}
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, question, top_k=DEFAULT_TOP_K, profile=False, corpora=None):
+        """
+        Queues a question and returns a Future resolving to its list of answers.
+
+        With profile, the batch holding the question runs under cProfile and
+        the future gets a .profile attribute with the report. corpora limits
+        a sharded engine to those corpora.
+        """
+        future = Future()
+        future.profile = None
+        try:
+            self._queue.put_nowait((question, (top_k, tuple(corpora) if corpora else None), future, profile))
+        except queue.Full:
+            with self._stats_lock:
+                self.stats["rejected"] += 1
+            REJECTED.inc()
+            raise Overloaded(f"{self._queue.maxsize} questions already waiting")
+        return future
+
+    def _collect(self):
+        """Blocks for one question, then gathers more until the batch is full or max_wait has passed."""
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _answer(self, batch):
+        # Questions asking for different top_k or corpora are searched separately
+        groups = {}
+        for item in batch:
+            groups.setdefault(item[1], []).append(item)
+
+        for (top_k, corpora), items in groups.items():
+            items = [item for item in items if item[2].set_running_or_notify_cancel()]
+            if not items:
+                continue
+            BATCH_SIZES.observe(len(items))
+            try:
+                with metrics.profiled(force=any(item[3] for item in items)) as profile:
+                    answers = self.engine.retrieve_best_sentences([item[0] for item in items], top_k=top_k,
+                                                                  batch_size=len(items),
+                                                                  **({"corpora": list(corpora)} if corpora else {}))
+            except Exception as e:
+                with self._stats_lock:
+                    self.stats["errors"] += 1
+                for item in items:
+                    item[2].set_exception(e)
+                continue
+            for (_, _, future, wants_profile), result in zip(items, answers):
+                if wants_profile:
+                    future.profile = profile.get("stats")
+                future.set_result(result)
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            self._answer(batch)
+            with self._stats_lock:
+                self.stats["requests"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["batch_seconds"] += time.perf_counter() - start
+
+    def report(self):
+        """Request, batch and rejection counts with mean batch size and latency."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        batches = max(stats["batches"], 1)
+        return {"requests": stats["requests"], "rejected": stats["rejected"], "errors": stats["errors"],
+                "batches": stats["batches"], "queued": self._queue.qsize(),
+                "mean_batch_size": stats["requests"] / batches,
+                "mean_batch_ms": 1000 * stats["batch_seconds"] / batches}
+
+    def close(self):
+        self._stop.set()
+        self._worker.join()
+
+
+def create_app(engine=None, batcher=None, warm_up=True):
+    """
+    Builds the Flask app.
+
+    Model, index and sentence index are loaded by a background warm-up;
+    /readyz answers 503 until it has finished, so a load balancer only
+    routes questions to a warm instance. /healthz only reports liveness.
+    engine may be wrapped in an AnswerCache.
+    """
+    engine = engine or get_engine()
+    batcher = batcher or MicroBatcher(engine)
+    cache = engine if isinstance(engine, AnswerCache) else None
+    backend = cache.engine if cache else engine
+    sharded = isinstance(backend, ShardedRetriever)
+    app = Flask(__name__)
+    state = {"ready": False, "error": None}
+
+    def run_warm_up():
+        try:
+            backend.warm_up()
+            state["ready"] = True
+        except Exception as e:
+            state["error"] = f"{type(e).__name__}: {e}"
+
+    if warm_up:
+        threading.Thread(target=run_warm_up, name="warm-up", daemon=True).start()
+    else:
+        state["ready"] = True
+
+    @app.get("/healthz")
+    def healthz():
+        return jsonify({"status": "ok"})
+
+    @app.get("/readyz")
+    def readyz():
+        if state["ready"]:
+            return jsonify({"status": "ready", "load_times": backend.load_times})
+        body = {"status": "failed" if state["error"] else "warming_up", "error": state["error"]}
+        return jsonify(body), 503
+
+    @app.get("/stats")
+    def stats():
+        body = {"batcher": batcher.report(), "backends": backend.latency_report(),
+                "load_times": backend.load_times, "metrics": metrics.snapshot()}
+        if cache:
+            body["cache"] = cache.report()
+        body["rerank"] = backend.reranker.report()
+        if sharded:
+            body["shards"] = backend.report()
+        return jsonify(body)
+
+    @app.get("/metrics")
+    def prometheus_metrics():
+        return metrics.export_prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    @app.post("/answer")
+    @metrics.timed("http_answer")
+    def answer():
+        """
+        Answers {"question": "..."} or {"questions": ["...", ...]}, with an optional "top_k"
+        and, when serving several corpora, an optional "corpora" list to search.
+
+        With ?profile=1 the response includes a cProfile report of the batch.
+        """
+        if not state["ready"]:
+            return jsonify({"error": "warming up"}), 503, {"Retry-After": str(RETRY_AFTER)}
+
+        body = request.get_json(silent=True) or {}
+        single = not body.get("questions")
+        questions = [body.get("question")] if single else body["questions"]
+        if not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+            return jsonify({"error": "expected a non-empty 'question' or 'questions'"}), 400
+        top_k = body.get("top_k", DEFAULT_TOP_K)
+        if isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 1:  # JSON true / false are ints in Python
+            return jsonify({"error": "'top_k' must be a positive integer"}), 400
+        corpora = body.get("corpora")
+        if corpora is not None:
+            if not sharded:
+                return jsonify({"error": "'corpora' needs a server started with --shards"}), 400
+            if not isinstance(corpora, list) or not corpora or not all(isinstance(c, str) for c in corpora):
+                return jsonify({"error": "'corpora' must be a non-empty list of corpus names"}), 400
+            unknown = sorted(set(corpora) - set(backend.registry.names()))
+            if unknown:
+                return jsonify({"error": f"unknown corpora: {', '.join(unknown)}"}), 400
+
+        profile = request.args.get("profile") == "1"
+        futures = []
+        try:
+            for question in questions:
+                futures.append(batcher.submit(question, top_k, profile, corpora))
+        except Overloaded as e:
+            for future in futures:
+                future.cancel()
+            return jsonify({"error": f"overloaded: {e}"}), 503, {"Retry-After": str(RETRY_AFTER)}
+
+        deadline = time.perf_counter() + REQUEST_TIMEOUT
+        results = []
+        try:
+            for question, future in zip(questions, futures):
+                answers = future.result(timeout=max(deadline - time.perf_counter(), 0))
+                fallback = not answers
+                results.append({
+                    "question": question,
+                    "answers": [generate_fallback_response(question)] if fallback else answers,
+                    "fallback": fallback,
+                })
+        except FutureTimeout:
+            for future in futures:
+                future.cancel()
+            return jsonify({"error": "timed out"}), 504
+        except Exception as e:
+            return jsonify({"error": f"{type(e).__name__}: {e}"}), 500
+
+        response = results[0] if single else {"results": results}
+        if profile:
+            response["profile"] = [future.profile for future in futures]
+        return jsonify(response)
+
+    app.batcher = batcher
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve question answering over HTTP with micro-batching.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on.")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE, help="Questions answered together.")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS, help="Time a question waits for others to join its batch.")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="Waiting questions before requests get 503.")
+    parser.add_argument("--shards", action="store_true", help="Serve every corpus of the shard registry instead of the single index.")
+    parser.add_argument("--shard-budget-mb", type=int, default=SHARD_MEMORY_BUDGET_MB, help="Memory for resident corpora with --shards.")
+    parser.add_argument("--no-cache", action="store_true", help="Search every question instead of reusing cached answers.")
+    args = parser.parse_args()
+
+    metrics.configure_logging()
+    engine = ShardedRetriever(memory_budget_mb=args.shard_budget_mb) if args.shards else get_engine()
+    if not args.no_cache:
+        engine = AnswerCache(engine)
+    batcher = MicroBatcher(engine, args.max_batch_size, args.max_wait_ms, args.max_queue)
+    app = create_app(engine, batcher)
+
+    # HTTP/1.1 keeps client connections alive between requests
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    print(f"🚀 Serving on http://{args.host}:{args.port} (batches of up to {args.max_batch_size}, {args.max_wait_ms}ms wait)")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+import argparse
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
+import metrics
+from bm25 import index_paths as bm25_paths
+from config import (EMBEDDING_MODEL_NAME, ENCODER_BACKEND, SENTENCES_PER_CHUNK, SHARD_MEMORY_BUDGET_MB, SHARD_SEARCH_THREADS,
+                    SHARDS_DIR, TOP_K, data_paths)
+from fusion import RRF_K, fuse
+from rerank import SentenceReranker, merge_candidates
+from retrieval import FUSION_WEIGHTS, RetrievalEngine, data_dir_version
+
+REGISTRY_FILE = "registry.json"
+
+logger = logging.getLogger("slm.shards")
+
+ShardHit = namedtuple("ShardHit", ["score", "corpus", "position", "text", "sources"], defaults=(None,))
+
+
+class ShardRegistry:
+    """
+    The corpora that can be searched, each one a data directory written by ingest.py.
+
+    Corpora are listed in root/registry.json with free-form metadata (title,
+    source PDF, ...). Data directories directly under root are picked up as
+    corpora named after the directory, so `ingest.py --corpus NAME` is all it
+    takes to add a book.
+    """
+
+    def __init__(self, root=SHARDS_DIR):
+        self.root = root
+        self.path = os.path.join(root, REGISTRY_FILE)
+        self._lock = threading.Lock()
+        self._corpora = self._read()
+
+    def _read(self):
+        corpora = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                corpora = json.load(file)["corpora"]
+        if os.path.isdir(self.root):
+            for name in sorted(os.listdir(self.root)):
+                if name not in corpora and os.path.exists(data_paths(os.path.join(self.root, name))["embeddings_index"]):
+                    corpora[name] = {"path": name}
+        return corpora
+
+    def _write(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({"corpora": self._corpora}, file, indent=2, ensure_ascii=False)
+        os.replace(self.path + ".tmp", self.path)
+
+    def register(self, name, data_dir=None, **metadata):
+        """Adds or updates a corpus. data_dir defaults to root/name; relative paths are relative to root."""
+        entry = {"path": data_dir or name, **metadata}
+        with self._lock:
+            self._corpora[name] = entry
+            self._write()
+        return entry
+
+    def unregister(self, name):
+        with self._lock:
+            self._corpora.pop(name)
+            self._write()
+
+    def names(self):
+        return sorted(self._corpora)
+
+    def metadata(self, name):
+        return dict(self._corpora[name])
+
+    def data_dir(self, name):
+        if name not in self._corpora:
+            raise KeyError(f"❌ Unknown corpus: {name}")
+        return os.path.join(self.root, self._corpora[name]["path"])
+
+    def estimate_bytes(self, name, lexical_backend=""):
+        """
+        Memory a loaded shard takes, estimated from its files.
+
+        The FAISS index, sentence tables and sentence text are read into
+        memory; chunk text and embeddings are memory-mapped and left to the
+        page cache, so they are not counted. Python strings take about twice
+        their UTF-8 size.
+        """
+        paths = data_paths(self.data_dir(name))
+        sizes = {key: os.path.getsize(paths[key]) if os.path.exists(paths[key]) else 0
+                 for key in ("embeddings_index", "sentence_offsets", "sentence_chunk_ids", "sentences")}
+        terms = bm25_paths(paths["bm25"])["terms"]
+        lexical = 2 * os.path.getsize(terms) if lexical_backend == "bm25" and os.path.exists(terms) else 0
+        return (sizes["embeddings_index"] + sizes["sentence_offsets"] + sizes["sentence_chunk_ids"]
+                + 2 * sizes["sentences"] + lexical)
+
+
+class _Shard:
+    __slots__ = ("name", "engine", "nbytes", "users", "evicted")
+
+    def __init__(self, name, engine, nbytes):
+        self.name = name
+        self.engine = engine
+        self.nbytes = nbytes
+        self.users = 0
+        self.evicted = False
+
+
+class ShardedRetriever:
+    """
+    Answers questions across many corpora, each searched by its own RetrievalEngine.
+
+    Questions are encoded once with a shared SBERT model, fanned out to the
+    selected shards on a thread pool. Each shard returns its vector and
+    lexical results unfused: the vector similarities of all shards (same
+    model) are merged into one ranking with a heap, and fused once with the
+    lexical ranking of every shard, whose BM25 scores are not comparable.
+
+    Shards are opened on first use and kept in LRU order. Once the
+    estimated memory of the resident shards exceeds memory_budget_mb, the
+    least recently used ones are unloaded; a shard still being searched is
+    closed only when that search finishes.
+    """
+
+    def __init__(self, registry=None, memory_budget_mb=SHARD_MEMORY_BUDGET_MB, max_workers=SHARD_SEARCH_THREADS,
+                 model=None, model_name=EMBEDDING_MODEL_NAME, encoder_backend=ENCODER_BACKEND, verbose=True,
+                 reranker=None, **engine_kwargs):
+        self.registry = registry or ShardRegistry()
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.model_name = model_name
+        self.encoder_backend = encoder_backend
+        self.verbose = verbose
+        self.engine_kwargs = engine_kwargs
+        self.fusion = engine_kwargs.get("fusion", "rrf")
+        self.fusion_weights = dict(engine_kwargs.get("fusion_weights") or FUSION_WEIGHTS)
+        self.rrf_k = engine_kwargs.get("rrf_k", RRF_K)
+        self.reranker = reranker or SentenceReranker()
+        self.load_times = {}
+        self.stats = {"loads": 0, "evictions": 0}
+        self._model = model
+        self._shards = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard")
+
+    def _log(self, message, level=logging.INFO):
+        if self.verbose:
+            logger.log(level, message)
+
+    @property
+    def model(self):
+        """The SBERT model shared by every shard, loaded on first use."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from encoders import load_encoder
+
+                    self._log(f"📥 Loading SBERT model ({self.encoder_backend})...")
+                    start = time.perf_counter()
+                    self._model = load_encoder(self.encoder_backend, self.model_name)
+                    self.load_times["model"] = time.perf_counter() - start
+        return self._model
+
+    def _open(self, name):
+        data_dir = self.registry.data_dir(name)
+        kwargs = dict(self.engine_kwargs)
+        if "lexical_backend" not in kwargs:
+            # Each shard has its own BM25 index if ingest built one; Elasticsearch serves a single index
+            kwargs["lexical_backend"] = "bm25" if os.path.exists(bm25_paths(data_paths(data_dir)["bm25"])["meta"]) else ""
+        engine = RetrievalEngine.from_data_dir(data_dir, model=self.model, verbose=self.verbose, **kwargs)
+        return _Shard(name, engine, self.registry.estimate_bytes(name, kwargs["lexical_backend"]))
+
+    def _evict(self, keep):
+        """Unloads least recently used shards until the rest fit the budget. Call with the lock held."""
+        total = sum(shard.nbytes for shard in self._shards.values())
+        for name in list(self._shards):
+            if total <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            shard = self._shards.pop(name)
+            total -= shard.nbytes
+            shard.evicted = True
+            self.stats["evictions"] += 1
+            metrics.count("shards", event="evict")
+            self._log(f"♻️ Unloading corpus {name} ({shard.nbytes / 2**20:.1f}MB)")
+            if shard.users == 0:
+                shard.engine.close()
+        if total > self.memory_budget:
+            self._log(f"⚠️ Resident corpora take {total / 2**20:.1f}MB, over the {self.memory_budget / 2**20:.0f}MB budget",
+                      logging.WARNING)
+
+    @contextmanager
+    def acquire(self, name):
+        """Yields the engine of a corpus, opening it (and evicting others) if it is not resident."""
+        with self._lock:
+            shard = self._shards.get(name)
+            if shard is None:
+                shard = self._shards[name] = self._open(name)
+                self.stats["loads"] += 1
+                metrics.count("shards", event="load")
+                self._log(f"📂 Opening corpus {name} (~{shard.nbytes / 2**20:.1f}MB)")
+                self._evict(keep=name)
+            self._shards.move_to_end(name)
+            shard.users += 1
+        try:
+            yield shard.engine
+        finally:
+            with self._lock:
+                shard.users -= 1
+                if shard.evicted and shard.users == 0:
+                    shard.engine.close()
+
+    def load(self, name):
+        """Opens a corpus and loads its index and sentence index now rather than on its first question."""
+        with self.acquire(name) as engine:
+            return engine.warm_up()
+
+    def unload(self, name):
+        """Closes a resident corpus. Returns False if it was not loaded."""
+        with self._lock:
+            shard = self._shards.pop(name, None)
+            if shard is None:
+                return False
+            shard.evicted = True
+            if shard.users == 0:
+                shard.engine.close()
+        return True
+
+    def resident(self):
+        """Estimated bytes of every loaded corpus, least recently used first."""
+        with self._lock:
+            return OrderedDict((name, shard.nbytes) for name, shard in self._shards.items())
+
+    def _select(self, corpora):
+        names = self.registry.names()
+        if corpora is None:
+            return names
+        unknown = sorted(set(corpora) - set(names))
+        if unknown:
+            raise ValueError(f"❌ Unknown corpora: {', '.join(unknown)}")
+        return list(dict.fromkeys(corpora))
+
+    def _search_shard(self, name, queries, top_k, query_embeddings):
+        with self.acquire(name) as engine, metrics.timer("shard_search"):
+            embeddings, positions, scores, lexical = engine.search_components(queries, top_k,
+                                                                              query_embeddings=query_embeddings)
+        vector = [[((name, int(p)), float(score)) for p, score in zip(row, row_scores) if p >= 0]
+                  for row, row_scores in zip(positions, scores)]
+        if lexical is not None:
+            lexical = [[((name, p), score) for p, score in hits] for hits in lexical]
+        return embeddings, vector, lexical
+
+    def _merge(self, shard_results, q, top_k):
+        """One query's hits of all shards in one ranking: similarities if no shard answered lexically, else fused scores."""
+        ranked = heapq.nlargest(top_k, chain.from_iterable(vector[q] for _, vector, _ in shard_results),
+                                key=lambda hit: hit[1])
+        lexical_lists = [lexical[q] for _, _, lexical in shard_results if lexical is not None]
+        if lexical_lists:
+            ranked = fuse(ranked, lexical_lists, self.fusion, self.fusion_weights, k=self.rrf_k, top_k=top_k)
+        return [ShardHit(float(score), name, position, None) for (name, position), score in ranked]
+
+    def _fan_out(self, queries, top_k, corpora, batch_size, query_embeddings=None):
+        """Searches every selected shard in parallel; returns the merged hits and each shard's query embeddings."""
+        names = self._select(corpora)
+        if query_embeddings is None:
+            with metrics.timer("encode", scope="shards"):
+                query_embeddings = self.model.encode(queries, batch_size=batch_size, convert_to_numpy=True)
+
+        futures = {name: self._executor.submit(metrics.profile_worker(self._search_shard), name, queries, top_k, query_embeddings)
+                   for name in names}
+        per_shard = {name: future.result() for name, future in futures.items()}
+
+        with metrics.timer("merge", scope="shards"):
+            merged = [self._merge(list(per_shard.values()), q, top_k) for q in range(len(queries))]
+        return merged, {name: results[0] for name, results in per_shard.items()}
+
+    def search(self, queries, top_k=TOP_K, corpora=None, batch_size=32):
+        """
+        Finds the top_k chunks of each question across the selected corpora (all by default).
+
+        Returns, per question, ShardHit(score, corpus, position, text, sources) tuples, best first.
+        sources lists the source chunk positions the hit stands for, more than
+        one when near-duplicate chunks were collapsed into it at ingest.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        merged, _ = self._fan_out(queries, top_k, corpora, batch_size)
+        results = [[] for _ in queries]
+        for name in {hit.corpus for hits in merged for hit in hits}:
+            with self.acquire(name) as engine:
+                for q, hits in enumerate(merged):
+                    results[q].extend((i, hit._replace(text=engine.text_chunks[hit.position],
+                                                       sources=engine.source_positions(hit.position).tolist()))
+                                      for i, hit in enumerate(hits) if hit.corpus == name)
+        return [[hit for _, hit in sorted(pairs)] for pairs in results]
+
+    def _shard_sentences(self, name, query_embeddings, merged):
+        with self.acquire(name) as engine:
+            chunk_indices = [[hit.position for hit in hits if hit.corpus == name] for hits in merged]
+            return engine.sentence_candidates(query_embeddings, chunk_indices)
+
+    def retrieve_best_sentences(self, queries, top_k=TOP_K, batch_size=32, corpora=None, query_embeddings=None):
+        """
+        Retrieves the most relevant sentences for a batch of questions across the selected corpora.
+
+        The sentences of the top_k chunks of the merged ranking are ranked
+        together by one reranker, so the result matches
+        RetrievalEngine.retrieve_best_sentences.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+
+        merged, shard_embeddings = self._fan_out(queries, top_k, corpora, batch_size, query_embeddings)
+        start = time.perf_counter()
+        names = sorted({hit.corpus for hits in merged for hit in hits})
+        futures = {name: self._executor.submit(metrics.profile_worker(self._shard_sentences), name, shard_embeddings[name], merged)
+                   for name in names}
+        selected = {name: future.result() for name, future in futures.items()}
+        metrics.observe("sentences", time.perf_counter() - start, scope="shards")
+
+        candidates = [merge_candidates(selected[name][q] for name in names) for q in range(len(queries))]
+        return self.reranker.rerank(queries, candidates, SENTENCES_PER_CHUNK * top_k)
+
+    def retrieve_best_sentence(self, query, top_k=TOP_K, corpora=None):
+        return self.retrieve_best_sentences([query], top_k=top_k, corpora=corpora)[0]
+
+    def index_version(self):
+        """The registered corpora and the index version of each; changes when a corpus is added or rebuilt."""
+        return tuple((name, data_dir_version(self.registry.data_dir(name))) for name in self.registry.names())
+
+    def warm_up(self):
+        """Loads the shared model and cross-encoder; shards are opened by the questions that need them."""
+        self.model
+        seconds = self.reranker.warm_up()
+        if seconds is not None:
+            self.load_times["cross_encoder"] = seconds
+        return dict(self.load_times)
+
+    def latency_report(self):
+        """Backend latencies of every resident corpus."""
+        with self._lock:
+            shards = list(self._shards.values())
+        return {shard.name: shard.engine.latency_report() for shard in shards}
+
+    def report(self):
+        """Loaded corpora, their estimated memory and the load / eviction counts."""
+        resident = self.resident()
+        return {"corpora": len(self.registry.names()),
+                "resident_mb": {name: round(nbytes / 2**20, 1) for name, nbytes in resident.items()},
+                "total_mb": round(sum(resident.values()) / 2**20, 1),
+                "budget_mb": round(self.memory_budget / 2**20), **self.stats}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for shard in self._shards.values():
+                shard.engine.close()
+            self._shards.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage corpora and ask questions across them.")
+    parser.add_argument("--root", default=SHARDS_DIR, help="Directory holding the corpora and registry.json.")
+    parser.add_argument("--list", action="store_true", help="List the registered corpora.")
+    parser.add_argument("--register", nargs=2, metavar=("NAME", "DATA_DIR"), help="Register an existing data directory as a corpus.")
+    parser.add_argument("--title", help="Title stored with --register.")
+    parser.add_argument("--unregister", metavar="NAME", help="Remove a corpus from the registry (its files are kept).")
+    parser.add_argument("--query", action="append", help="Question to answer (repeatable).")
+    parser.add_argument("--corpus", nargs="+", help="Only search these corpora.")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="Chunks retrieved per question across all corpora (upper bound).")
+    parser.add_argument("--budget-mb", type=int, default=SHARD_MEMORY_BUDGET_MB, help="Memory for resident corpora.")
+    args = parser.parse_args()
+
+    metrics.configure_logging()
+    registry = ShardRegistry(args.root)
+    if args.register:
+        name, data_dir = args.register
+        registry.register(name, os.path.abspath(data_dir), **({"title": args.title} if args.title else {}))
+        print(f"✅ Registered corpus {name} → {data_dir}")
+    if args.unregister:
+        registry.unregister(args.unregister)
+        print(f"🗑️ Unregistered corpus {args.unregister}")
+    if args.list:
+        for name in registry.names():
+            size = registry.estimate_bytes(name) / 2**20
+            print(f"📚 {name:<30} ~{size:8.1f}MB  {registry.data_dir(name)}  {registry.metadata(name).get('title', '')}")
+
+    if args.query:
+        retriever = ShardedRetriever(registry, memory_budget_mb=args.budget_mb)
+        for question, hits in zip(args.query, retriever.search(args.query, args.top_k, args.corpus)):
+            print(f"\n❓ {question}")
+            for hit in hits:
+                duplicates = f" (+{len(hit.sources) - 1} near-duplicates)" if len(hit.sources) > 1 else ""
+                print(f"   [{hit.corpus}] {hit.score:.3f}  {hit.text[:160]}{duplicates}")
+        retriever.close()
+
+
+if __name__ == "__main__":
+    main()
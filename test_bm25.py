@@ -0,0 +1,87 @@
+import math
+import os
+import tempfile
+import unittest
+import numpy as np
+from bm25 import B, K1, BM25Index, tokenize
+from chunks import chunk_id
+
+
+def reference_scores(texts, query, k1=K1, b=B):
+    """Textbook BM25 score of every document, computed term by term."""
+    documents = [tokenize(text) for text in texts]
+    average_length = sum(len(tokens) for tokens in documents) / len(documents)
+    scores = np.zeros(len(documents))
+    for term in set(tokenize(query)):
+        frequency = sum(term in tokens for tokens in documents)
+        if not frequency:
+            continue
+        idf = math.log(1 + (len(documents) - frequency + 0.5) / (frequency + 0.5))
+        for doc, tokens in enumerate(documents):
+            tf = tokens.count(term)
+            scores[doc] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / average_length))
+    return scores
+
+
+class BM25IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.texts = [f"Rocket {i} carries satellites into orbit, rocket stage {i % 3}." for i in range(38)]
+        self.texts += ["The telescope watched the comet.", "Fuel pumps feed the rocket engine the fuel."]
+        self.ids = [chunk_id(text) for text in self.texts]
+        self.index = BM25Index.build(self.texts, self.ids)
+
+    def test_postings_are_grouped_by_term(self):
+        offsets = self.index.term_offsets
+        self.assertEqual(len(offsets), len(self.index.vocabulary) + 1)
+        self.assertEqual(offsets[0], 0)
+        self.assertEqual(offsets[-1], len(self.index.doc_ids))
+        self.assertTrue(np.all(np.diff(offsets) > 0))
+        for term, term_id in self.index.vocabulary.items():
+            docs = self.index.doc_ids[offsets[term_id]:offsets[term_id + 1]]
+            self.assertTrue(np.all(np.diff(docs) > 0))  # Each document once, in order
+            self.assertEqual(docs.tolist(), [d for d, text in enumerate(self.texts) if term in tokenize(text)])
+
+    def test_scores_match_reference(self):
+        # "rocket" covers most documents (dense accumulation), "comet" one (sparse accumulation)
+        for query in ("rocket", "comet", "fuel pumps", "rocket stage 2 telescope"):
+            expected = reference_scores(self.texts, query)
+            docs, scores = self.index.score(query)
+            self.assertEqual(docs.tolist(), np.flatnonzero(expected).tolist())
+            np.testing.assert_allclose(scores, expected[docs], rtol=1e-5)
+
+    def test_unknown_terms_match_nothing(self):
+        docs, scores = self.index.score("quasar nebula")
+        self.assertEqual(len(docs), 0)
+        self.assertEqual(self.index.search(["quasar nebula"], 5), [[]])
+
+    def test_search_returns_best_chunk_ids_first(self):
+        results = self.index.search(["fuel rocket", "comet"], 3)
+        expected = reference_scores(self.texts, "fuel rocket")
+        self.assertEqual(len(results[0]), 3)
+        self.assertEqual(results[0][0][0], self.ids[int(np.argmax(expected))])
+        scores = [score for _, score in results[0]]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual([cid for cid, _ in results[1]], [self.ids[38]])
+
+    def test_save_load_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            prefix = os.path.join(tmp, "bm25")
+            self.index.save(prefix)
+            loaded = BM25Index.load(prefix)
+            self.assertEqual(loaded.vocabulary, self.index.vocabulary)
+            self.assertEqual(loaded.meta, self.index.meta)
+            for name in ("term_offsets", "doc_ids", "impacts", "chunk_ids"):
+                self.assertIsInstance(getattr(loaded, name), np.memmap)
+                np.testing.assert_array_equal(getattr(loaded, name), getattr(self.index, name))
+            queries = ["rocket stage 1", "comet", "fuel"]
+            self.assertEqual(loaded.search(queries, 5), self.index.search(queries, 5))
+            del loaded  # Release the memory maps before the directory is removed
+
+    def test_load_reports_missing_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(FileNotFoundError):
+                BM25Index.load(os.path.join(tmp, "bm25"))
+
+
+if __name__ == "__main__":
+    unittest.main()
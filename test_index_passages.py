@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import index_passages
+from chunk_store import ChunkStore, ChunkStoreWriter
+from chunks import chunk_id
+
+
+class FakeModel:
+    """Stands in for the SBERT model: fixed-size zero embeddings."""
+
+    def get_sentence_embedding_dimension(self):
+        return 4
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        return np.zeros((len(texts), 4), dtype=np.float32)
+
+
+class FakeIndices:
+    def __init__(self):
+        self.settings = {}
+        self.created = False
+
+    def exists(self, index):
+        return self.created
+
+    def create(self, index, mappings):
+        self.created = True
+
+    def get_settings(self, index):
+        return {index: {"settings": {"index": dict(self.settings)}}}
+
+    def put_settings(self, index, settings):
+        self.settings.update(settings)
+
+    def refresh(self, index):
+        pass
+
+
+class FakeElasticsearch:
+    """Local stand-in for the Elasticsearch client, holding indexed documents by _id."""
+
+    def __init__(self):
+        self.indices = FakeIndices()
+        self.documents = {}
+
+
+def fake_parallel_bulk(fail_after=None):
+    """helpers.parallel_bulk double that stores each action, optionally failing after fail_after documents."""
+    def parallel_bulk(es, actions, thread_count=4, chunk_size=500):
+        for count, action in enumerate(actions):
+            if count == fail_after:
+                raise ConnectionError("bulk request failed")
+            es.documents[action["_id"]] = action["_source"]
+            yield True, {"index": {"_id": action["_id"], "status": 201}}
+    return parallel_bulk
+
+
+class IndexPassagesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        prefix = os.path.join(self.tmp.name, "chunks")
+        self.texts = [f"Passage number {i} about rockets and satellites." for i in range(23)]
+        with ChunkStoreWriter(prefix) as writer:
+            for text in self.texts:
+                writer.append(text)
+        self.passages = ChunkStore(prefix)
+        self.checkpoint = os.path.join(self.tmp.name, "checkpoint.json")
+        self.es = FakeElasticsearch()
+
+    def tearDown(self):
+        self.passages.close()
+        self.tmp.cleanup()
+
+    def run_index(self, start=0, fail_after=None):
+        with mock.patch.object(index_passages.helpers, "parallel_bulk", fake_parallel_bulk(fail_after)), \
+                mock.patch.object(index_passages, "CHECKPOINT_EVERY", 5):
+            return index_passages.index_passages(self.es, self.passages, FakeModel(), "test_index", chunk_size=4,
+                                                 thread_count=2, encode_batch_size=8, start=start,
+                                                 checkpoint_path=self.checkpoint)
+
+    def test_documents_are_keyed_by_chunk_id(self):
+        self.assertEqual(self.run_index(), len(self.texts))
+        self.assertEqual(set(self.es.documents), {str(chunk_id(text)) for text in self.texts})
+        for doc_id, source in self.es.documents.items():
+            self.assertEqual(doc_id, str(source["chunk_id"]))
+            self.assertEqual(source["chunk_id"], int(self.passages.ids[source["position"]]))
+            self.assertEqual(source["text"], self.texts[source["position"]])
+        self.assertEqual(self.es.indices.settings["refresh_interval"], "1s")  # Restored after the load
+
+    def test_rerun_resumes_from_checkpoint(self):
+        with self.assertRaises(ConnectionError):
+            self.run_index(fail_after=7)
+        self.assertEqual(self.es.indices.settings["refresh_interval"], "1s")  # Restored after the failure
+
+        fingerprint = index_passages.store_fingerprint(self.passages)
+        start = index_passages.load_checkpoint(self.checkpoint, "test_index", fingerprint)
+        self.assertEqual(start, 7)
+        self.assertEqual(index_passages.load_checkpoint(self.checkpoint, "other_index", fingerprint), 0)
+
+        indexed_before = dict(self.es.documents)
+        self.es.documents.clear()
+        self.assertEqual(self.run_index(start=start), len(self.texts))
+        self.assertEqual(sorted(source["position"] for source in self.es.documents.values()),
+                         list(range(start, len(self.texts))))  # Only the rest is re-sent
+        self.assertEqual(len({**indexed_before, **self.es.documents}), len(self.texts))
+        self.assertEqual(index_passages.load_checkpoint(self.checkpoint, "test_index", fingerprint), len(self.texts))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+import numpy as np
+from retrieval import adaptive_keep
+
+
+class AdaptiveKeepTest(unittest.TestCase):
+    def test_keeps_results_within_the_gap_of_the_best(self):
+        scores = np.array([[0.80, 0.76, 0.75, 0.60],
+                           [0.50, 0.49, 0.30, 0.29]], dtype=np.float32)
+        keep = adaptive_keep(scores, min_score=0.4, score_gap=0.05)
+        self.assertEqual(keep.tolist(), [[True, True, True, False],
+                                         [True, True, False, False]])
+
+    def test_weak_best_result_is_a_miss(self):
+        scores = np.array([[0.39, 0.38], [0.40, 0.10]], dtype=np.float32)
+        keep = adaptive_keep(scores, min_score=0.4, score_gap=0.05)
+        self.assertEqual(keep.tolist(), [[False, False], [True, False]])
+
+    def test_gap_bounds_are_inclusive(self):
+        scores = np.array([[0.5, 0.25, 0.0]])
+        self.assertEqual(adaptive_keep(scores, min_score=0.5, score_gap=0.25).tolist(), [[True, True, False]])
+        self.assertEqual(adaptive_keep(scores, min_score=-1.0, score_gap=1.0).all(), True)
+        self.assertEqual(adaptive_keep(scores, min_score=-1.0, score_gap=0.0).tolist(), [[True, False, False]])
+
+    def test_padding_is_never_kept(self):
+        # The engine pads queries with fewer than k results with -inf similarities (and position -1)
+        scores = np.array([[0.9, -np.inf], [-np.inf, -np.inf]], dtype=np.float32)
+        keep = adaptive_keep(scores, min_score=0.0, score_gap=10.0)
+        self.assertEqual(keep.tolist(), [[True, False], [False, False]])
+
+    def test_empty_batch(self):
+        self.assertEqual(adaptive_keep(np.zeros((0, 5), dtype=np.float32)).shape, (0, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
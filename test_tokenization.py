@@ -0,0 +1,87 @@
+import re
+import unittest
+from config import CHUNK_MAX_TOKENS
+from tokenization import MIN_CHUNK_TOKENS, iter_chunks
+
+RE_WORD = re.compile(r"\S+")
+
+
+class WordTokenizer:
+    """Stands in for the fast subword tokenizer: one token per whitespace-separated word."""
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False, **kwargs):
+        if isinstance(text, list):
+            return {"input_ids": [list(range(len(RE_WORD.findall(t)))) for t in text]}
+        offsets = [match.span() for match in RE_WORD.finditer(text)]
+        return {"input_ids": list(range(len(offsets))), "offset_mapping": offsets}
+
+
+def sentence(number, length):
+    return " ".join(f"s{number}w{i}" for i in range(length))
+
+
+def count(text):
+    return len(RE_WORD.findall(text))
+
+
+class IterChunksTest(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = WordTokenizer()
+        self.sentences = [sentence(i, length) for i, length in enumerate([5, 7, 3, 9, 4, 6, 8, 2, 7, 5] * 4)]
+
+    def chunk(self, sentences, chunk_size, overlap, batch_size=7):
+        return list(iter_chunks(sentences, chunk_size, overlap, tokenizer=self.tokenizer, batch_size=batch_size))
+
+    def test_chunks_fit_the_window(self):
+        chunks = self.chunk(self.sentences, 30, 10)
+        self.assertGreater(len(chunks), 5)
+        for chunk in chunks:
+            self.assertLessEqual(count(chunk), 30)
+            self.assertGreater(count(chunk), MIN_CHUNK_TOKENS)
+
+    def test_overlap_is_the_longest_sentence_suffix_that_fits(self):
+        chunk_size, overlap = 30, 10
+        chunks = self.chunk(self.sentences, chunk_size, overlap)
+        position = 0  # Index of the first sentence of the current chunk
+        overlapping = 0
+        for previous, current in zip(chunks, chunks[1:]):
+            members = []
+            while " ".join(members) != previous:
+                members.append(self.sentences[position + len(members)])
+            following = self.sentences[position + len(members)]
+            # The trailing sentences kept: as many as fit in overlap and leave room for the next sentence
+            kept = len(members)
+            tokens = sum(count(s) for s in members)
+            while kept and (tokens > overlap or tokens + count(following) > chunk_size):
+                tokens -= count(members[len(members) - kept])
+                kept -= 1
+            self.assertLessEqual(tokens, overlap)
+            self.assertTrue(current.startswith(" ".join(members[len(members) - kept:] + [following])))
+            position += len(members) - kept
+            overlapping += kept > 0
+        self.assertGreater(overlapping, 0)
+        self.assertTrue(chunks[-1].endswith(self.sentences[-1]))
+
+    def test_no_overlap(self):
+        chunks = self.chunk(self.sentences, 30, 0)
+        self.assertEqual(" ".join(chunks), " ".join(self.sentences))
+
+    def test_chunk_size_is_capped_at_the_encoder_window(self):
+        sentences = [sentence(i, 20) for i in range(40)]
+        chunks = self.chunk(sentences, CHUNK_MAX_TOKENS * 4, 0)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(count(chunk) <= CHUNK_MAX_TOKENS for chunk in chunks))
+
+    def test_long_sentences_are_split_at_word_starts(self):
+        long_sentence = sentence(0, 75)
+        chunks = self.chunk([long_sentence], 30, 0)
+        self.assertEqual([count(chunk) for chunk in chunks], [30, 30, 15])
+        self.assertEqual(" ".join(chunks), long_sentence)
+
+    def test_short_chunks_are_dropped(self):
+        self.assertEqual(self.chunk([sentence(0, MIN_CHUNK_TOKENS)], 30, 0), [])
+        self.assertEqual(self.chunk([], 30, 10), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
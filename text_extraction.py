@@ -1,13 +1,190 @@
 import pdfplumber
 import os
 import re
+import time
 import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from config import BOOK_PATH  # Load from config
 
 # Define extracted text save path dynamically
 EXTRACTED_TEXT_PATH = os.path.join(os.path.dirname(BOOK_PATH), "extracted_text_cleaned.txt")
 
-def extract_text(pdf_path, save_path=None, skip_first_n_pages=2):
+PAGES_PER_TASK = 8  # Pages extracted per worker task
+
+# === Text Cleaning Rules (precompiled) ===
+RE_EXTRA_SPACES = re.compile(r"\s{2,}")
+RE_PAGE_NUMBER = re.compile(r"^\d+\s*$")  # Standalone numbers (page numbers)
+RE_NUMBERED_HEADING = re.compile(r"^\d+\..*")  # Numbered headings
+RE_METADATA = re.compile(r"(PENGUIN BOOKS|Copyright|All rights reserved|References|Appendix|Contents|Preface|Acknowledgements)",
+                         re.IGNORECASE)  # Unwanted metadata
+RE_BROKEN_HYPHEN = re.compile(r"(\w+)[\u00AD-]\n?(\w+)")  # Hyphenated words broken across lines
+RE_SPACED_HYPHEN = re.compile(r"(\w+)- (\w+)")
+RE_SECTION_TITLE = re.compile(r"^(CHAPTER|SECTION|PART|APPENDIX)", re.IGNORECASE)
+
+# Line events produced per page and merged into paragraphs in page order
+TITLE, LINE, BREAK = "title", "line", "break"
+
+
+def clean_page_lines(text):
+    """
+    Applies the cleaning rules to one page of text.
+
+    Returns a list of (event, text) pairs: TITLE for section titles, LINE for
+    paragraph text and BREAK for blank lines. Paragraphs are assembled from
+    these later, so paragraphs spanning page (and worker) boundaries are
+    joined correctly.
+    """
+    events = []
+    for line in text.split("\n"):
+        line = unicodedata.normalize("NFKC", line.strip())  # Normalize Unicode
+        line = RE_EXTRA_SPACES.sub(" ", line)  # Remove extra spaces
+
+        if RE_PAGE_NUMBER.match(line) or RE_NUMBERED_HEADING.match(line) or RE_METADATA.search(line):
+            continue
+
+        # Fix hyphenated words broken across lines
+        line = RE_BROKEN_HYPHEN.sub(r"\1\2", line)
+        line = RE_SPACED_HYPHEN.sub(r"\1\2", line)
+
+        if RE_SECTION_TITLE.match(line):
+            events.append((TITLE, line.upper()))
+        elif line.endswith("-"):
+            events.append((LINE, line[:-1]))  # Remove hyphen, append
+        elif line:
+            events.append((LINE, line))
+        else:
+            events.append((BREAK, ""))
+    return events
+
+
+def _extract_pages(pdf_path, page_numbers):
+    """
+    Worker task: extracts and cleans a range of pages.
+
+    Each page is isolated, so a page that fails to parse is reported with
+    its error instead of aborting the run. Returns a list of
+    (page_number, events, seconds, error).
+    """
+    results = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_num in page_numbers:
+            start = time.perf_counter()
+            try:
+                text = pdf.pages[page_num - 1].extract_text()
+                events = clean_page_lines(text) if text else []
+                results.append((page_num, events, time.perf_counter() - start, None))
+            except Exception as e:
+                results.append((page_num, [], time.perf_counter() - start, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def iter_pages(pdf_path, skip_first_n_pages=2, workers=None, pages_per_task=PAGES_PER_TASK):
+    """
+    Yields (page_number, events, seconds, error) for every page, in page order.
+
+    Page ranges are extracted in a process pool, with a bounded number of
+    tasks in flight so memory stays flat for large books. workers=1 extracts
+    in-process.
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+    print(f"📄 PDF Loaded Successfully: {pdf_path} ({page_count} pages)")
+
+    page_numbers = list(range(skip_first_n_pages + 1, page_count + 1))
+    tasks = [page_numbers[i:i + pages_per_task] for i in range(0, len(page_numbers), pages_per_task)]
+
+    if workers == 1:
+        for task in tasks:
+            yield from _extract_pages(pdf_path, task)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = workers * 2
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_extract_pages, pdf_path, task))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def iter_paragraphs(pages, stats=None):
+    """
+    Merges page events into paragraphs and section titles, in order.
+
+    Section titles are yielded as "\\n\\nTITLE\\n", matching the original
+    single-process output. If stats is a dict, per-page timings and
+    failures are recorded in it.
+    """
+    current_paragraph = []
+    for page_num, events, seconds, error in pages:
+        if stats is not None:
+            stats.setdefault("page_seconds", []).append((page_num, seconds))
+            if error:
+                stats.setdefault("failed_pages", []).append((page_num, error))
+        if error:
+            print(f"⚠️ Skipping page {page_num}: {error}")
+
+        for event, line in events:
+            if event == TITLE:
+                if current_paragraph:
+                    yield " ".join(current_paragraph)
+                    current_paragraph = []
+                yield "\n\n" + line + "\n"
+            elif event == LINE:
+                current_paragraph.append(line)
+            elif current_paragraph:
+                yield " ".join(current_paragraph)
+                current_paragraph = []  # Reset buffer
+
+    # Append remaining paragraph
+    if current_paragraph:
+        yield " ".join(current_paragraph)
+
+
+def summarize_stats(stats):
+    """One-line summary of per-page extraction timings and failures."""
+    timings = stats.get("page_seconds", [])
+    if not timings:
+        return "No pages extracted."
+    total = sum(seconds for _, seconds in timings)
+    slowest_page, slowest = max(timings, key=lambda item: item[1])
+    return (f"{len(timings)} pages, {total:.1f}s in workers, {1000 * total / len(timings):.1f} ms/page avg, "
+            f"slowest page {slowest_page} ({1000 * slowest:.0f} ms), {len(stats.get('failed_pages', []))} failed")
+
+
+def extract_to_file(pdf_path, save_path, skip_first_n_pages=2, workers=None, pages_per_task=PAGES_PER_TASK):
+    """
+    Extracts and cleans text from a PDF, streaming it to save_path as pages finish.
+
+    Returns a stats dict with per-page timings and failed pages, or None if
+    the PDF could not be read.
+    """
+    if not os.path.exists(pdf_path):
+        print(f"❌ Error: PDF file not found at {pdf_path}")
+        return None
+
+    stats = {}
+    try:
+        pages = iter_pages(pdf_path, skip_first_n_pages, workers, pages_per_task)
+        with open(save_path, "w", encoding="utf-8") as file:
+            for i, paragraph in enumerate(iter_paragraphs(pages, stats)):
+                if i:
+                    file.write("\n\n")
+                file.write(paragraph)
+        print(f"✅ Text Extraction Completed Successfully: {summarize_stats(stats)}")
+        print(f"📂 Cleaned extracted text saved to: {save_path}")
+    except Exception as e:
+        print(f"❌ Error reading PDF: {e}")
+        return None
+
+    return stats
+
+
+def extract_text(pdf_path, save_path=None, skip_first_n_pages=2, workers=None, pages_per_task=PAGES_PER_TASK):
     """
     Extracts and cleans text from a PDF file using pdfplumber.
 
@@ -15,94 +192,40 @@ def extract_text(pdf_path, save_path=None, skip_first_n_pages=2):
         pdf_path (str): Path of the PDF file.
         save_path (str, optional): Path to save extracted text. Defaults to None.
         skip_first_n_pages (int): Number of initial pages to skip.
+        workers (int, optional): Extraction processes. Defaults to one per CPU.
+        pages_per_task (int): Pages handed to a worker at a time.
 
     Returns:
         str: Cleaned extracted text from the PDF.
     """
+    if save_path:
+        if extract_to_file(pdf_path, save_path, skip_first_n_pages, workers, pages_per_task) is None:
+            return ""
+        with open(save_path, "r", encoding="utf-8") as file:
+            return file.read()
+
     if not os.path.exists(pdf_path):
         print(f"❌ Error: PDF file not found at {pdf_path}")
         return ""
 
-    extracted_text = []
-    current_paragraph = []
-
+    stats = {}
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            print(f"📄 PDF Loaded Successfully: {pdf_path}")
-
-            for page_num, page in enumerate(pdf.pages, start=1):
-                if page_num <= skip_first_n_pages:
-                    continue  # Skip unwanted pages
-
-                text = page.extract_text()
-                if not text:
-                    continue
-
-                lines = text.split("\n")
-
-                for line in lines:
-                    line = unicodedata.normalize("NFKC", line.strip())  # Normalize Unicode
-                    line = re.sub(r"\s{2,}", " ", line)  # Remove extra spaces
-
-                    # === Text Cleaning Rules ===
-                    if re.match(r"^\d+\s*$", line):  # Skip standalone numbers (page numbers)
-                        continue
-                    if re.match(r"^\d+\..*", line):  # Skip numbered headings
-                        continue  
-                    if re.search(r"(PENGUIN BOOKS|Copyright|All rights reserved|References|Appendix|Contents|Preface|Acknowledgements)", 
-                                 line, re.IGNORECASE):  # Skip unwanted metadata
-                        continue
-
-                    # Fix hyphenated words broken across lines
-                    line = re.sub(r"(\w+)[\u00AD-]\n?(\w+)", r"\1\2", line)  
-                    line = re.sub(r"(\w+)- (\w+)", r"\1\2", line)  
-
-                    # Handle section titles
-                    if re.match(r"^(CHAPTER|SECTION|PART|APPENDIX)", line, re.IGNORECASE):
-                        if current_paragraph:
-                            extracted_text.append(" ".join(current_paragraph))
-                            current_paragraph = []
-                        extracted_text.append("\n\n" + line.upper() + "\n")
-                        continue
-
-                    # Manage paragraph structure
-                    if line.endswith("-"):  
-                        current_paragraph.append(line[:-1])  # Remove hyphen, append
-                    elif line:  
-                        current_paragraph.append(line)
-                    else:  
-                        if current_paragraph:
-                            extracted_text.append(" ".join(current_paragraph))
-                            current_paragraph = []  # Reset buffer
-
-            # Append remaining paragraph
-            if current_paragraph:
-                extracted_text.append(" ".join(current_paragraph))
-
-        print(f"✅ Text Extraction Completed Successfully.")
-
+        pages = iter_pages(pdf_path, skip_first_n_pages, workers, pages_per_task)
+        final_text = "\n\n".join(iter_paragraphs(pages, stats))
+        print(f"✅ Text Extraction Completed Successfully: {summarize_stats(stats)}")
     except Exception as e:
         print(f"❌ Error reading PDF: {e}")
         return ""
 
-    final_text = "\n\n".join(extracted_text)
-
-    # Save cleaned text
-    if save_path:
-        try:
-            with open(save_path, "w", encoding="utf-8") as file:
-                file.write(final_text)
-            print(f"📂 Cleaned extracted text saved to: {save_path}")
-        except Exception as e:
-            print(f"❌ Error saving text to file: {e}")
-
     return final_text
 
 
 # ✅ Testing the function
 if __name__ == "__main__":
-    text = extract_text(BOOK_PATH, EXTRACTED_TEXT_PATH)
+    if extract_to_file(BOOK_PATH, EXTRACTED_TEXT_PATH) is None:
+        raise SystemExit(1)
 
     # Print first 1000 characters for verification
     print("\n🔍 Sample Extracted Text (First 1000 characters):\n")
-    print(text[:1000])
+    with open(EXTRACTED_TEXT_PATH, "r", encoding="utf-8") as file:
+        print(file.read(1000))
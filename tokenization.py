@@ -1,6 +1,8 @@
 import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
+from nltk.tokenize import sent_tokenize
 import os
+from collections import deque
+from config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, CHUNK_TOKENIZER_MODEL
 
 # Ensure NLTK tokenizer is available
 try:
@@ -8,6 +10,11 @@ try:
 except LookupError:
     nltk.download("punkt")
 
+TOKENIZE_BATCH_SIZE = 1024  # Sentences per tokenizer call
+MIN_CHUNK_TOKENS = 10  # Chunks this short or shorter are dropped
+
+_tokenizers = {}
+
 def load_text(file_path):
     """Load text from a file with error handling."""
     if not os.path.exists(file_path):
@@ -21,40 +28,102 @@ def load_text(file_path):
 
     return text
 
-def tokenize_and_chunk(text, chunk_size=256, overlap=50):
-    """
-    Tokenizes text into sentences and groups them into chunks.
-    Maintains overlap between chunks for better context retention.
-    """
-    sentences = sent_tokenize(text)  # Sentence tokenization
-    chunks = []
-    current_chunk = []
-    current_length = 0
-
-    for i, sentence in enumerate(sentences):
-        words = word_tokenize(sentence)  # Proper word tokenization
-        sentence_length = len(words)
-
-        # If adding this sentence exceeds chunk size, save current chunk
-        if current_length + sentence_length > chunk_size:
-            chunks.append(" ".join(current_chunk))  # Store current chunk
-            
-            # Ensure overlap is sentence-based, not just word-based
-            if len(current_chunk) >= overlap:
-                current_chunk = current_chunk[-overlap:]  # Retain only last `overlap` sentences
-            else:
-                current_chunk = []  # If too small, start fresh
+def load_tokenizer(name=CHUNK_TOKENIZER_MODEL):
+    """Load (once) the fast tokenizer chunk lengths are measured with."""
+    if name not in _tokenizers:
+        from transformers import AutoTokenizer
 
-            current_length = sum(len(word_tokenize(s)) for s in current_chunk)  # Reset length
+        tokenizer = AutoTokenizer.from_pretrained(name, use_fast=True)
+        if not tokenizer.is_fast:
+            raise ValueError(f"❌ {name} has no fast tokenizer, which the chunker needs for batching and offsets")
+        _tokenizers[name] = tokenizer
+    return _tokenizers[name]
 
-        current_chunk.append(sentence)
-        current_length += sentence_length
+def token_counts(sentences, tokenizer):
+    """Count subword tokens (without special tokens) of a batch of sentences in one tokenizer call."""
+    encoded = tokenizer(list(sentences), add_special_tokens=False,
+                        return_attention_mask=False, return_token_type_ids=False)
+    return [len(ids) for ids in encoded["input_ids"]]
 
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))  # Add last chunk
+def split_long_sentence(sentence, tokenizer, max_tokens):
+    """
+    Splits a sentence longer than max_tokens into pieces that each fit.
 
-    # Filter out empty or very short chunks
-    return [chunk for chunk in chunks if len(word_tokenize(chunk)) > 10]
+    Pieces are cut at the start of a word where possible, so every piece
+    tokenizes to the same tokens it had inside the sentence.
+    Returns [(piece, token_count)].
+    """
+    offsets = tokenizer(sentence, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    pieces = []
+    start = 0
+    while len(offsets) - start > max_tokens:
+        cut = start + max_tokens
+        # Walk back to a token preceded by whitespace (a word start), unless the word fills the whole piece
+        while cut > start + 1 and offsets[cut][0] == offsets[cut - 1][1]:
+            cut -= 1
+        if cut == start + 1:
+            cut = start + max_tokens
+        pieces.append((sentence[offsets[start][0]:offsets[cut - 1][1]].strip(), cut - start))
+        start = cut
+    pieces.append((sentence[offsets[start][0]:].strip(), len(offsets) - start))
+    return pieces
+
+def _counted_sentences(sentences, tokenizer, max_tokens, batch_size):
+    """Yields (sentence, token_count) with counts computed one batch at a time; long sentences are split."""
+    batch = []
+
+    def flush():
+        for sentence, count in zip(batch, token_counts(batch, tokenizer)):
+            if count > max_tokens:
+                yield from split_long_sentence(sentence, tokenizer, max_tokens)
+            elif count:
+                yield sentence, count
+
+    for sentence in sentences:
+        batch.append(sentence)
+        if len(batch) >= batch_size:
+            yield from flush()
+            batch = []
+    if batch:
+        yield from flush()
+
+def iter_chunks(sentences, chunk_size=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS, tokenizer=None,
+                batch_size=TOKENIZE_BATCH_SIZE):
+    """
+    Groups a stream of sentences into chunks, yielding each chunk as soon as it is complete.
+
+    chunk_size and overlap are in subword tokens of the embedding model, and
+    chunk_size is capped at its encoder window, so chunks are never truncated
+    when embedded. Every sentence is tokenized once. A window of sentences
+    with a running token count then slides over the stream, so the work is
+    linear in the text. Each new chunk starts with the trailing sentences of
+    the previous one, up to overlap tokens, for better context retention.
+    """
+    tokenizer = tokenizer or load_tokenizer()
+    chunk_size = min(chunk_size, CHUNK_MAX_TOKENS)
+    window = deque()  # (sentence, token_count) of the chunk being built
+    window_tokens = 0
+
+    for sentence, count in _counted_sentences(sentences, tokenizer, chunk_size, batch_size):
+        # If adding this sentence exceeds chunk size, emit the current chunk and keep only the overlap
+        if window_tokens + count > chunk_size and window:
+            if window_tokens > MIN_CHUNK_TOKENS:  # Filter out very short chunks
+                yield " ".join(s for s, _ in window)
+            while window and (window_tokens > overlap or window_tokens + count > chunk_size):
+                window_tokens -= window.popleft()[1]
+
+        window.append((sentence, count))
+        window_tokens += count
+
+    if window_tokens > MIN_CHUNK_TOKENS:
+        yield " ".join(s for s, _ in window)  # Add last chunk
+
+def tokenize_and_chunk(text, chunk_size=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS, tokenizer=None):
+    """
+    Tokenizes text into sentences and groups them into chunks.
+    Maintains overlap between chunks for better context retention.
+    """
+    return list(iter_chunks(sent_tokenize(text), chunk_size, overlap, tokenizer))
 
 def save_chunks(chunks, output_path):
     """Save tokenized and chunked text into a file (overwrite if exists)."""
@@ -71,15 +140,16 @@ if __name__ == "__main__":
         text = load_text(input_file)
 
         print("🔍 Tokenizing and chunking text...")
-        chunks = tokenize_and_chunk(text, chunk_size=256)
+        tokenizer = load_tokenizer()
+        chunks = tokenize_and_chunk(text, tokenizer=tokenizer)
 
         print("💾 Saving tokenized chunks...")
         save_chunks(chunks, output_file)
 
         print(f"✅ Tokenized chunks saved to: {output_file}")
         print(f"📊 Total Chunks Created: {len(chunks)}")
-        avg_size = sum(len(word_tokenize(chunk)) for chunk in chunks) / len(chunks)
-        print(f"📏 Average Chunk Size: {avg_size:.2f} words")
+        sizes = token_counts(chunks, tokenizer)
+        print(f"📏 Average Chunk Size: {sum(sizes) / len(sizes):.2f} tokens (max {max(sizes)}, limit {CHUNK_MAX_TOKENS})")
 
         # Show a sample chunk for verification
         print("\n🔎 Sample Tokenized Chunks (First 3):")
@@ -0,0 +1,54 @@
+import numpy as np
+
+# Vector helpers shared by index building and query time, kept free of faiss so serving processes import it cheaply
+DEFAULT_METRIC = "ip"
+DEFAULT_RERANK_FACTOR = 4  # Candidates re-scored exactly per requested result when vectors are quantized
+
+
+def normalize(vectors):
+    """Float32, C-contiguous, L2-normalized copy of vectors (rows of zeros stay zero)."""
+    vectors = np.array(vectors, dtype=np.float32, order="C", copy=True)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def prepare_vectors(vectors, metric=DEFAULT_METRIC):
+    """Vectors in the form an index of this metric stores and is queried with."""
+    if metric == "ip":
+        return normalize(vectors)
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def index_metric(meta):
+    """Metric of a stored index (indexes built before metrics were recorded use L2)."""
+    return meta.get("build_params", {}).get("metric", "l2")
+
+
+def rerank_exact(queries, labels, vectors, lookup, k, metric=DEFAULT_METRIC):
+    """
+    Re-scores candidate labels with full-precision vectors and keeps the best k.
+
+    vectors holds the stored (float32) rows and lookup (a chunks.ChunkIdLookup)
+    maps labels to rows; only candidate rows are read, so vectors can be a
+    memory map. Returns (scores, labels), higher scores better, padded with
+    -inf / -1 where a query has fewer than k valid candidates.
+    """
+    queries = prepare_vectors(queries, metric)
+    n, candidates = labels.shape
+    rows = lookup.positions(labels.ravel()).reshape(n, candidates)
+    valid = rows >= 0
+
+    candidate_vectors = np.zeros((n, candidates, queries.shape[1]), dtype=np.float32)
+    candidate_vectors[valid] = vectors[rows[valid]]
+    if metric == "ip":
+        candidate_vectors = prepare_vectors(candidate_vectors.reshape(-1, queries.shape[1]), metric).reshape(n, candidates, -1)
+        scores = np.einsum("nkd,nd->nk", candidate_vectors, queries)
+    else:
+        scores = -np.linalg.norm(candidate_vectors - queries[:, None, :], axis=2)
+    scores[~valid] = -np.inf
+
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    top_scores = np.take_along_axis(scores, order, axis=1)
+    top_labels = np.where(np.isfinite(top_scores), np.take_along_axis(labels, order, axis=1), -1)
+    return top_scores, top_labels